@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import re
+import uuid
+import pandas as pd
+import pyarrow.parquet as pq
+from fact_writer import read_fact, fact_dataset
+
+# ==========================================
+# 📊 彙總層 (Aggregation Tables)
+# ==========================================
+# Fact_Sales 是交易粒度，報表每個視覺效果都要掃整張表。這裡先算好月 / 季粒度的彙總表，
+# 報表頁面只需讀幾千列：
+# - 只掃一次 Fact_Sales：先彙總到 (月, 產品, 經銷商, 客戶) 基礎粒度，各彙總表再由它 roll up
+#   (基礎粒度含 Customer_Key，不重複客戶數才算得正確)
+# - TMDL 表定義也由同一份規格產生 (python aggregations.py --tmdl)，欄位改了不必手動對齊 Power BI
+# - 彙總表是給報表「直接查詢」的獨立表，不設定 alternateOf (Power BI 自動改查彙總表只在明細表為
+#   DirectQuery 時生效，這裡的 Fact_Sales 是 Import)；用法寫在產生的 TMDL 表說明 (///) 裡
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+BASE_PATH = os.path.dirname(current_dir)
+BI_FOLDER = os.path.join(BASE_PATH, "02_ProcessedData", "BI_Tables")
+MODEL_FOLDER = os.path.join(BASE_PATH, "05_Dashboards", "eCCP_Business_Analysis.SemanticModel", "definition")
+# Power BI 端讀取 Parquet 的路徑 (與其他資料表的 partition 相同)
+PBI_SOURCE_FOLDER = r"C:\Users\rich\我的雲端硬碟\eCCP\02_ProcessedData\BI_Tables"
+
+MEASURE_COLS = ['ResExt', 'Qty', 'CstExt']
+
+# 彙總表名稱 -> 分組欄位
+AGG_TABLES = {
+    'Agg_Sales_Month_Product_Group': ['Month_Start', 'Product Group'],
+    'Agg_Sales_Month_Distributor': ['Month_Start', 'Distributor_Key'],
+    'Agg_Sales_Quarter_Parent_Group': ['Quarter_Start', 'Parent_Group'],
+}
+
+# 彙總表欄位 -> 關聯到的維度欄位 (TMDL relationship)
+AGG_RELATIONSHIPS = {
+    'Month_Start': 'Dim_Date.Date',
+    'Quarter_Start': 'Dim_Date.Date',
+    'Distributor_Key': 'Dim_Distributor.Distributor_Key',
+}
+
+FACT_COLS = ['POS_ShpDate', 'Product_Key', 'Distributor_Key', 'Customer_Key'] + MEASURE_COLS
+# SCD2 (create_star_schema.SCD_MODE) 時 Fact_Sales 另有版本 Key，產品群 / 集團取交易當時的版本
+VERSION_KEYS = {'Product_Key': 'Product_Version_Key', 'Customer_Key': 'Customer_Version_Key'}
+
+def build_base_grain(fact):
+    """ 唯一一次掃 Fact_Sales：彙總到 (月, Product_Key, Distributor_Key, Customer_Key [, 版本 Key]) """
+    month = fact['POS_ShpDate'].to_numpy().astype('datetime64[M]').astype('datetime64[ns]')
+    keys = ['Product_Key', 'Distributor_Key', 'Customer_Key'] + [v for v in VERSION_KEYS.values() if v in fact.columns]
+    grouped = fact[keys + MEASURE_COLS].assign(Month_Start=month)
+    base = grouped.groupby(['Month_Start'] + keys, sort=False, dropna=False).agg(
+        **{col: (col, 'sum') for col in MEASURE_COLS},
+        Transactions=('ResExt', 'size'),
+    )
+    return base.reset_index()
+
+def lookup(base, dim, key, attr):
+    """ 以版本 Key (兩邊都有時) 或自然鍵 Key 對應維度屬性；SCD 表只用自然鍵時取目前版本 """
+    if attr not in dim.columns:
+        return pd.Series(None, index=base.index, dtype=object)
+    version = VERSION_KEYS[key]
+    if version in base.columns and version in dim.columns:
+        key = version
+    elif 'Is_Current' in dim.columns:
+        dim = dim[dim['Is_Current']]
+    return base[key].map(dim.drop_duplicates(key).set_index(key)[attr])
+
+def attach_attributes(base, dim_product, dim_cust):
+    """ 基礎粒度 (列數遠少於交易) 再補上產品群、集團、季 """
+    base = base.copy()
+    base['Product Group'] = lookup(base, dim_product, 'Product_Key', 'Product Group').fillna('Unknown').astype(str)
+    base['Parent_Group'] = lookup(base, dim_cust, 'Customer_Key', 'Parent_Group').fillna('UNKNOWN').astype(str)
+    base['Quarter_Start'] = base['Month_Start'].dt.to_period('Q').dt.start_time
+    return base
+
+def rollup(base, group_cols):
+    agg = base.groupby(group_cols, sort=True, dropna=False).agg(
+        **{col: (col, 'sum') for col in MEASURE_COLS},
+        Transactions=('Transactions', 'sum'),
+        Customer_Count=('Customer_Key', 'nunique'),
+    )
+    return agg.reset_index()
+
+def build_aggregations(fact, dim_product, dim_cust):
+    """ [主流程] 回傳 {彙總表名稱: DataFrame} """
+    base = attach_attributes(build_base_grain(fact), dim_product, dim_cust)
+    return {name: rollup(base, cols) for name, cols in AGG_TABLES.items()}
+
+def write_aggregations(bi_folder=BI_FOLDER, fact=None, dim_product=None, dim_cust=None):
+    """ 由 BI_Tables 的 Fact_Sales / Dim_Product / Dim_Customer 產生彙總表，回傳總列數
+    fact / dim_product / dim_cust 已在記憶體時 (同一個 process 剛建好) 直接使用，不再讀檔 """
+    if fact is None:
+        names = fact_dataset(bi_folder).schema.names
+        fact = read_fact(bi_folder, columns=FACT_COLS + [v for v in VERSION_KEYS.values() if v in names])
+    if dim_product is None:
+        dim_product = pd.read_parquet(os.path.join(bi_folder, "Dim_Product.parquet"))
+    if dim_cust is None:
+        cust_file = os.path.join(bi_folder, "Dim_Customer.parquet")
+        names = pq.read_schema(cust_file).names
+        dim_cust = pd.read_parquet(cust_file, columns=[c for c in ['Customer_Key', 'Customer_Version_Key', 'Parent_Group',
+                                                                   'Is_Current'] if c in names])
+    tables = build_aggregations(fact, dim_product, dim_cust)
+    for name, table in tables.items():
+        table.to_parquet(os.path.join(bi_folder, f"{name}.parquet"), index=False)
+    return sum(len(t) for t in tables.values())
+
+# ==========================================
+# 📐 TMDL 產生器
+# ==========================================
+# lineageTag 以 uuid5(表名.欄名) 產生，重跑結果不變，git diff 才看得出真正的變化。
+# TMDL 檔案一律 CRLF (與 Power BI Desktop 存檔一致)。
+
+LINEAGE_NAMESPACE = uuid.UUID('6b1c3a52-0d6e-4a0f-9a57-2f1f5b6e0c11')
+
+def lineage_tag(*names):
+    return str(uuid.uuid5(LINEAGE_NAMESPACE, ".".join(names)))
+
+def tmdl_name(name):
+    return f"'{name}'" if re.search(r"[^0-9A-Za-z_]", name) else name
+
+def tmdl_column(table, name, kind):
+    """ kind: date / key / string / bool / sum_int / sum_double / double (比率等不可加總的數值) """
+    lines = [f"\tcolumn {tmdl_name(name)}"]
+    lines += {
+        'date': ["\t\tdataType: dateTime", "\t\tformatString: General Date"],
+        'key': ["\t\tdataType: int64", "\t\tformatString: 0"],
+        'string': ["\t\tdataType: string"],
+        'bool': ["\t\tdataType: boolean", '\t\tformatString: """TRUE"";""TRUE"";""FALSE"""'],
+        'sum_int': ["\t\tdataType: int64", "\t\tformatString: 0"],
+        'sum_double': ["\t\tdataType: double"],
+        'double': ["\t\tdataType: double"],
+    }[kind]
+    lines += [f"\t\tlineageTag: {lineage_tag(table, name)}",
+              f"\t\tsummarizeBy: {'sum' if kind.startswith('sum') else 'none'}",
+              f"\t\tsourceColumn: {name}",
+              "",
+              "\t\tannotation SummarizationSetBy = Automatic",
+              ""]
+    if kind in ('sum_double', 'double'):
+        lines += ['\t\tannotation PBI_FormatHint = {"isGeneralNumber":true}', ""]
+    return lines
+
+def column_kind(name):
+    if name.endswith('_Start'):
+        return 'date'
+    if name.endswith('_Key'):
+        return 'key'
+    if name in MEASURE_COLS:
+        return 'sum_double'
+    if name in ('Transactions', 'Customer_Count'):
+        return 'sum_int'
+    return 'string'
+
+def tmdl_table(name, columns, kind=column_kind, description=None):
+    """ description: 表說明 (TMDL 的 /// 註解，Power BI 欄位清單滑鼠移上去會顯示) """
+    lines = [f"/// {line}" for line in (description or "").splitlines()]
+    lines += [f"table {name}", f"\tlineageTag: {lineage_tag(name)}", ""]
+    for col in columns:
+        lines += tmdl_column(name, col, kind(col))
+    lines += [f"\tpartition {name} = m",
+              "\t\tmode: import",
+              "\t\tsource =",
+              "\t\t\t\tlet",
+              f'\t\t\t\t    來源 = Parquet.Document(File.Contents("{PBI_SOURCE_FOLDER}\\{name}.parquet"), '
+              "[Compression=null, LegacyColumnNameEncoding=false, MaxDepth=null])",
+              "\t\t\t\tin",
+              "\t\t\t\t    來源",
+              "",
+              "\tannotation PBI_ResultType = Table",
+              "",
+              ""]
+    return "\n".join(lines)
+
+def read_tmdl(path):
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        return f.read().replace('\r\n', '\n')
+
+def write_tmdl(path, text):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write(text.replace('\n', '\r\n'))
+
+def agg_description(group_cols):
+    return (f"Fact_Sales 依 {' / '.join(group_cols)} 預先彙總 (aggregations.py 產生，請勿手動修改)。\n"
+            "未設定 alternateOf：Fact_Sales 為 Import 模式，Power BI 不會自動改查本表，"
+            "報表頁面的視覺效果與量值請直接使用本表的欄位。\n"
+            "Customer_Count 是該列的不重複客戶數，跨列加總會重複計算。")
+
+def add_model_refs(names, model_folder=MODEL_FOLDER):
+    """ model.tmdl 補上新表的 ref table 與 PBI_QueryOrder (已存在則略過) """
+    model_path = os.path.join(model_folder, "model.tmdl")
+    model = read_tmdl(model_path)
+    order_match = re.search(r"annotation PBI_QueryOrder = (\[.*\])", model)
+    order = json.loads(order_match.group(1))
+    new_order = order + [n for n in names if n not in order]
+    model = model.replace(order_match.group(1), json.dumps(new_order, ensure_ascii=False, separators=(',', ':')))
+    refs = re.findall(r"^ref table (.+)$", model, flags=re.M)
+    missing = "".join(f"ref table {n}\n" for n in names if n not in refs)
+    model = model.replace(f"ref table {refs[-1]}\n", f"ref table {refs[-1]}\n{missing}", 1)
+    write_tmdl(model_path, model)
+
+def export_tmdl(model_folder=MODEL_FOLDER):
+    """ 產生彙總表的 .tmdl，並補上 model.tmdl 的 ref 與 relationships.tmdl 的關聯 (已存在則略過) """
+    for name, group_cols in AGG_TABLES.items():
+        columns = group_cols + MEASURE_COLS + ['Transactions', 'Customer_Count']
+        write_tmdl(os.path.join(model_folder, "tables", f"{name}.tmdl"),
+                   tmdl_table(name, columns, description=agg_description(group_cols)))
+    add_model_refs(list(AGG_TABLES), model_folder)
+
+    rel_path = os.path.join(model_folder, "relationships.tmdl")
+    relationships = read_tmdl(rel_path)
+    for name, group_cols in AGG_TABLES.items():
+        for col in group_cols:
+            if col not in AGG_RELATIONSHIPS:
+                continue
+            from_col = f"{name}.{tmdl_name(col)}"
+            if f"fromColumn: {from_col}\n" in relationships:
+                continue
+            relationships += (f"relationship {lineage_tag(name, col, 'relationship')}\n"
+                              f"\tfromColumn: {from_col}\n"
+                              f"\ttoColumn: {AGG_RELATIONSHIPS[col]}\n\n")
+    write_tmdl(rel_path, relationships)
+    print(f"   ✅ 已產生 {len(AGG_TABLES)} 個彙總表的 TMDL: {model_folder}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="產生彙總表 / TMDL 定義")
+    parser.add_argument('--tmdl', action='store_true', help="只產生 TMDL 表定義")
+    args = parser.parse_args()
+    if args.tmdl:
+        export_tmdl()
+    else:
+        print(f"   ✅ 彙總表共 {write_aggregations():,} 列")
@@ -0,0 +1,112 @@
+import asyncio
+import random
+import time
+
+# ==========================================
+# ⚡ 非同步批次分類引擎 (Async LLM Classifier)
+# ==========================================
+# - 同時最多 concurrency 個批次在飛，速度只受 API 額度 (RPM) 限制
+# - Token bucket 控制每分鐘請求數；遇到 429 自動降速，成功後慢慢回升
+# - 429 / 暫時性錯誤採指數退避 + jitter 重試，不再一次 429 就整輪離線
+# - client 可替換：Gemini、或本機假 LLM server (測試 / benchmark 用)
+
+class RateLimitError(Exception):
+    """ 額度用盡 (HTTP 429)，自訂 client 遇到時請拋出這個例外 """
+
+class TokenBucket:
+    """ [限流] 每分鐘 rate_per_min 個 token，最多累積 capacity 個 """
+
+    def __init__(self, rate_per_min, capacity=None):
+        self.max_rate = rate_per_min / 60.0
+        self.rate = self.max_rate
+        self.capacity = capacity or max(1, int(rate_per_min // 10))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def slow_down(self):
+        """ 收到 429：速率減半 (最低為原本的 1/8) """
+        self.rate = max(self.max_rate / 8, self.rate / 2)
+
+    def speed_up(self):
+        """ 成功一次：速率回升 10%，不超過設定值 """
+        self.rate = min(self.max_rate, self.rate * 1.1)
+
+def backoff_delay(attempt, base=2.0, cap=60.0):
+    """ 指數退避 + full jitter (避免所有批次同時重試) """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+async def classify_batches(batches, client, concurrency=4, rate_per_min=15, max_retries=5,
+                           rate_limit_errors=(RateLimitError,), on_result=None, on_call=None):
+    """ [主流程] 非同步分類所有批次
+    client: async 函式 (names_list) -> {name: {'Category': ..., 'Group': ...}}
+    rate_limit_errors: 代表額度用盡的例外 (例如 google.api_core.exceptions.ResourceExhausted)
+    on_result: 每批成功時立即呼叫 on_result(batch, result) (例如寫入快取)
+    on_call: 每次 API 呼叫結束時呼叫 on_call(延遲秒數, error)，error 為 None / 'rate_limit' / 例外類別名稱 (例如記錄指標)
+    回傳與 batches 同順序的結果 list；重試仍失敗的批次回傳 None (與「成功但判斷不出來」的 {} 區分，
+    呼叫端不應寫入任何結果，下次再重試) """
+    bucket = TokenBucket(rate_per_min)
+    semaphore = asyncio.Semaphore(concurrency)
+    total = len(batches)
+    done = 0
+
+    async def run_one(idx, batch):
+        nonlocal done
+        async with semaphore:
+            for attempt in range(max_retries + 1):
+                await bucket.acquire()
+                t0 = time.perf_counter()
+                try:
+                    result = await client(batch)
+                    if on_call is not None:
+                        on_call(time.perf_counter() - t0, None)
+                    bucket.speed_up()
+                    if on_result is not None:
+                        on_result(batch, result)
+                    done += 1
+                    print(f"     Batch {idx + 1}/{total} (AI) ✅ [{done}/{total}]")
+                    return result
+                except rate_limit_errors:
+                    if on_call is not None:
+                        on_call(time.perf_counter() - t0, 'rate_limit')
+                    bucket.slow_down()
+                    reason = "額度用盡 (429)"
+                except Exception as e:
+                    if on_call is not None:
+                        on_call(time.perf_counter() - t0, type(e).__name__)
+                    reason = f"API 錯誤: {e}"
+                if attempt < max_retries:
+                    delay = backoff_delay(attempt)
+                    print(f"     ⚠️ Batch {idx + 1} {reason}，{delay:.1f}s 後重試 ({attempt + 1}/{max_retries})")
+                    await asyncio.sleep(delay)
+            done += 1
+            print(f"     ⚠️ Batch {idx + 1} 重試 {max_retries} 次仍失敗，下次再試")
+            return None
+
+    return await asyncio.gather(*(run_one(i, b) for i, b in enumerate(batches)))
+
+def http_llm_client(url, parse_response, build_prompt, timeout=60.0):
+    """ [可替換 client] 呼叫 HTTP LLM 服務 (例如本機假 server)
+    POST {"prompt": ...} -> {"text": ...}；HTTP 429 視為額度用盡 """
+    import httpx
+
+    async def client(names_list):
+        async with httpx.AsyncClient(timeout=timeout) as http:
+            resp = await http.post(url, json={'prompt': build_prompt(names_list)})
+        if resp.status_code == 429:
+            raise RateLimitError(resp.text)
+        resp.raise_for_status()
+        return parse_response(resp.json()['text'])
+
+    return client
@@ -0,0 +1,203 @@
+import argparse
+import asyncio
+import functools
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import etl_metrics
+from etl_metrics import peak_rss_bytes
+from synthetic_pos import generate_pos, N_CUSTOMERS, N_PRODUCTS, N_DISTRIBUTORS
+
+# ==========================================
+# 🏁 全流程效能基準 (合成資料，完全離線)
+# ==========================================
+# 用法: python benchmark_pipeline.py                      (預設 1M / 10M / 50M 筆)
+#       python benchmark_pipeline.py 1000000 --update-baseline   (把這次結果存成基準)
+# 流程: synthetic_pos 產生 CSV (同參數只產生一次) -> clean_data (串流) -> create_star_schema (平行)
+#       -> generate_mapping (假 LLM，不連網) -> rfm_analysis
+# - 每個階段在獨立的子行程執行，peak RSS 就是該階段自己的記憶體高峰 (不受前一階段影響)
+# - 結果附加到 results.jsonl；與 baseline.json 比較，時間或記憶體超過 REGRESSION_THRESHOLD 即視為退步，
+#   結束碼為 1 (可直接放進 CI / 排程)
+# - 所有輸出 (CSV、Parquet、帳本、快取、各階段的 etl_metrics.jsonl) 都在 BENCH_FOLDER，
+#   不會動到正式的 02_ProcessedData / 99_Config 帳本；Prometheus textfile 不輸出
+# - generate_mapping 用假 LLM，不需要安裝 Gemini SDK
+# 注意: 50M 筆的 CSV 約 10 GB，清洗與建表需要數十 GB 記憶體，請在 ETL 主機上執行
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+BASE_PATH = os.path.dirname(current_dir)
+BENCH_FOLDER = os.path.join(BASE_PATH, "02_ProcessedData", "_benchmark")
+RESULTS_FILE = "results.jsonl"
+BASELINE_FILE = "baseline.json"    # 基準與機器有關，放在 BENCH_FOLDER 不進版控
+
+STAGES = ['clean_data', 'create_star_schema', 'generate_mapping', 'rfm_analysis']
+REGRESSION_THRESHOLD = 0.20        # 比基準慢 / 多用 20% 以上即失敗
+MIN_SECONDS = 1.0                  # 基準低於此秒數的階段不比時間 (雜訊太大)
+FAKE_LLM_LATENCY = 0.02            # 假 LLM 每批回應秒數
+FAKE_LLM_CATEGORIES = ['OEM', 'SI', 'EMS', 'Distributor', 'Uncategorized']
+
+def bench_paths(rows, folder=BENCH_FOLDER):
+    base = os.path.join(folder, str(rows))
+    return {
+        'base': base,
+        'processed': os.path.join(base, "processed"),
+        'bi': os.path.join(base, "processed", "BI_Tables"),
+        'ledger': os.path.join(base, "Customer_Parent_Mapping.parquet"),
+        'excel': os.path.join(base, "Customer_Parent_Mapping.xlsx"),   # 不存在 = 沒有人工修改
+        'cache': os.path.join(base, "classification_cache.sqlite"),
+        'metrics': os.path.join(base, "_metrics"),
+    }
+
+def fake_llm_client(latency=FAKE_LLM_LATENCY):
+    """ [可替換 client] 不連網的假 LLM：依名稱 hash 給固定分類，模擬 API 延遲 """
+    async def client(names_list):
+        await asyncio.sleep(latency)
+        result = {}
+        for name in names_list:
+            h = int(hashlib.md5(name.encode('utf-8')).hexdigest(), 16)
+            result[name] = {'Category': FAKE_LLM_CATEGORIES[h % len(FAKE_LLM_CATEGORIES)],
+                            'Group': name.split()[0] if name.split() else name}
+        return result
+    return client
+
+def use_bench_metrics(module, paths):
+    """ 階段模組的指標改寫到 BENCH_FOLDER (MetricsRun 的預設資料夾在 import 時就綁定，模組內的參照也要換掉) """
+    etl_metrics.METRICS_FOLDER = paths['metrics']
+    etl_metrics.PROMETHEUS_FOLDER = None
+    module.MetricsRun = functools.partial(etl_metrics.MetricsRun, metrics_folder=paths['metrics'],
+                                          prometheus_folder=None)
+    return module
+
+def run_stage(stage, csv_path, paths):
+    """ [子行程] 執行單一階段，回傳牆鐘 / CPU 時間與本行程的 peak RSS """
+    t0, cpu0 = time.perf_counter(), time.process_time()
+    if stage == 'clean_data':
+        import clean_data
+        use_bench_metrics(clean_data, paths).clean_and_transform(csv_path, paths['processed'], stream=True,
+                                                                 incremental=False)
+    elif stage == 'create_star_schema':
+        import create_star_schema
+        use_bench_metrics(create_star_schema, paths).create_star_schema(
+            os.path.join(paths['processed'], "POS_Cleaned.parquet"), paths['bi'],
+            config_file=paths['excel'], ledger_file=paths['ledger'], incremental=False, parallel=True)
+    elif stage == 'generate_mapping':
+        import generate_mapping
+        use_bench_metrics(generate_mapping, paths)
+        # 每次從空帳本 / 空快取開始，所有客戶都走完硬規則 -> 模糊比對 -> AI 的完整路徑
+        for path in (paths['ledger'], paths['cache']):
+            if os.path.exists(path):
+                os.remove(path)
+        generate_mapping.GEMINI_RPM = 1_000_000
+        generate_mapping.EXPORT_EXCEL = False
+        t0, cpu0 = time.perf_counter(), time.process_time()
+        generate_mapping.run_detective(fake_llm_client(), os.path.join(paths['bi'], "Dim_Customer.parquet"),
+                                       paths['ledger'], paths['excel'], paths['cache'])
+    elif stage == 'rfm_analysis':
+        import rfm_analysis
+        # 刪掉上次的累計基底，每次都是全量計算
+        for name in (rfm_analysis.RFM_STATE_FILE, rfm_analysis.RFM_BASE_FILE):
+            if os.path.exists(os.path.join(paths['bi'], name)):
+                os.remove(os.path.join(paths['bi'], name))
+        t0, cpu0 = time.perf_counter(), time.process_time()
+        rfm_analysis.run_rfm(bi_folder=paths['bi'])
+    else:
+        raise ValueError(f"未知的階段: {stage}")
+    return {'wall_sec': round(time.perf_counter() - t0, 3), 'cpu_sec': round(time.process_time() - cpu0, 3),
+            'peak_rss_bytes': peak_rss_bytes()}
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def check_regression(result, base, threshold=REGRESSION_THRESHOLD, min_seconds=MIN_SECONDS):
+    """ 回傳退步原因 list (空 list = 通過) """
+    problems = []
+    if base.get('wall_sec', 0) >= min_seconds and result['wall_sec'] > base['wall_sec'] * (1 + threshold):
+        problems.append(f"時間 {base['wall_sec']:.2f}s -> {result['wall_sec']:.2f}s")
+    if base.get('peak_rss_bytes') and result['peak_rss_bytes'] \
+            and result['peak_rss_bytes'] > base['peak_rss_bytes'] * (1 + threshold):
+        problems.append(f"記憶體 {base['peak_rss_bytes'] / 1024 ** 2:,.0f} MB -> {result['peak_rss_bytes'] / 1024 ** 2:,.0f} MB")
+    return problems
+
+def run_benchmark(sizes, seed=42, n_customers=N_CUSTOMERS, n_products=N_PRODUCTS, n_distributors=N_DISTRIBUTORS,
+                  stages=STAGES, bench_folder=BENCH_FOLDER, update_baseline=False, threshold=REGRESSION_THRESHOLD):
+    """ [主流程] 回傳是否有階段退步 """
+    os.makedirs(bench_folder, exist_ok=True)
+    baseline_path = os.path.join(bench_folder, BASELINE_FILE)
+    baseline = load_baseline(baseline_path)
+    run_id = time.strftime('%Y%m%dT%H%M%S')
+    results, regressions = [], []
+
+    for rows in sizes:
+        paths = bench_paths(rows, bench_folder)
+        csv_path = os.path.join(paths['base'], f"POS_{seed}_{n_customers}_{n_products}_{n_distributors}.csv")
+        if not os.path.exists(csv_path):
+            generate_pos(rows, csv_path, seed, n_customers, n_products, n_distributors)
+        if 'clean_data' in stages and os.path.isdir(paths['processed']):
+            shutil.rmtree(paths['processed'])
+
+        for stage in stages:
+            print(f"\n🏁 [Benchmark] {rows:,} 筆 - {stage}")
+            # 每個階段一個全新的 spawn 子行程，peak RSS 互不影響
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                result = pool.submit(run_stage, stage, csv_path, paths).result()
+            key = f"{rows}:{stage}"
+            problems = check_regression(result, baseline[key], threshold) if key in baseline else []
+            if problems:
+                regressions.append((key, problems))
+            results.append({'run_id': run_id, 'rows': rows, 'stage': stage, 'seed': seed,
+                            'customers': n_customers, 'products': n_products, **result,
+                            'baseline_wall_sec': baseline.get(key, {}).get('wall_sec'),
+                            'regression': problems})
+
+    with open(os.path.join(bench_folder, RESULTS_FILE), 'a', encoding='utf-8') as f:
+        for rec in results:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+
+    print("\n🏁 [Benchmark] 全流程")
+    print(f"   {'Rows':>12} | {'Stage':<20} | {'Wall (s)':>9} | {'CPU (s)':>9} | {'Peak RSS':>10} | {'vs 基準':>8}")
+    print("   " + "-" * 84)
+    for rec in results:
+        rss = f"{rec['peak_rss_bytes'] / 1024 ** 2:,.0f} MB" if rec['peak_rss_bytes'] else "-"
+        ratio = f"{rec['wall_sec'] / rec['baseline_wall_sec']:.2f}x" if rec['baseline_wall_sec'] else "-"
+        flag = " ❌" if rec['regression'] else ""
+        print(f"   {rec['rows']:>12,} | {rec['stage']:<20} | {rec['wall_sec']:>9.2f} | {rec['cpu_sec']:>9.2f} | "
+              f"{rss:>10} | {ratio:>8}{flag}")
+
+    if update_baseline:
+        for rec in results:
+            baseline[f"{rec['rows']}:{rec['stage']}"] = {k: rec[k] for k in ('wall_sec', 'cpu_sec', 'peak_rss_bytes')}
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2)
+        print(f"\n💾 已更新基準: {baseline_path}")
+    elif regressions:
+        print(f"\n❌ {len(regressions)} 個階段退步超過 {threshold:.0%}:")
+        for key, problems in regressions:
+            print(f"   - {key}: {'; '.join(problems)}")
+        return False
+    elif not baseline:
+        print("\n💡 尚無基準，請加上 --update-baseline 儲存本次結果")
+    else:
+        print("\n✅ 沒有階段退步")
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="全流程效能基準 (合成 POS 資料)")
+    parser.add_argument('sizes', nargs='*', type=int, default=[1_000_000, 10_000_000, 50_000_000])
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--customers', type=int, default=N_CUSTOMERS)
+    parser.add_argument('--products', type=int, default=N_PRODUCTS)
+    parser.add_argument('--distributors', type=int, default=N_DISTRIBUTORS)
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args()
+    ok = run_benchmark(args.sizes, args.seed, args.customers, args.products, args.distributors, args.stages,
+                       update_baseline=args.update_baseline, threshold=args.threshold)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# ==========================================
+# 📅 日曆引擎 (Dim_Date)
+# ==========================================
+# Dim_Date 全部用整數運算 (datetime64 換算) 產生，不逐日呼叫 month_name / strftime：
+# - 文字欄 (月份名稱、YearQuarter...) 先算整數代碼，再用 Categorical 對應標籤 (Parquet 存成 dictionary)
+# - 研華財年 / 財季、ISO 週、工作日旗標，以及 yyyymmdd 整數 DateKey (關聯比 dateTime 便宜)
+# - 結果快取在磁碟 (_calendar_cache.parquet)，以「日曆設定」為 key；
+#   要的日期範圍在快取內就直接切片，範圍變大才重算 (重算時一併涵蓋舊範圍)
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+BASE_PATH = os.path.dirname(current_dir)
+
+# --- 日曆設定 (改了任何一項，快取都會自動失效) ---
+FISCAL_YEAR_START_MONTH = 1        # 研華財年與曆年相同 (1 月起)；若改為 4，則 2025/4 ~ 2026/3 為 FY2026
+WEEKEND_DAYS = [5, 6]              # 0=週一 ... 6=週日
+HOLIDAYS_FILE = os.path.join(BASE_PATH, "99_Config", "Holidays.csv")   # 選用，需有 Date 欄位；不存在則只排除週末
+DEFAULT_START = "2023-01-01"       # 沒有任何有效日期時的預設範圍
+DEFAULT_END = "2025-12-31"
+
+CALENDAR_CACHE_FILE = "_calendar_cache.parquet"   # 與 Dim_Date.parquet 同資料夾
+
+MONTH_NAMES = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+               'August', 'September', 'October', 'November', 'December']
+WEEKDAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+def load_holidays(holidays_file=HOLIDAYS_FILE):
+    if not holidays_file or not os.path.exists(holidays_file):
+        return np.array([], dtype='datetime64[D]')
+    dates = pd.to_datetime(pd.read_csv(holidays_file)['Date'], errors='coerce').dropna()
+    return np.unique(dates.to_numpy().astype('datetime64[D]'))
+
+def calendar_config(fiscal_start_month=FISCAL_YEAR_START_MONTH, weekend_days=WEEKEND_DAYS,
+                    holidays_file=HOLIDAYS_FILE):
+    """ 影響 Dim_Date 內容的所有設定 (含假日清單本身)，用來判斷快取是否可用 """
+    holidays = load_holidays(holidays_file)
+    return {
+        'fiscal_start_month': int(fiscal_start_month),
+        'weekend_days': sorted(int(d) for d in weekend_days),
+        'holidays_sha256': hashlib.sha256(holidays.astype('int64').tobytes()).hexdigest(),
+    }
+
+def config_key(config):
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+def year_bounds(min_year, max_year):
+    """ (最早年份, 最晚年份) -> 完整年度的起訖日；None 時用預設範圍 """
+    if min_year is None or max_year is None:
+        return pd.Timestamp(DEFAULT_START), pd.Timestamp(DEFAULT_END)
+    return pd.Timestamp(f"{min_year}-01-01"), pd.Timestamp(f"{max_year}-12-31")
+
+def labels(codes, categories):
+    """ 整數代碼 -> Categorical (只保留用到的標籤) """
+    return pd.Categorical.from_codes(codes, categories=categories).remove_unused_categories()
+
+def build_calendar(start, end, fiscal_start_month=FISCAL_YEAR_START_MONTH, weekend_days=WEEKEND_DAYS,
+                   holidays=None):
+    """ [計算] start ~ end (含) 每天一列，全部向量化整數運算 """
+    days = np.arange(np.datetime64(pd.Timestamp(start).date(), 'D'),
+                     np.datetime64(pd.Timestamp(end).date(), 'D') + 1)
+    months_since_epoch = days.astype('datetime64[M]').astype('int64')
+    year = months_since_epoch // 12 + 1970
+    month = months_since_epoch % 12 + 1
+    day = (days - days.astype('datetime64[M]')).astype('int64') + 1
+    quarter = (month - 1) // 3 + 1
+    weekday = (days.astype('int64') + 3) % 7          # 1970-01-01 是週四；0=週一
+
+    # ISO 週：該週週四所在的年份即 ISO 年
+    thursday = days - weekday + 3
+    iso_year = thursday.astype('datetime64[Y]').astype('int64') + 1970
+    iso_week = (thursday - thursday.astype('datetime64[Y]')).astype('int64') // 7 + 1
+
+    # 財年以「結束的那一年」命名；起始月為 1 時即曆年
+    fiscal_month = (month - fiscal_start_month) % 12 + 1
+    fiscal_year = year + (month >= fiscal_start_month).astype('int64') if fiscal_start_month != 1 else year
+    fiscal_quarter = (fiscal_month - 1) // 3 + 1
+
+    first_year = int(min(year.min(), fiscal_year.min()))
+    year_labels = range(first_year, int(max(year.max(), fiscal_year.max())) + 1)
+    quarter_codes = (year - first_year) * 4 + quarter - 1
+    fiscal_quarter_codes = (fiscal_year - first_year) * 4 + fiscal_quarter - 1
+    month_codes = (year - first_year) * 12 + month - 1
+
+    is_weekend = np.isin(weekday, weekend_days)
+    is_holiday = np.isin(days, holidays if holidays is not None else np.array([], dtype='datetime64[D]'))
+
+    dim_date = pd.DataFrame({
+        'Date': days.astype('datetime64[ns]'),
+        'DateKey': (year * 10000 + month * 100 + day).astype('int32'),
+        'Year': year,
+        'Month': month,
+        'Month_Name': labels(month - 1, MONTH_NAMES),
+        'Quarter': quarter,
+        'YearQuarter': labels(quarter_codes, [f"{y}-Q{q}" for y in year_labels for q in range(1, 5)]),
+        'YearMonth': labels(month_codes, [f"{y}-{m:02d}" for y in year_labels for m in range(1, 13)]),
+        'Day': day,
+        'Weekday': weekday + 1,                           # 1=週一 ... 7=週日 (ISO)
+        'Weekday_Name': labels(weekday, WEEKDAY_NAMES),
+        'ISO_Year': iso_year,
+        'ISO_Week': iso_week,
+        'Fiscal_Year': fiscal_year,
+        'Fiscal_Quarter': fiscal_quarter,
+        'Fiscal_Month': fiscal_month,
+        'Fiscal_YearQuarter': labels(fiscal_quarter_codes, [f"FY{y}-Q{q}" for y in year_labels for q in range(1, 5)]),
+        'Is_Weekend': is_weekend,
+        'Is_Holiday': is_holiday,
+        'Is_Working_Day': ~is_weekend & ~is_holiday,
+    })
+    return dim_date
+
+def date_key(dates):
+    """ datetime Series -> yyyymmdd 整數 (Int32，空值保留為 <NA>)，供 Fact 表關聯 Dim_Date.DateKey """
+    values = pd.to_datetime(dates).to_numpy()
+    nat = np.isnat(values)
+    months_since_epoch = values.astype('datetime64[M]').astype('int64')
+    day = (values.astype('datetime64[D]') - values.astype('datetime64[M]')).astype('int64') + 1
+    key = (months_since_epoch // 12 + 1970) * 10000 + (months_since_epoch % 12 + 1) * 100 + day
+    return pd.arrays.IntegerArray(np.where(nat, 0, key).astype('int32'), nat)
+
+def read_cache(cache_path, key):
+    """ 回傳 (快取的 Dim_Date, 起日, 迄日)；設定不同或不存在時回傳 (None, None, None) """
+    if not os.path.exists(cache_path):
+        return None, None, None
+    meta = pq.read_schema(cache_path).metadata or {}
+    if meta.get(b'calendar_key', b'').decode() != key:
+        return None, None, None
+    cached = pd.read_parquet(cache_path)
+    if cached.empty:
+        return None, None, None
+    return cached, cached['Date'].iloc[0], cached['Date'].iloc[-1]
+
+def write_cache(cache_path, dim_date, key):
+    table = pa.Table.from_pandas(dim_date, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'calendar_key': key.encode()})
+    tmp_path = cache_path + ".tmp"
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, cache_path)
+
+def slice_range(dim_date, start, end):
+    """ 切出 start ~ end，並移除沒用到的標籤 (結果與直接計算該範圍相同) """
+    window = dim_date[(dim_date['Date'] >= start) & (dim_date['Date'] <= end)].reset_index(drop=True)
+    for col in window.columns:
+        if isinstance(window[col].dtype, pd.CategoricalDtype):
+            window[col] = window[col].cat.remove_unused_categories()
+    return window
+
+def get_dim_date(min_year, max_year, cache_folder=None, fiscal_start_month=FISCAL_YEAR_START_MONTH,
+                 weekend_days=WEEKEND_DAYS, holidays_file=HOLIDAYS_FILE):
+    """ [主流程] 取得 min_year ~ max_year 的 Dim_Date；cache_folder 有給時先查磁碟快取 """
+    start, end = year_bounds(min_year, max_year)
+    config = calendar_config(fiscal_start_month, weekend_days, holidays_file)
+    key = config_key(config)
+    cache_path = os.path.join(cache_folder, CALENDAR_CACHE_FILE) if cache_folder else None
+
+    if cache_path:
+        cached, cached_start, cached_end = read_cache(cache_path, key)
+        if cached is not None:
+            if cached_start <= start and end <= cached_end:
+                print("   - ♻️ Dim_Date: 使用日曆快取")
+                return slice_range(cached, start, end)
+            # 範圍變大：重算聯集範圍，之後較小的範圍都能直接切片
+            start, end = min(start, cached_start), max(end, cached_end)
+
+    dim_date = build_calendar(start, end, fiscal_start_month, weekend_days, load_holidays(holidays_file))
+    if cache_path:
+        write_cache(cache_path, dim_date, key)
+    return slice_range(dim_date, *year_bounds(min_year, max_year))
@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# 🗂️ 類別欄位 (Dictionary-Encoded) 工具
+# ==========================================
+# 低基數欄位 (DistName、Product Group、Channel District...) 以 category 存放：
+# 每列只存整數 code，字串處理 (strip / upper / replace) 只對「不重複值」做一次，
+# 寫出 Parquet 時自動成為 dictionary 欄位，讀回來也還是 category。
+
+def map_distinct(series, func):
+    """ 對不重複值套用 func (Series -> Series 的向量化函式)，再用 codes 展開回整欄，結果為 category
+    空值也會當成一個值交給 func，行為與逐列 astype(str) 處理一致 """
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    mapped = func(pd.Series(np.asarray(uniques, dtype=object)))
+    # 不同原值可能對應到同一個新值 (例如 'abc ' 與 'abc')，再 factorize 一次合併；NaN 會成為 -1
+    new_codes, new_uniques = pd.factorize(mapped)
+    categorical = pd.Categorical.from_codes(new_codes[codes], categories=new_uniques)
+    return pd.Series(categorical, index=series.index, name=series.name)
+
+def to_plain(df):
+    """ 把 category 欄位轉回一般字串 (維度表資料量小，之後可自由 fillna / concat) """
+    cat_cols = [c for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)]
+    if cat_cols:
+        df = df.astype({c: object for c in cat_cols})
+    return df
@@ -0,0 +1,101 @@
+import re
+import sqlite3
+import time
+
+# ==========================================
+# 🗄️ 客戶分類快取 (SQLite)
+# ==========================================
+# Key 為「標準化客戶名稱」：ACME INC / ACME, INC. / Acme Inc  -> ACME INC
+# - 正向結果 (有分類) 永久保留，直到 model 或 prompt 版本改變才失效
+# - 負向結果 (AI 判斷不出來) 也記下來，TTL 到期前不再重問
+# - 每批 API 結果一回來就寫入，程式中斷也不會白做
+
+NEGATIVE_TTL_DAYS = 7
+
+def normalize_name(name):
+    """ 大寫、標點換成空白、合併連續空白 """
+    name = re.sub(r"[^0-9A-Z&]+", " ", str(name).upper())
+    return " ".join(name.split())
+
+class ClassificationCache:
+
+    def __init__(self, path, model, prompt_version, negative_ttl_days=NEGATIVE_TTL_DAYS):
+        self.model = model
+        self.prompt_version = prompt_version
+        self.negative_ttl = negative_ttl_days * 86400
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS classification (
+                norm_name TEXT PRIMARY KEY,
+                original_name TEXT,
+                category TEXT,
+                parent_group TEXT,
+                source TEXT,
+                model TEXT,
+                prompt_version TEXT,
+                is_negative INTEGER,
+                created_at REAL,
+                expires_at REAL
+            )""")
+        self.conn.commit()
+
+    def get_many(self, names):
+        """ 回傳 {原始名稱: {'Category', 'Parent_Group', 'Source', 'is_negative'}}，只含有效的快取 """
+        norm_map = {}
+        for name in names:
+            norm_map.setdefault(normalize_name(name), []).append(name)
+        hits = {}
+        norms = list(norm_map)
+        now = time.time()
+        for i in range(0, len(norms), 500):  # SQLite 參數上限
+            chunk = norms[i:i+500]
+            rows = self.conn.execute(
+                f"SELECT norm_name, category, parent_group, source, is_negative FROM classification "
+                f"WHERE norm_name IN ({','.join('?' * len(chunk))}) AND model = ? AND prompt_version = ? "
+                f"AND (expires_at IS NULL OR expires_at > ?)",
+                chunk + [self.model, self.prompt_version, now]).fetchall()
+            for norm, cat, group, source, is_negative in rows:
+                for name in norm_map[norm]:
+                    hits[name] = {'Category': cat, 'Parent_Group': group, 'Source': source,
+                                  'is_negative': bool(is_negative)}
+        return hits
+
+    def put_many(self, records):
+        """ records: [{'Original_CustName', 'Parent_Group', 'Category', 'Source'}]
+        Source 為 Check-Manually 或 Category 為 Uncategorized 的視為負向結果 (有 TTL) """
+        now = time.time()
+        rows = []
+        for r in records:
+            is_negative = r['Source'] == 'Check-Manually' or r['Category'] == 'Uncategorized'
+            rows.append((normalize_name(r['Original_CustName']), r['Original_CustName'], r['Category'],
+                         r['Parent_Group'], r['Source'], self.model, self.prompt_version, int(is_negative),
+                         now, now + self.negative_ttl if is_negative else None))
+        self.conn.executemany("INSERT OR REPLACE INTO classification VALUES (?,?,?,?,?,?,?,?,?,?)", rows)
+        self.conn.commit()
+
+    def evict(self):
+        """ 清除過期的負向結果，以及舊 model / prompt 版本的結果，回傳刪除筆數 """
+        cur = self.conn.execute(
+            "DELETE FROM classification WHERE (expires_at IS NOT NULL AND expires_at <= ?) "
+            "OR model != ? OR prompt_version != ?",
+            (time.time(), self.model, self.prompt_version))
+        self.conn.commit()
+        return cur.rowcount
+
+    def invalidate(self, names=None):
+        """ 手動失效：指定名稱，或不給參數清空全部 """
+        if names is None:
+            self.conn.execute("DELETE FROM classification")
+        else:
+            self.conn.executemany("DELETE FROM classification WHERE norm_name = ?",
+                                  [(normalize_name(n),) for n in names])
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,125 +1,527 @@
 import pandas as pd
 import os
 import numpy as np # 引入 numpy 處理空值
+import pyarrow as pa
+import pyarrow.parquet as pq
+import io
+import math
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from numeric_cleaner import clean_numeric_columns
+from categorical_ops import map_distinct
+from etl_state import file_sha256, load_state, save_state, append_parquet, copy_row_groups
+from etl_metrics import MetricsRun
+from quality_rules import QualityGate, load_quality_rules, QUALITY_RULES_FILE, QUARANTINE_FILE
 
 # --- 設定路徑 ---
 BASE_PATH = "/Users/rich/我的雲端硬碟/eCCP"
 RAW_DATA_PATH = os.path.join(BASE_PATH, "01_RawData", "POS_all.csv")
 PROCESSED_FOLDER = os.path.join(BASE_PATH, "02_ProcessedData")
+OUTPUT_FILE = "POS_Cleaned.parquet"
 
-# 確保輸出資料夾存在
-os.makedirs(PROCESSED_FOLDER, exist_ok=True)
+# --- 串流模式設定 ---
+# 大檔 (多年度 POS) 建議開啟：分批讀取 CSV，逐一寫入 Parquet row group，記憶體不隨檔案變大
+STREAM_MODE = False
+CHUNK_SIZE = 500_000  # 每批筆數 (同時也是 Parquet row group 大小)
 
-def clean_and_transform():
-    print("🚀 [ETL 啟動] V5.0 最終融合版...")
-    print(f"   - 讀取路徑: {RAW_DATA_PATH}")
-    
-    # 讀取 CSV
-    df = pd.read_csv(RAW_DATA_PATH, low_memory=False)
-    
+# --- 平行模式設定 ---
+# 字串清洗 (金額解析、strip、'nan' 取代、SBU 修復) 都是單核心：開啟後 CSV 依位元組切成多段 (邊界對齊換行)，
+# 在多個子行程各自清洗成 Parquet part，再依原始順序合併 (輸出與串流模式逐列相同)
+# 前提: 欄位值內沒有換行 (POS 匯出檔不含多行文字)
+PARALLEL_MODE = False
+MAX_WORKERS = os.cpu_count() or 1
+SHARD_BYTES = 128 * 1024 * 1024  # 每段大約的位元組數 (段數至少等於行程數，段越小負載越平均)
+
+# --- 增量模式設定 ---
+# 只清洗上次之後「附加在檔尾」的列，附加為新的 row group (一律走串流)，結果與全量重建逐列相同：
+# 狀態檔記錄已處理的位元組數 / 原始列數，以及當時整個檔案的 hash；前段 hash 相同才從該位元組接續讀，
+# 不看日期，所以同日、補登 (日期較舊)、日期為空的新列都會被處理
+# 前提: 匯出檔為 append-only (舊資料不變、新資料接在後面)；前段有改動或重新排序時自動全量重建
+INCREMENTAL_MODE = False
+STATE_FILE = "_clean_state.json"
+
+# --- 資料品質規則 ---
+# 依 99_Config/Quality_Rules.csv 在清洗同一輪檢查；Action = quarantine 的規則不合格時移到 POS_Quarantine.parquet
+# (附原因代碼)。預設規則全部為 warn，只計數不移除列
+QUALITY_MODE = True
+
+# --- 類別欄位模式 ---
+# 低基數欄位以 category (dictionary-encoded) 讀入與輸出：字串清洗只對不重複值做一次，記憶體大幅下降
+CATEGORICAL_MODE = False
+LOW_CARD_COLS = ['DistName', 'Product Group', 'Product Division', 'Group Roll-UP',
+                 'Channel District', 'CustSt', 'DIST TYPE', 'Channel Manager']
+
+# --- 欄位定義 ---
+MONEY_COLS = ['UnitCst', 'CstExt', 'UnitResale', 'ResExt']
+QTY_COLS = ['Qty']
+DATE_COL = 'POS_ShpDate'
+TEXT_COLS = ['DistName', 'CustName', 'Product Group', 'Product Division', 'Channel District']
+
+# Level 2 (Product Group) -> Level 1 (Group Roll-UP)
+L2_TO_L1_MAP = {
+    'Embedded Computing Group': 'EIoT',
+    'Embedded IoT': 'EIoT',
+    'Industrial Automation Group': 'IIoT',
+    'Industrial Cloud & Video Group': 'IIoT',
+    'Service IoT Group': 'SIoT',
+    'Advantech Service+ (AS+)': 'SIoT',
+    'Applied Computing Group': 'ACG'
+}
+
+# Level 3 (Division) -> Level 1 (Group Roll-UP) (備用)
+L3_TO_L1_MAP = {
+    'Edge AI Platform': 'EIoT',
+    'Industrial HMI': 'IIoT',
+    'Intelligent Systems': 'IIoT',
+    'Systems': 'IIoT'
+}
+
+def strip_text(s):
+    """ 去除前後空白，並把字串 'nan' / 'None' / 空字串轉回真正的空值 """
+    s = s.astype(str).str.strip()
+    return s.replace({'nan': np.nan, '': np.nan, 'None': np.nan})
+
+def is_categorical(s):
+    return isinstance(s.dtype, pd.CategoricalDtype)
+
+def add_timing(stats, step, t0):
+    """ 累計清洗子步驟耗時 (串流模式逐批累加)，回傳下一步的起點 """
+    now = time.perf_counter()
+    if stats is not None:
+        stats['timings'][step] = stats['timings'].get(step, 0.0) + now - t0
+    return now
+
+def clean_frame(df, stats=None, quality=None):
+    """ [核心清洗] 欄位標準化 + 數值/日期/文字清洗 + SBU 架構修復 (整批或單一 chunk 皆適用)
+    stats: 傳入時累計各數值欄位被補 0 的筆數與各子步驟耗時
+    quality: QualityGate，傳入時最後套用品質規則，回傳的 df 已移除被隔離的列 """
+    t = time.perf_counter()
     # 1. 欄位名稱標準化 (去除前後空白)
     df.columns = df.columns.str.strip()
-    print(f"   - 原始資料筆數: {len(df):,}")
-
-    # 2. 數值欄位清洗 (金額與數量)
-    # 定義要清洗的欄位
-    money_cols = ['UnitCst', 'CstExt', 'UnitResale', 'ResExt']
-    qty_cols = ['Qty']
-    
-    # 清洗金額 (去 $ , 空白)
-    for col in money_cols:
-        if col in df.columns:
-            df[col] = df[col].astype(str).str.replace('$', '', regex=False) \
-                                         .str.replace(',', '', regex=False) \
-                                         .str.strip()
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-            
-    # 清洗數量 (去 , 空白)
-    for col in qty_cols:
-        if col in df.columns:
-            df[col] = df[col].astype(str).str.replace(',', '', regex=False).str.strip()
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-            
-    print("   - ✅ 數值與金額欄位已標準化")
+
+    # 品質規則要記錄原始值：只保留原欄位的參照 (清洗會換成新欄位，不會複製資料)
+    raw_cols = MONEY_COLS + QTY_COLS + [DATE_COL]
+    raw = {col: df[col] for col in raw_cols if col in df.columns} if quality is not None else None
+    unparsable = {} if quality is not None else None
+
+    # 2. 數值欄位清洗 (金額與數量) - Arrow 向量化引擎，一次處理所有欄位
+    df, coerced = clean_numeric_columns(df, MONEY_COLS, QTY_COLS, masks=unparsable)
+    if stats is not None:
+        for col, n in coerced.items():
+            stats['coerced'][col] = stats['coerced'].get(col, 0) + n
+    t = add_timing(stats, 'numeric', t)
 
     # 3. 日期格式化
-    if 'POS_ShpDate' in df.columns:
-        df['POS_ShpDate'] = pd.to_datetime(df['POS_ShpDate'], errors='coerce')
-    print("   - ✅ 日期欄位已標準化")
+    if DATE_COL in df.columns:
+        df[DATE_COL] = pd.to_datetime(df[DATE_COL], errors='coerce')
+    t = add_timing(stats, 'dates', t)
 
-    # 4. 文字欄位去除雜質
-    text_cols = ['DistName', 'CustName', 'Product Group', 'Product Division', 'Channel District']
-    for col in text_cols:
+    # 4. 文字欄位去除雜質 (category 欄位只處理不重複值)
+    for col in TEXT_COLS:
         if col in df.columns:
-            df[col] = df[col].astype(str).str.strip()
-            # 把字串 'nan' 或空字串轉回真正的空值
-            df[col] = df[col].replace({'nan': np.nan, '': np.nan, 'None': np.nan})
+            df[col] = map_distinct(df[col], strip_text) if is_categorical(df[col]) else strip_text(df[col])
+    t = add_timing(stats, 'text', t)
 
     # 5. [核心商業邏輯] 產品階層修復 (Hierarchy Repair)
-    print("   - 🌳 正在執行 SBU 架構修復 (Level 1~4 Mapping)...")
-    
     # A. 名稱標準化 (SYS -> Systems)
     if 'Product Division' in df.columns:
-        df['Product Division'] = df['Product Division'].replace({'SYS': 'Systems'})
-
-    # B. Level 2 (Product Group) -> Level 1 (Group Roll-UP)
-    l2_to_l1_map = {
-        'Embedded Computing Group': 'EIoT',
-        'Embedded IoT': 'EIoT',
-        'Industrial Automation Group': 'IIoT',
-        'Industrial Cloud & Video Group': 'IIoT',
-        'Service IoT Group': 'SIoT',
-        'Advantech Service+ (AS+)': 'SIoT',
-        'Applied Computing Group': 'ACG'
-    }
-
-    # C. Level 3 (Division) -> Level 1 (Group Roll-UP) (備用)
-    l3_to_l1_map = {
-        'Edge AI Platform': 'EIoT',
-        'Industrial HMI': 'IIoT',
-        'Intelligent Systems': 'IIoT',
-        'Systems': 'IIoT'
-    }
+        sys_to_systems = lambda s: s.replace({'SYS': 'Systems'})
+        col = df['Product Division']
+        df['Product Division'] = map_distinct(col, sys_to_systems) if is_categorical(col) else sys_to_systems(col)
 
     # 執行修復
     if 'Group Roll-UP' in df.columns:
+        # category 欄位先轉回一般字串才能 fillna 新值，修復完再轉回 category
+        rollup_is_cat = is_categorical(df['Group Roll-UP'])
+        if rollup_is_cat:
+            df['Group Roll-UP'] = df['Group Roll-UP'].astype(object)
+
         # 先用 L2 補
         if 'Product Group' in df.columns:
-            df['Group Roll-UP'] = df['Group Roll-UP'].fillna(df['Product Group'].map(l2_to_l1_map))
-        
+            df['Group Roll-UP'] = df['Group Roll-UP'].fillna(df['Product Group'].map(L2_TO_L1_MAP))
+
         # 再用 L3 補
         if 'Product Division' in df.columns:
-            df['Group Roll-UP'] = df['Group Roll-UP'].fillna(df['Product Division'].map(l3_to_l1_map))
-            
+            df['Group Roll-UP'] = df['Group Roll-UP'].fillna(df['Product Division'].map(L3_TO_L1_MAP))
+
         # 剩下的填 Unknown
         df['Group Roll-UP'] = df['Group Roll-UP'].fillna('Unknown')
-        
-    print("   - ✅ SBU 架構修復完成")
-
-    # 6. 輸出為 Parquet (高效能格式)
-    output_file = "POS_Cleaned.parquet"
-    output_path = os.path.join(PROCESSED_FOLDER, output_file)
-    
-    # 儲存
-    df.to_parquet(output_path, index=False)
-    
-    print("\n" + "="*40)
-    print(f"✨ [ETL 完成] 資料已輸出為 Parquet")
-    print(f"📂 路徑: {output_path}")
-    print("="*40)
+        if rollup_is_cat:
+            df['Group Roll-UP'] = df['Group Roll-UP'].astype('category')
+    t = add_timing(stats, 'hierarchy', t)
 
-    # 7. [Cursor 貢獻] 資料品質快報
-    print("\n🔎 [資料品質驗證報告]")
-    print(f"   - 總業績 (ResExt): ${df['ResExt'].sum():,.2f}")
+    # 6. 品質規則 (整欄 mask)，不合格的列移到隔離區
+    if quality is not None:
+        df = quality.check(df, unparsable, raw)
+        add_timing(stats, 'quality', t)
+
+    return df
+
+def new_quality_stats():
+    """ [品質統計] 累計值 (串流模式下逐批累加，不需重讀整份資料) """
+    return {'rows': 0, 'source_rows': 0, 'resext_sum': 0.0, 'district_rows': 0, 'district_unknown': 0,
+            'max_ship_date': None, 'coerced': {}, 'timings': {}}
+
+def merge_quality_stats(stats, part):
+    """ [平行模式] 把一個 shard 的品質統計加總進 stats """
+    for key in ['rows', 'source_rows', 'resext_sum', 'district_rows', 'district_unknown']:
+        stats[key] += part[key]
+    if part['max_ship_date'] is not None and (stats['max_ship_date'] is None
+                                              or part['max_ship_date'] > stats['max_ship_date']):
+        stats['max_ship_date'] = part['max_ship_date']
+    for group in ['coerced', 'timings']:
+        for key, value in part[group].items():
+            stats[group][key] = stats[group].get(key, 0) + value
+    return stats
+
+def update_quality_stats(stats, df):
+    stats['rows'] += len(df)
+    if 'ResExt' in df.columns:
+        stats['resext_sum'] += float(df['ResExt'].sum())
     if 'Channel District' in df.columns:
-        unknown_pct = (df['Channel District'] == 'Unknown').mean() * 100
+        stats['district_rows'] += len(df)
+        stats['district_unknown'] += int((df['Channel District'] == 'Unknown').sum())
+    if DATE_COL in df.columns:
+        chunk_max = df[DATE_COL].max()
+        if pd.notna(chunk_max) and (stats['max_ship_date'] is None or chunk_max > stats['max_ship_date']):
+            stats['max_ship_date'] = chunk_max
+    return stats
+
+def print_quality_report(stats, preview_df):
+    """ [Cursor 貢獻] 資料品質快報 """
+    print("\n🔎 [資料品質驗證報告]")
+    print(f"   - 總業績 (ResExt): ${stats['resext_sum']:,.2f}")
+    if stats['district_rows'] > 0:
+        unknown_pct = stats['district_unknown'] / stats['district_rows'] * 100
         print(f"   - Channel District Unknown 佔比: {unknown_pct:.2f}%")
         if unknown_pct > 5: print("     ⚠️ 警告: 超過 5% 門檻，需注意！")
-    
+    for col, n in stats['coerced'].items():
+        if n > 0:
+            print(f"   - {col} 無法解析而補 0: {n:,} 筆")
+
     print("\n📸 前 3 筆資料預覽:")
     cols_to_show = ['POS_ShpDate', 'Group Roll-UP', 'Product Division', 'ResExt', 'Qty']
-    print(df[[c for c in cols_to_show if c in df.columns]].head(3).to_string(index=False))
+    print(preview_df[[c for c in cols_to_show if c in preview_df.columns]].head(3).to_string(index=False))
     print("="*40)
 
+def read_csv_dtypes(input_path, base_dtype=None, categorical=CATEGORICAL_MODE):
+    """ 組出 read_csv 的 dtype 設定：類別模式下低基數欄位直接讀成 category (原始欄名含空白也對得上) """
+    if not categorical:
+        return base_dtype
+    header = pd.read_csv(input_path, nrows=0).columns
+    dtypes = {raw: 'category' if raw.strip() in LOW_CARD_COLS else base_dtype for raw in header}
+    return {k: v for k, v in dtypes.items() if v is not None}
+
+def build_arrow_schema(df):
+    """ [串流模式] 固定輸出 schema，避免每個 chunk 推論出不同型別 """
+    fields = []
+    for col in df.columns:
+        if is_categorical(df[col]):
+            fields.append(pa.field(col, pa.dictionary(pa.int32(), pa.string())))
+        elif col in MONEY_COLS or col in QTY_COLS:
+            fields.append(pa.field(col, pa.float64()))
+        elif col == DATE_COL:
+            fields.append(pa.field(col, pa.timestamp('ns')))
+        else:
+            fields.append(pa.field(col, pa.string()))
+    return pa.schema(fields)
+
+def write_clean_chunks(reader, output_path, quality=None, row_offset=0, verbose=True):
+    """ 逐批清洗 read_csv 的 chunk 並寫入 output_path，回傳 (品質統計, 預覽資料)
+    row_offset: 這段之前已處理的原始列數 (增量 / 平行時讓 Source_Row 對應整個 CSV 的行號) """
+    stats = new_quality_stats()
+    preview_df = None
+    writer = None
+    schema = None
+    try:
+        for i, chunk in enumerate(reader, start=1):
+            stats['source_rows'] += len(chunk)
+            if row_offset:
+                chunk.index = chunk.index + row_offset
+            chunk = clean_frame(chunk, stats, quality)
+            if writer is None:
+                schema = build_arrow_schema(chunk)
+                writer = pq.ParquetWriter(output_path, schema)
+                preview_df = chunk.head(3)
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            update_quality_stats(stats, chunk)
+            if verbose:
+                print(f"     Chunk {i}: 累計 {stats['rows']:,} 筆")
+    finally:
+        if writer is not None:
+            writer.close()
+    return stats, preview_df
+
+class ByteRangeReader(io.RawIOBase):
+    """ 檔案 [start, end) 這段位元組，前面接上表頭：給 read_csv 邊讀邊解析，不必先把整段讀進記憶體 """
+
+    def __init__(self, path, header, start, end):
+        self.file = open(path, 'rb')
+        self.file.seek(start)
+        self.pending = memoryview(header)
+        self.remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if len(self.pending):
+            n = min(len(buffer), len(self.pending))
+            buffer[:n] = self.pending[:n]
+            self.pending = self.pending[n:]
+            return n
+        n = self.file.readinto(memoryview(buffer)[:min(len(buffer), self.remaining)]) if self.remaining > 0 else 0
+        self.remaining -= n
+        return n
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+def read_header(input_path):
+    """ 表頭那一行 (含換行) 的位元組 """
+    with open(input_path, 'rb') as f:
+        return f.readline()
+
+def stream_clean_to_parquet(input_path, output_path, chunk_size=CHUNK_SIZE, start=None, row_offset=0,
+                            categorical=CATEGORICAL_MODE, quality=None, workers=1):
+    """ [串流模式] 分批讀 CSV -> 清洗 -> 逐一寫入 row group，回傳 (品質統計, 預覽資料)
+    start: 從這個位元組 (某一行開頭) 讀到檔尾 (增量模式)；row_offset 為前面已處理的原始列數
+    workers > 1 時改走平行模式 """
+    if workers > 1:
+        return parallel_clean_to_parquet(input_path, output_path, chunk_size, start, row_offset, categorical,
+                                         quality, workers)
+    # 全部以字串讀入：每個 chunk 型別一致，清洗後再由 schema 決定輸出型別
+    dtype = read_csv_dtypes(input_path, str, categorical)
+    if start is None:
+        with pd.read_csv(input_path, dtype=dtype, chunksize=chunk_size) as reader:
+            return write_clean_chunks(reader, output_path, quality, row_offset)
+    with io.BufferedReader(ByteRangeReader(input_path, read_header(input_path), start,
+                                           os.path.getsize(input_path))) as source:
+        with pd.read_csv(source, dtype=dtype, chunksize=chunk_size) as reader:
+            return write_clean_chunks(reader, output_path, quality, row_offset)
+
+def shard_ranges(input_path, n_shards, start=None):
+    """ [平行模式] 表頭之後 (或從 start 位元組起) 依位元組均分成 n_shards 段，邊界往後推到下一行開頭，
+    回傳 (表頭 bytes, [(start, end)]) """
+    size = os.path.getsize(input_path)
+    with open(input_path, 'rb') as f:
+        header = f.readline()
+        bounds = [f.tell() if start is None else start]
+        body = size - bounds[0]
+        for k in range(1, n_shards):
+            f.seek(max(bounds[0] + body * k // n_shards, bounds[-1]))
+            f.readline()          # 跳過被切到的那一行 (歸前一段)
+            bounds.append(f.tell())
+        bounds.append(size)
+    return header, [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+def clean_shard(input_path, header, start, end, part_path, dtype, chunk_size, rules):
+    """ [平行模式子行程] 清洗一段位元組 (前面接上表頭) 並寫成 part 檔；邊讀邊解析，記憶體只有一個 chunk
+    回傳 (品質統計, 預覽資料, QualityGate)；Source_Row 為段內行號，由主行程補上位移 """
+    gate = QualityGate(rules) if rules is not None else None
+    with io.BufferedReader(ByteRangeReader(input_path, header, start, end)) as source:
+        with pd.read_csv(source, dtype=dtype, chunksize=chunk_size) as reader:
+            stats, preview_df = write_clean_chunks(reader, part_path, gate, verbose=False)
+    return stats, preview_df, gate
+
+def parallel_clean_to_parquet(input_path, output_path, chunk_size=CHUNK_SIZE, start=None, row_offset=0,
+                              categorical=CATEGORICAL_MODE, quality=None, workers=MAX_WORKERS,
+                              shard_bytes=SHARD_BYTES):
+    """ [平行模式] 各段在子行程清洗成 part 檔，主行程依原始順序把 part 的 row group 接進輸出檔並加總品質統計
+    (前面的段一完成就先搬，合併與後面的段同時進行)，回傳 (品質統計, 預覽資料) """
+    n_shards = max(workers, math.ceil(os.path.getsize(input_path) / shard_bytes))
+    header, ranges = shard_ranges(input_path, n_shards, start)
+    dtype = read_csv_dtypes(input_path, str, categorical)
+    rules = quality.rules if quality is not None else None
+    part_paths = [f"{output_path}.part{i:05d}" for i in range(len(ranges))]
+    tmp_path = output_path + ".tmp"
+    stats = new_quality_stats()
+    preview_df = None
+    writer = None
+    rows_read = row_offset
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(clean_shard, input_path, header, lo, hi, part_path, dtype, chunk_size, rules)
+                       for (lo, hi), part_path in zip(ranges, part_paths)]
+            # 依段的順序收結果 (不是完成順序)：Source_Row 位移與輸出順序都固定
+            for i, (future, part_path) in enumerate(zip(futures, part_paths), start=1):
+                shard_stats, shard_preview, shard_gate = future.result()
+                merge_quality_stats(stats, shard_stats)
+                if quality is not None:
+                    quality.merge(shard_gate, rows_read)
+                rows_read += shard_stats['source_rows']
+                if shard_preview is not None:
+                    if writer is None:
+                        writer = pq.ParquetWriter(tmp_path, pq.ParquetFile(part_path).schema_arrow)
+                        preview_df = shard_preview
+                    copy_row_groups(part_path, writer)
+                    os.remove(part_path)
+                print(f"     Shard {i}/{len(futures)}: 累計 {stats['rows']:,} 筆")
+        if writer is not None:
+            writer.close()
+            writer = None
+            os.replace(tmp_path, output_path)
+    finally:
+        if writer is not None:
+            writer.close()
+        for path in part_paths + [tmp_path]:
+            if os.path.exists(path):
+                os.remove(path)
+    return stats, preview_df
+
+def appended_start(input_path, state, source_name):
+    """ 上次處理到的位元組 (某一行開頭)；檔案不是「前段不變、只在檔尾附加」時回傳 None (需全量重建) """
+    consumed = state.get('source_bytes')
+    if consumed is None or state.get('source_rows') is None or source_name not in state.get('sources', {}):
+        return None
+    if os.path.getsize(input_path) < consumed:
+        return None
+    with open(input_path, 'rb') as f:
+        f.seek(max(consumed - 1, 0))
+        if consumed and f.read(1) != b'\n':      # 上次最後一行沒有換行，新資料可能接在同一行
+            return None
+    if file_sha256(input_path, limit=consumed) != state['sources'][source_name]:
+        return None
+    return consumed
+
+def incremental_clean_to_parquet(input_path, output_path, state_path, chunk_size=CHUNK_SIZE,
+                                 categorical=CATEGORICAL_MODE, quality=None, workers=1):
+    """ [增量模式] 只清洗上次之後附加在檔尾的列並附加到既有 Parquet，回傳 (品質統計, 預覽資料)
+    來源檔 hash 未變時回傳 (None, None) """
+    state = load_state(state_path)
+    source_name = os.path.basename(input_path)
+    source_hash = file_sha256(input_path)
+    has_output = bool(state) and os.path.exists(output_path)
+
+    if has_output and state.get('sources', {}).get(source_name) == source_hash:
+        print("   - ✅ 來源檔內容未變 (hash 相同)，略過清洗")
+        return None, None
+    start = appended_start(input_path, state, source_name) if has_output else None
+    if start is None:
+        if state:
+            print("   - 📌 來源檔前段有變動 (不是只在檔尾附加)，改為全量 (串流) 重建...")
+        else:
+            print("   - 📌 尚無狀態檔，先做一次全量 (串流) 建置...")
+        # 舊的隔離資料屬於上一次建置，重建時不能再附加上去
+        quarantine_path = os.path.join(os.path.dirname(output_path), QUARANTINE_FILE)
+        if os.path.exists(quarantine_path):
+            os.remove(quarantine_path)
+        stats, preview_df = stream_clean_to_parquet(input_path, output_path, chunk_size, categorical=categorical,
+                                                    quality=quality, workers=workers)
+        state = {'build_id': uuid.uuid4().hex, 'sources': {}, 'max_ship_date': None, 'rows': 0, 'source_rows': 0}
+    else:
+        print(f"   - 📌 從第 {state['source_rows'] + 2:,} 行 (位元組 {start:,}) 接續讀取新附加的資料")
+        delta_path = output_path + ".delta"
+        stats, preview_df = stream_clean_to_parquet(input_path, delta_path, chunk_size, start=start,
+                                                    row_offset=state['source_rows'], categorical=categorical,
+                                                    quality=quality, workers=workers)
+        if preview_df is not None:
+            append_parquet(output_path, delta_path)
+            os.remove(delta_path)
+        print(f"   - ➕ 新增 {stats['rows']:,} 筆 (附加為新的 row group)")
+
+    # 記錄最大出貨日 (只往前推，不會倒退；僅供參考，增量判斷不再依賴日期)
+    if stats['max_ship_date'] is not None:
+        old_mark = pd.Timestamp(state['max_ship_date']) if state.get('max_ship_date') else None
+        if old_mark is None or stats['max_ship_date'] > old_mark:
+            state['max_ship_date'] = stats['max_ship_date'].isoformat()
+    state['rows'] = state.get('rows', 0) + stats['rows']
+    state['source_rows'] = state.get('source_rows', 0) + stats['source_rows']
+    state['source_bytes'] = os.path.getsize(input_path)
+    state['sources'] = {source_name: source_hash}
+    save_state(state_path, state)
+    return stats, preview_df
+
+def clean_and_transform(input_path=RAW_DATA_PATH, output_folder=PROCESSED_FOLDER,
+                        stream=STREAM_MODE, chunk_size=CHUNK_SIZE, incremental=INCREMENTAL_MODE,
+                        categorical=CATEGORICAL_MODE, quality=QUALITY_MODE, quality_rules_file=QUALITY_RULES_FILE,
+                        parallel=PARALLEL_MODE, max_workers=MAX_WORKERS):
+    print("🚀 [ETL 啟動] V5.1 串流版...")
+    print(f"   - 讀取路徑: {input_path}")
+
+    # 確保輸出資料夾存在
+    os.makedirs(output_folder, exist_ok=True)
+    output_path = os.path.join(output_folder, OUTPUT_FILE)
+    state_path = os.path.join(output_folder, STATE_FILE)
+
+    metrics = MetricsRun('clean_data')
+    gate = QualityGate(load_quality_rules(quality_rules_file)) if quality else None
+    workers = max_workers if parallel else 1
+    if incremental:
+        print("   - 📈 增量模式...")
+        with metrics.stage('incremental_clean', inputs=[input_path]) as rec:
+            stats, preview_df = incremental_clean_to_parquet(input_path, output_path, state_path, chunk_size,
+                                                             categorical, gate, workers)
+            if stats is not None:
+                rec['rows_out'] = stats['rows']
+                rec['extra']['substep_sec'] = stats['timings']
+        if stats is None:
+            return
+        if preview_df is None:
+            print("✨ 沒有新附加的資料，POS_Cleaned.parquet 維持不變。")
+            return
+    elif stream or parallel:
+        # 串流模式：記憶體只保留一個 chunk (平行模式為每個行程一段原始位元組 + 一個 chunk)
+        if parallel:
+            print(f"   - ⚡ 平行模式 ({workers} 個行程，每批 {chunk_size:,} 筆)...")
+        else:
+            print(f"   - 🌊 串流模式 (每批 {chunk_size:,} 筆)...")
+        stage = 'parallel_clean' if parallel else 'stream_clean'
+        with metrics.stage(stage, inputs=[input_path], outputs=[output_path]) as rec:
+            stats, preview_df = stream_clean_to_parquet(input_path, output_path, chunk_size, categorical=categorical,
+                                                        quality=gate, workers=workers)
+            rec['rows_out'] = stats['rows']
+            rec['extra']['substep_sec'] = stats['timings']
+        if preview_df is None:
+            print("❌ 錯誤: CSV 沒有任何資料")
+            return
+        print(f"   - 原始資料筆數: {stats['rows'] + (gate.quarantined_rows if gate else 0):,}")
+        print("   - ✅ 數值/日期/文字清洗與 SBU 架構修復完成")
+    else:
+        # 讀取 CSV
+        with metrics.stage('read_csv', inputs=[input_path]) as rec:
+            df = pd.read_csv(input_path, low_memory=False, dtype=read_csv_dtypes(input_path, categorical=categorical))
+            rec['rows_out'] = len(df)
+        print(f"   - 原始資料筆數: {len(df):,}")
+
+        print("   - 🌳 正在執行清洗與 SBU 架構修復 (Level 1~4 Mapping)...")
+        stats = new_quality_stats()
+        with metrics.stage('clean_frame', rows_in=len(df)) as rec:
+            df = clean_frame(df, stats, gate)
+            rec['rows_out'] = len(df)
+            rec['extra']['substep_sec'] = stats['timings']
+        print("   - ✅ 數值/日期/文字清洗與 SBU 架構修復完成")
+
+        # 6. 輸出為 Parquet (高效能格式)
+        with metrics.stage('write_parquet', rows_in=len(df), outputs=[output_path]) as rec:
+            df.to_parquet(output_path, index=False)
+            rec['rows_out'] = len(df)
+        update_quality_stats(stats, df)
+        preview_df = df.head(3)
+
+    if gate is not None:
+        quarantine_path = os.path.join(output_folder, QUARANTINE_FILE)
+        with metrics.stage('quality', rows_in=gate.rows_checked, outputs=[quarantine_path]) as rec:
+            gate.write(output_folder, os.path.basename(input_path), append=incremental)
+            rec['rows_out'] = gate.quarantined_rows
+            rec['extra']['rule_failures'] = gate.failed
+
+    if not incremental and os.path.exists(state_path):
+        # 全量重建後舊的增量狀態失效，下次增量會重新建立
+        os.remove(state_path)
+
+    print("\n" + "="*40)
+    print(f"✨ [ETL 完成] 資料已輸出為 Parquet")
+    print(f"📂 路徑: {output_path}")
+    print("="*40)
+
+    # 7. 資料品質快報
+    print_quality_report(stats, preview_df)
+    if gate is not None:
+        gate.report()
+    metrics.summary()
+
 if __name__ == "__main__":
     clean_and_transform()
\ No newline at end of file
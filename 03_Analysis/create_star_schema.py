@@ -1,5 +1,19 @@
+import argparse
 import pandas as pd
+import pyarrow as pa
 import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from categorical_ops import map_distinct, to_plain
+from surrogate_keys import CUSTOMER_KEY_COLS, surrogate_key, check_unique_keys
+from etl_state import file_sha256, load_state, save_state, read_row_groups_from
+from ledger_store import load_ledger, LEDGER_FILE
+from aggregations import AGG_TABLES, MODEL_FOLDER, write_aggregations
+from etl_metrics import MetricsRun
+from fact_writer import FACT_LAYOUT, write_fact, append_fact, fact_path
+from calendar_engine import get_dim_date, date_key
+from scd2 import latest_snapshot, read_scd_dim, is_scd_file, scd2_merge, bind_versions, check_model, export_tmdl
 
 # --- 1. 路徑設定 ---
 # 動態抓取路徑，避免寫死
@@ -8,142 +22,456 @@ BASE_PATH = os.path.dirname(current_dir)
 
 INPUT_FILE = os.path.join(BASE_PATH, "02_ProcessedData", "POS_Cleaned.parquet")
 OUTPUT_FOLDER = os.path.join(BASE_PATH, "02_ProcessedData", "BI_Tables")
-CONFIG_FILE = os.path.join(BASE_PATH, "99_Config", "Customer_Parent_Mapping.xlsx")
+CONFIG_FILE = os.path.join(BASE_PATH, "99_Config", "Customer_Parent_Mapping.xlsx")   # 人工確認用的匯出檔，有修改會先合併進帳本
 
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+# --- 增量模式設定 ---
+# 只處理 POS_Cleaned.parquet 新附加的 row group (需搭配 clean_data.py 的增量模式)
+INCREMENTAL_MODE = False
+CLEAN_STATE_FILE = "_clean_state.json"   # 與 POS_Cleaned.parquet 同資料夾
+STAR_STATE_FILE = "_star_state.json"     # 放在 BI_Tables
+# fact_write_id：Fact_Sales 每次全量重寫 (依月份重排) 都換新；增量附加不變。
+# RFM / PMF 的增量以「第 N 列之後是新資料」接續，id 不同代表列順序已變，必須全量重算
 
-def create_star_schema():
-    print("🌟 [Star Schema 引擎 V3.1 - Fix Mapping] 啟動中...")
-    
-    if not os.path.exists(INPUT_FILE):
-        print(f"❌ 錯誤: 找不到輸入檔 {INPUT_FILE}")
-        return
+# --- 平行建表設定 ---
+# 各維度表與 Fact_Sales 互不相依 (Key 都是 hash 算出來的)，可同時建表；
+# pandas 去重 / pyarrow 寫檔大多會釋放 GIL，用 thread 就能讓寫檔與運算重疊
+PARALLEL_MODE = False
+MAX_WORKERS = 5
 
-    df = pd.read_parquet(INPUT_FILE)
-    print(f"   - 讀取來源資料: {len(df):,} 筆")
+# --- 彙總層 ---
+# 建完 Fact_Sales 後產生月 / 季彙總表 (Agg_Sales_*)，報表頁面直接讀彙總表
+AGGREGATION_MODE = True
+
+# --- 緩慢變動維度 (SCD Type 2) ---
+# Dim_Product / Dim_Customer 保留屬性歷史 (產品換產品群、客戶換集團)，Fact_Sales 依出貨日對應當時的版本
+# 切換後先執行 python create_star_schema.py --tmdl，Power BI 關聯改用 *_Version_Key (模型不一致時建表會中止，詳見 scd2.py)
+SCD_MODE = False
+
+KEY_COLS = ['AdjPtNo', 'PtNo', 'DistName', 'CustName', 'CustCity', 'CustSt', 'CustZIP']
+CUST_COLS = ['CustName', 'CustCity', 'CustSt', 'CustZIP', 'Channel District', 'Channel GeoGroup']
+PROD_COLS = ['AdjPtNo', 'PtNo', 'Product Line', 'Product Division', 'Product Group', 'Group Roll-UP']
+# SCD2 追蹤的屬性 (變動即開新版本)；帳本欄位沒有日期，以執行日生效
+PROD_SCD_COLS = ['PtNo', 'Product Line', 'Product Division', 'Product Group', 'Group Roll-UP']
+CUST_SCD_COLS = ['Channel District', 'Channel GeoGroup', 'Parent_Group', 'Category', 'Source']
+CUST_DATED_COLS = ['Channel District', 'Channel GeoGroup']
+
+def normalize_key_values(s):
+    s = s.astype(str).str.strip().str.upper()
+    return s.replace({'NAN': 'UNKNOWN', 'NONE': 'UNKNOWN', '': 'UNKNOWN'})
 
-    # 欄位名稱對齊
+def normalize_keys(df):
+    """ 欄位名稱對齊 + Key 值大寫標準化 (category 欄位只處理不重複值) """
     rename_map = {'CustCty': 'CustCity', 'Adj PtNo': 'AdjPtNo'}
     available_map = {k: v for k, v in rename_map.items() if k in df.columns}
     if available_map: df = df.rename(columns=available_map)
 
-    # 0. 全局標準化
-    print("   - 🔄 Key 值大寫標準化...")
-    key_cols = ['AdjPtNo', 'PtNo', 'DistName', 'CustName', 'CustCity', 'CustSt', 'CustZIP']
-    for col in key_cols:
+    for col in KEY_COLS:
         if col in df.columns:
-            df[col] = df[col].astype(str).str.strip().str.upper()
-            df[col] = df[col].replace({'NAN': 'UNKNOWN', 'NONE': 'UNKNOWN', '': 'UNKNOWN'})
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = map_distinct(df[col], normalize_key_values)
+            else:
+                df[col] = normalize_key_values(df[col])
+    return df
 
-    # 1. Dim_Product
-    print("   - 🔨 建立 Dim_Product...")
-    product_key = 'AdjPtNo' if 'AdjPtNo' in df.columns else 'PtNo'
-    prod_cols = [c for c in ['AdjPtNo', 'PtNo', 'Product Line', 'Product Division', 'Product Group', 'Group Roll-UP'] if c in df.columns]
-    df[product_key] = df[product_key].fillna('UNKNOWN')
-    dim_prod = df[prod_cols].drop_duplicates(subset=[product_key]).fillna('Unknown')
-    dim_prod.to_parquet(os.path.join(OUTPUT_FOLDER, "Dim_Product.parquet"), index=False)
+def get_product_key(df):
+    return 'AdjPtNo' if 'AdjPtNo' in df.columns else 'PtNo'
 
-    # 2. Dim_Distributor
-    print("   - 🔨 建立 Dim_Distributor...")
+def build_dim_product(df):
+    product_key = get_product_key(df)
+    prod_cols = [c for c in PROD_COLS if c in df.columns]
+    dim_prod = to_plain(df[prod_cols].drop_duplicates(subset=[product_key]))
+    dim_prod[product_key] = dim_prod[product_key].fillna('UNKNOWN')
+    dim_prod = dim_prod.fillna('Unknown')
+    dim_prod['Product_Key'] = surrogate_key(dim_prod, [product_key])
+    check_unique_keys(dim_prod, 'Product_Key', [product_key])
+    return dim_prod
+
+def build_dim_distributor(df):
     dist_cols = ['DistName', 'Channel Manager', 'TerrNo', 'DIST TYPE']
-    df['DistName'] = df['DistName'].fillna('UNKNOWN')
-    dim_dist = df[dist_cols].drop_duplicates(subset=['DistName']).fillna('Unknown')
-    dim_dist.to_parquet(os.path.join(OUTPUT_FOLDER, "Dim_Distributor.parquet"), index=False)
+    dim_dist = to_plain(df[dist_cols].drop_duplicates(subset=['DistName']))
+    dim_dist['DistName'] = dim_dist['DistName'].fillna('UNKNOWN')
+    dim_dist = dim_dist.fillna('Unknown')
+    dim_dist['Distributor_Key'] = surrogate_key(dim_dist, ['DistName'])
+    check_unique_keys(dim_dist, 'Distributor_Key', ['DistName'])
+    return dim_dist
 
-    # 3. Dim_Customer (含集團歸戶)
-    print("   - 🔨 建立 Dim_Customer (整合集團歸戶)...")
-    cust_cols = ['CustName', 'CustCity', 'CustSt', 'CustZIP', 'Channel District', 'Channel GeoGroup']
-    available_cust_cols = [c for c in cust_cols if c in df.columns]
-    
-    # 3.1 基礎清單
-    dim_cust = df[available_cust_cols].drop_duplicates().reset_index(drop=True)
-
-    # 3.2 讀取 Excel 黃金帳本
-    if os.path.exists(CONFIG_FILE):
-        print("     📖 讀取 Mapping Table...")
-        try:
-            map_df = pd.read_excel(CONFIG_FILE)
-            
-            # [Fix] 去除欄位名稱的空白 (以防萬一)
-            map_df.columns = map_df.columns.str.strip()
-            
-            # 檢查關鍵欄位是否存在
-            if 'Original_CustName' in map_df.columns:
-                # 標準化 Key
-                map_df['Original_CustName'] = map_df['Original_CustName'].astype(str).str.strip().str.upper()
-                
-                # 去重 (確保 Excel 裡沒有重複的 Key)
-                map_df = map_df.drop_duplicates(subset=['Original_CustName'])
-                
-                # 合併
-                dim_cust = dim_cust.merge(
-                    map_df[['Original_CustName', 'Parent_Group', 'Category', 'Source']], # 這裡讀取 Category, Source
-                    left_on='CustName',
-                    right_on='Original_CustName',
-                    how='left'
-                )
-                
-                # 填補空值
-                dim_cust['Parent_Group'] = dim_cust['Parent_Group'].fillna(dim_cust['CustName'])
-                dim_cust['Category'] = dim_cust['Category'].fillna('Uncategorized')
-                dim_cust['Source'] = dim_cust['Source'].fillna('Auto-Generated')
-                
-                # 移除多餘欄位
-                dim_cust = dim_cust.drop(columns=['Original_CustName'])
-            else:
-                print("     ⚠️ Excel 缺少 'Original_CustName' 欄位，跳過合併")
-                dim_cust['Parent_Group'] = dim_cust['CustName']
-                dim_cust['Category'] = 'Uncategorized'
-        except Exception as e:
-            print(f"     ⚠️ 讀取 Excel 失敗: {e}")
-            dim_cust['Parent_Group'] = dim_cust['CustName']
-            dim_cust['Category'] = 'Uncategorized'
+def build_scd_product(df, output_folder, as_of=None):
+    """ [SCD2] 每個料號取最近一筆交易的屬性，與既有 Dim_Product 版本比對，回傳 (版本表, 變動統計) """
+    product_key = get_product_key(df)
+    dim_prod = latest_snapshot(df, [product_key], [c for c in PROD_COLS if c != product_key])
+    dim_prod[product_key] = dim_prod[product_key].fillna('UNKNOWN')
+    dim_prod = dim_prod.fillna('Unknown')
+    dim_prod['Product_Key'] = surrogate_key(dim_prod, [product_key])
+    stored = read_scd_dim(os.path.join(output_folder, "Dim_Product.parquet"))
+    return scd2_merge(stored, dim_prod, 'Product_Key', PROD_SCD_COLS, 'Product_Version_Key', as_of=as_of)
+
+def get_customer_key_cols(df):
+    return [c for c in CUSTOMER_KEY_COLS if c in df.columns]
+
+def build_customer_base(df):
+    """ 3.1 基礎清單 (尚未歸戶、尚未給 Key)，一個自然鍵只留第一筆，與 Dim_Product 相同 """
+    available_cust_cols = [c for c in CUST_COLS if c in df.columns]
+    dim_cust = df[available_cust_cols].drop_duplicates(subset=get_customer_key_cols(df))
+    return to_plain(dim_cust.reset_index(drop=True))
+
+def attach_customer_mapping(dim_cust, ledger):
+    """ 3.2 依黃金帳本 (ledger_store) 補上 Parent_Group / Category / Source """
+    if ledger is not None and not ledger.empty:
+        map_df = ledger[['Original_CustName', 'Parent_Group', 'Category', 'Source']].copy()
+
+        # 標準化 Key
+        map_df['Original_CustName'] = map_df['Original_CustName'].astype(str).str.strip().str.upper()
+
+        # 去重 (確保帳本裡沒有重複的 Key)
+        map_df = map_df.drop_duplicates(subset=['Original_CustName'])
+
+        # 合併
+        dim_cust = dim_cust.merge(map_df, left_on='CustName', right_on='Original_CustName', how='left')
+
+        # 填補空值
+        dim_cust['Parent_Group'] = dim_cust['Parent_Group'].fillna(dim_cust['CustName'])
+        dim_cust['Category'] = dim_cust['Category'].fillna('Uncategorized')
+        dim_cust['Source'] = dim_cust['Source'].fillna('Auto-Generated')
+
+        # 移除多餘欄位
+        dim_cust = dim_cust.drop(columns=['Original_CustName'])
     else:
-        print("     ⚠️ 找不到 Mapping Excel，使用預設值")
+        print("     ⚠️ 帳本為空，使用預設值")
         dim_cust['Parent_Group'] = dim_cust['CustName']
         dim_cust['Category'] = 'Uncategorized'
+        dim_cust['Source'] = 'Auto-Generated'      # 與帳本未命中時相同，SCD 才不會在帳本第一次有資料時全部開新版本
+    return dim_cust
 
-    # 產生 Key
+def assign_customer_keys(dim_cust):
+    """ 產生 Key (自然鍵 hash，與出現順序無關) """
     dim_cust = dim_cust.reset_index(drop=True)
-    dim_cust['Customer_Key'] = dim_cust.index + 10000 
-    dim_cust.to_parquet(os.path.join(OUTPUT_FOLDER, "Dim_Customer.parquet"), index=False)
-    print(f"     ✅ 完成: {len(dim_cust):,} 個唯一客戶")
+    key_cols = get_customer_key_cols(dim_cust)
+    dim_cust['Customer_Key'] = surrogate_key(dim_cust, key_cols)
+    check_unique_keys(dim_cust, 'Customer_Key', key_cols)
+    return dim_cust
 
-    # 4. Dim_Date
-    print("   - 🔨 建立 Dim_Date...")
+def build_scd_customer(df, ledger, output_folder, as_of=None):
+    """ [SCD2] 每個客戶取最近一筆交易的區域 + 目前帳本歸戶，與既有 Dim_Customer 版本比對，回傳 (版本表, 變動統計) """
+    key_cols = get_customer_key_cols(df)
+    dim_cust = latest_snapshot(df, key_cols, [c for c in CUST_COLS if c not in key_cols])
+    effective_from = dim_cust.pop('Effective_From')
+    dim_cust = assign_customer_keys(attach_customer_mapping(dim_cust, ledger))
+    dim_cust['Effective_From'] = effective_from.to_numpy()
+    stored = read_scd_dim(os.path.join(output_folder, "Dim_Customer.parquet"))
+    return scd2_merge(stored, dim_cust, 'Customer_Key', CUST_SCD_COLS, 'Customer_Version_Key',
+                      dated_cols=CUST_DATED_COLS, as_of=as_of)
+
+def print_scd_changes(name, changes):
+    print(f"   - 🕰️ {name}: 新增 {changes['new']:,} / 開新版本 {changes['changed']:,} / 未變 {changes['unchanged']:,}")
+
+def get_date_bounds(df):
+    """ 回傳 (最早年份, 最晚年份)；無有效日期時回傳 (None, None) """
+    if 'POS_ShpDate' not in df.columns:
+        return None, None
+    min_date = df['POS_ShpDate'].min()
+    max_date = df['POS_ShpDate'].max()
+    if pd.isna(min_date) or pd.isna(max_date):
+        return None, None
+    return int(min_date.year), int(max_date.year)
+
+def build_fact(df, scd_dims=None):
+    """ 直接對每筆交易算出維度 Key (與維度表同一個 hash)，不需 merge
+    scd_dims: {'Dim_Product': 版本表, 'Dim_Customer': 版本表}，傳入時依出貨日補上 *_Version_Key """
+    fact_df = df.copy(deep=False)
+    fact_df['Product_Key'] = surrogate_key(df, [get_product_key(df)])
+    fact_df['Distributor_Key'] = surrogate_key(df, ['DistName'])
+    fact_df['Customer_Key'] = surrogate_key(df, get_customer_key_cols(df))
     if 'POS_ShpDate' in df.columns:
-        min_date = df['POS_ShpDate'].min()
-        max_date = df['POS_ShpDate'].max()
-        # 避免空值日期導致報錯
-        if pd.isna(min_date) or pd.isna(max_date):
-             start_date = pd.to_datetime("2023-01-01")
-             end_date = pd.to_datetime("2025-12-31")
+        fact_df['DateKey'] = date_key(df['POS_ShpDate'])
+    if scd_dims:
+        date_keys = fact_df['DateKey'] if 'DateKey' in fact_df.columns else pd.array([None] * len(df), dtype='Int32')
+        for dim_name, key_col, version_col in [("Dim_Product", 'Product_Key', 'Product_Version_Key'),
+                                               ("Dim_Customer", 'Customer_Key', 'Customer_Version_Key')]:
+            fact_df[version_col] = bind_versions(fact_df[key_col], date_keys, scd_dims[dim_name], key_col, version_col)
+
+    fact_cols = ['POS_ShpDate', 'DateKey', 'Product_Key', 'Product_Version_Key', 'PtNo', 'Distributor_Key',
+                 'Customer_Key', 'Customer_Version_Key', 'ResExt', 'Qty', 'UnitResale', 'UnitCst', 'CstExt']
+    final_fact_cols = [c for c in fact_cols if c in fact_df.columns]
+    return fact_df[final_fact_cols]
+
+def stage_outputs(name, output_folder):
+    """ 階段名稱 -> 輸出檔 (記錄寫出 bytes 用) """
+    if name == "Fact_Sales":
+        return [fact_path(output_folder)]
+    if name == "Aggregations":
+        return [os.path.join(output_folder, f"{table}.parquet") for table in AGG_TABLES]
+    return [os.path.join(output_folder, f"{name}.parquet")]
+
+def run_stages(stages, parallel=PARALLEL_MODE, max_workers=MAX_WORKERS, metrics=None, output_folder=None):
+    """ 執行建表階段 [(名稱, 函式)]，回傳 {名稱: (輸出筆數, 秒數)}
+    metrics: 傳入 MetricsRun 時每個階段另外記錄 CPU / RSS / 寫出 bytes """
+    def timed(name, func):
+        t0 = time.perf_counter()
+        if metrics is None:
+            rows = func()
         else:
-             start_date = pd.to_datetime(f"{min_date.year}-01-01")
-             end_date = pd.to_datetime(f"{max_date.year}-12-31")
-             
-        date_range = pd.date_range(start=start_date, end=end_date, freq='D')
-        dim_date = pd.DataFrame({'Date': date_range})
-        dim_date['Year'] = dim_date['Date'].dt.year
-        dim_date['Month'] = dim_date['Date'].dt.month
-        dim_date['Month_Name'] = dim_date['Date'].dt.month_name()
-        dim_date['Quarter'] = dim_date['Date'].dt.quarter
-        dim_date['YearQuarter'] = dim_date['Year'].astype(str) + "-Q" + dim_date['Quarter'].astype(str)
-        dim_date['YearMonth'] = dim_date['Date'].dt.strftime('%Y-%m')
-        dim_date.to_parquet(os.path.join(OUTPUT_FOLDER, "Dim_Date.parquet"), index=False)
+            with metrics.stage(name, outputs=stage_outputs(name, output_folder) if output_folder else ()) as rec:
+                rows = func()
+                rec['rows_out'] = rows
+        return rows, time.perf_counter() - t0
+
+    if not parallel:
+        return {name: timed(name, func) for name, func in stages}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {name: pool.submit(timed, name, func) for name, func in stages}
+        return {name: future.result() for name, future in futures.items()}
+
+def print_stage_timings(timings, wall_sec):
+    print("\n⏱️ [各階段耗時]")
+    for name, (rows, sec) in timings.items():
+        print(f"   - {name:<16} {rows:>12,} 筆 {sec:>8.2f}s")
+    slowest = max(timings, key=lambda name: timings[name][1])
+    print(f"   - 總耗時 {wall_sec:.2f}s (關鍵路徑: {slowest})")
+
+def load_source(input_file):
+    """ 讀取 POS_Cleaned (可傳入已在記憶體的 Arrow Table) 並做全局 Key 標準化 """
+    df = input_file.to_pandas() if isinstance(input_file, pa.Table) else pd.read_parquet(input_file)
+    print(f"   - 讀取來源資料: {len(df):,} 筆")
+    print("   - 🔄 Key 值大寫標準化...")
+    return normalize_keys(df)
+
+def new_fact_write_id(output_folder):
+    """ Fact_Sales 全量重寫前呼叫：狀態檔先換上新的 fact_write_id (寫到一半失敗也不會沿用舊 id) """
+    state_path = os.path.join(output_folder, STAR_STATE_FILE)
+    state = load_state(state_path)
+    state['fact_write_id'] = uuid.uuid4().hex
+    save_state(state_path, state)
+    return state['fact_write_id']
+
+def save_star_state(input_file, output_folder, ledger_file, source_rows, min_year, max_year):
+    """ 全量建表後記錄狀態 (增量模式以此判斷從哪一列接續、帳本是否更新) """
+    clean_state = load_state(os.path.join(os.path.dirname(input_file), CLEAN_STATE_FILE))
+    state_path = os.path.join(output_folder, STAR_STATE_FILE)
+    save_state(state_path, {
+        'clean_build_id': clean_state.get('build_id', uuid.uuid4().hex),
+        'fact_write_id': load_state(state_path).get('fact_write_id') or uuid.uuid4().hex,
+        'source_rows': source_rows,
+        'mapping_hash': file_sha256(ledger_file) if os.path.exists(ledger_file) else None,
+        'min_year': min_year,
+        'max_year': max_year,
+    })
+
+def create_star_schema(input_file=INPUT_FILE, output_folder=OUTPUT_FOLDER, config_file=CONFIG_FILE,
+                       ledger_file=LEDGER_FILE, incremental=INCREMENTAL_MODE, parallel=PARALLEL_MODE,
+                       max_workers=MAX_WORKERS, aggregations=AGGREGATION_MODE, fact_layout=FACT_LAYOUT,
+                       scd=SCD_MODE, model_folder=MODEL_FOLDER):
+    """ model_folder: Power BI 模型 (檢查關聯與 SCD 模式一致；None = 不檢查) """
+    print("🌟 [Star Schema 引擎 V3.3 - Hash Key] 啟動中...")
+
+    if not os.path.exists(input_file):
+        print(f"❌ 錯誤: 找不到輸入檔 {input_file}")
+        return
+    check_model(scd, model_folder)
+
+    os.makedirs(output_folder, exist_ok=True)
+    metrics = MetricsRun('create_star_schema')
+
+    # 讀取帳本 (Parquet 正本；Excel 有人工修改會先合併，之後帳本檔案的 hash 才是最新的)
+    print("   - 📖 讀取黃金帳本...")
+    with metrics.stage('load_ledger', inputs=[p for p in [ledger_file] if os.path.exists(p)]) as rec:
+        ledger = load_ledger(ledger_file, config_file)
+        rec['rows_out'] = len(ledger)
+
+    if incremental:
+        with metrics.stage('incremental', inputs=[input_file]):
+            done = incremental_star_schema(input_file, output_folder, ledger_file, ledger, aggregations, scd)
+        if done:
+            metrics.summary()
+            return
+        print("   - ♻️ 無法增量更新，改為全量重建...")
+
+    with metrics.stage('load_source', inputs=[input_file]) as rec:
+        df = load_source(input_file)
+        rec['rows_out'] = len(df)
+
+    min_year, max_year = get_date_bounds(df)
+
+    # SCD2：版本表要先和既有的 Dim 比對，Fact_Sales 也需要版本表才能對應版本 Key，所以先建
+    scd_dims = None
+    if scd:
+        with metrics.stage('scd2_dimensions', rows_in=len(df)) as rec:
+            (dim_prod, prod_changes), (dim_cust, cust_changes) = \
+                build_scd_product(df, output_folder), build_scd_customer(df, ledger, output_folder)
+            scd_dims = {"Dim_Product": dim_prod, "Dim_Customer": dim_cust}
+            rec['rows_out'] = len(dim_prod) + len(dim_cust)
+            rec['extra']['scd_changes'] = {'Dim_Product': prod_changes, 'Dim_Customer': cust_changes}
+        print_scd_changes("Dim_Product", prod_changes)
+        print_scd_changes("Dim_Customer", cust_changes)
+
+    def write_table(table, name):
+        table.to_parquet(os.path.join(output_folder, f"{name}.parquet"), index=False)
+        return len(table)
+
+    # 1. Dim_Product
+    def stage_product():
+        print("   - 🔨 建立 Dim_Product...")
+        return write_table(scd_dims["Dim_Product"] if scd else build_dim_product(df), "Dim_Product")
+
+    # 2. Dim_Distributor
+    def stage_distributor():
+        print("   - 🔨 建立 Dim_Distributor...")
+        return write_table(build_dim_distributor(df), "Dim_Distributor")
+
+    # 3. Dim_Customer (含集團歸戶)
+    def stage_customer():
+        print("   - 🔨 建立 Dim_Customer (整合集團歸戶)...")
+        if scd:
+            return write_table(scd_dims["Dim_Customer"], "Dim_Customer")
+        dim_cust = build_customer_base(df)
+        dim_cust = attach_customer_mapping(dim_cust, ledger)
+        dim_cust = assign_customer_keys(dim_cust)
+        return write_table(dim_cust, "Dim_Customer")
+
+    # 4. Dim_Date
+    def stage_date():
+        print("   - 🔨 建立 Dim_Date...")
+        return write_table(get_dim_date(min_year, max_year, cache_folder=output_folder), "Dim_Date")
 
     # 5. Fact_Sales
-    print("   - 🔨 建立 Fact_Sales...")
-    merge_cols = [col for col in ['CustName', 'CustCity', 'CustSt', 'CustZIP'] if col in dim_cust.columns]
-    fact_df = df.merge(dim_cust[merge_cols + ['Customer_Key']], on=merge_cols, how='left')
-    
-    fact_cols = ['POS_ShpDate', 'AdjPtNo', 'PtNo', 'DistName', 'Customer_Key', 'ResExt', 'Qty', 'UnitResale', 'UnitCst', 'CstExt']
-    final_fact_cols = [c for c in fact_cols if c in fact_df.columns]
-    fact_table = fact_df[final_fact_cols]
-    
-    fact_table.to_parquet(os.path.join(OUTPUT_FOLDER, "Fact_Sales.parquet"), index=False)
-    print(f"     ✅ 完成: {len(fact_table):,} 筆交易資料")
+    def stage_fact():
+        print("   - 🔨 建立 Fact_Sales...")
+        new_fact_write_id(output_folder)
+        return write_fact(build_fact(df, scd_dims), output_folder, fact_layout)
+
+    stages = [("Dim_Product", stage_product), ("Dim_Distributor", stage_distributor),
+              ("Dim_Customer", stage_customer), ("Dim_Date", stage_date), ("Fact_Sales", stage_fact)]
+    if 'POS_ShpDate' not in df.columns:
+        stages = [st for st in stages if st[0] != "Dim_Date"]
+
+    if parallel:
+        print(f"   - ⚡ 平行建表 ({max_workers} threads)...")
+    t0 = time.perf_counter()
+    timings = run_stages(stages, parallel, max_workers, metrics, output_folder)
+    # 彙總表要用到 Dim_Product / Dim_Customer 的屬性，等所有表建完再做
+    if aggregations:
+        print("   - 🔨 建立彙總表 (Agg_Sales_*)...")
+        timings.update(run_stages([("Aggregations", lambda: write_aggregations(output_folder))],
+                                  metrics=metrics, output_folder=output_folder))
+    print_stage_timings(timings, time.perf_counter() - t0)
+    print(f"     ✅ 完成: {timings['Dim_Customer'][0]:,} 個唯一客戶, {timings['Fact_Sales'][0]:,} 筆交易資料")
+
+    # 記錄狀態，供下次增量使用
+    save_star_state(input_file, output_folder, ledger_file, len(df), min_year, max_year)
+    metrics.summary()
     print("\n🚀 [ETL 完成] 所有檔案已輸出至 BI_Tables")
 
+def incremental_star_schema(input_file, output_folder, ledger_file, ledger, aggregations=AGGREGATION_MODE,
+                            scd=SCD_MODE):
+    """ [增量模式] 只處理新附加的 row group；回傳 False 代表條件不符需全量重建 """
+    clean_state = load_state(os.path.join(os.path.dirname(input_file), CLEAN_STATE_FILE))
+    state_path = os.path.join(output_folder, STAR_STATE_FILE)
+    state = load_state(state_path)
+    table_names = ["Dim_Product", "Dim_Distributor", "Dim_Customer", "Dim_Date", "Fact_Sales"]
+    paths = {name: os.path.join(output_folder, f"{name}.parquet") for name in table_names}
+    paths["Fact_Sales"] = fact_path(output_folder)
+
+    if not clean_state or not state or state.get('clean_build_id') != clean_state.get('build_id'):
+        print("   - 📌 POS_Cleaned 已全量重建或尚無狀態檔")
+        return False
+    if not all(os.path.exists(p) for p in paths.values()):
+        return False
+    if any(scd != is_scd_file(paths[name]) for name in ["Dim_Product", "Dim_Customer"]):
+        print("   - 📌 SCD_MODE 與現有維度表格式不同")
+        return False
+
+    delta = read_row_groups_from(input_file, state['source_rows'])
+    if delta is None:
+        print("   - 📌 POS_Cleaned row group 邊界與上次不符")
+        return False
+
+    mapping_hash = file_sha256(ledger_file) if os.path.exists(ledger_file) else None
+    mapping_changed = mapping_hash != state.get('mapping_hash')
+    if delta.empty and not mapping_changed:
+        print("✅ 沒有新資料，BI_Tables 維持不變。")
+        return True
+
+    print(f"   - 📈 增量資料: {len(delta):,} 筆")
+    delta = normalize_keys(delta)
+
+    # 1. Dim_Product / 2. Dim_Distributor：只附加新出現的 Key (SCD2 時 Dim_Product 另外比對版本)
+    product_key = get_product_key(delta)
+    plain_dims = [("Dim_Distributor", build_dim_distributor, 'DistName')]
+    if not scd:
+        plain_dims.insert(0, ("Dim_Product", build_dim_product, product_key))
+    for name, builder, key in plain_dims:
+        existing = pd.read_parquet(paths[name])
+        new_rows = builder(delta)
+        new_rows = new_rows[~new_rows[key].isin(existing[key])]
+        if not new_rows.empty:
+            pd.concat([existing, new_rows], ignore_index=True).to_parquet(paths[name], index=False)
+        print(f"   - 🔨 {name}: 新增 {len(new_rows):,} 筆")
+
+    scd_dims = None
+    if scd:
+        # SCD2：新交易帶來的屬性變動開新版本；帳本有更新時所有客戶都重新比對歸戶
+        dim_prod, changes = build_scd_product(delta, output_folder)
+        dim_prod.to_parquet(paths["Dim_Product"], index=False)
+        print_scd_changes("Dim_Product", changes)
+        if mapping_changed:
+            # 帳本變動要套用到所有客戶：以既有目前版本的屬性 + 新交易組成完整的傳入清單
+            current = pd.read_parquet(paths["Dim_Customer"])
+            current = current[current['Is_Current']]
+            base_cols = [c for c in CUST_COLS if c in current.columns]
+            delta_cols = [c for c in CUST_COLS + ['POS_ShpDate'] if c in delta.columns]
+            source = pd.concat([current[base_cols], delta[delta_cols]], ignore_index=True)
+        else:
+            source = delta
+        dim_cust, changes = build_scd_customer(source, ledger, output_folder)
+        dim_cust.to_parquet(paths["Dim_Customer"], index=False)
+        print_scd_changes("Dim_Customer", changes)
+        scd_dims = {"Dim_Product": dim_prod, "Dim_Customer": dim_cust}
+    else:
+        # 3. Dim_Customer：Key 是 hash，新客戶直接附加；帳本有更新才整張重新歸戶
+        dim_cust = pd.read_parquet(paths["Dim_Customer"])
+        base_cols = [c for c in CUST_COLS if c in delta.columns]
+        new_base = build_customer_base(delta)
+        new_base = new_base[~surrogate_key(new_base, get_customer_key_cols(new_base)).isin(dim_cust['Customer_Key'])]
+        if mapping_changed:
+            print("   - 🔨 Dim_Customer: 帳本有更新，重新歸戶...")
+            dim_cust = attach_customer_mapping(pd.concat([dim_cust[base_cols], new_base], ignore_index=True), ledger)
+            assign_customer_keys(dim_cust).to_parquet(paths["Dim_Customer"], index=False)
+        elif not new_base.empty:
+            new_cust = assign_customer_keys(attach_customer_mapping(new_base, ledger))
+            pd.concat([dim_cust, new_cust], ignore_index=True).to_parquet(paths["Dim_Customer"], index=False)
+        print(f"   - 🔨 Dim_Customer: 新增 {len(new_base):,} 個客戶")
+
+    # 4. Dim_Date：年份範圍變大才重建
+    delta_min, delta_max = get_date_bounds(delta)
+    years = [y for y in [state.get('min_year'), state.get('max_year'), delta_min, delta_max] if y is not None]
+    min_year, max_year = (min(years), max(years)) if years else (None, None)
+    if (min_year, max_year) != (state.get('min_year'), state.get('max_year')):
+        print("   - 🔨 Dim_Date: 日期範圍擴大，重建...")
+        get_dim_date(min_year, max_year, cache_folder=output_folder).to_parquet(paths["Dim_Date"], index=False)
+
+    # 5. Fact_Sales：新交易附加為新的 row group (hive 版面則是各分區的新檔案)
+    if not delta.empty:
+        added = append_fact(build_fact(delta, scd_dims), output_folder)
+        print(f"   - 🔨 Fact_Sales: 附加 {added:,} 筆交易資料")
+
+    # 6. 彙總表：不重複客戶數無法相加，直接由 Fact_Sales 重算 (只讀需要的欄位)
+    if aggregations:
+        print(f"   - 🔨 彙總表: {write_aggregations(output_folder):,} 列")
+
+    state.update({
+        'source_rows': state['source_rows'] + len(delta),
+        'mapping_hash': mapping_hash,
+        'min_year': min_year,
+        'max_year': max_year,
+    })
+    save_state(state_path, state)
+    print("\n🚀 [增量完成] BI_Tables 已更新")
+    return True
+
 if __name__ == "__main__":
-    create_star_schema()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="建立 Star Schema (BI_Tables)")
+    parser.add_argument('--tmdl', action='store_true', help="只依 SCD_MODE 同步 Power BI 模型的版本欄位與關聯")
+    args = parser.parse_args()
+    if args.tmdl:
+        export_tmdl(SCD_MODE)
+    else:
+        create_star_schema()
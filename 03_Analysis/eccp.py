@@ -0,0 +1,360 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import pandas as pd
+import pyarrow.parquet as pq
+import clean_data
+import create_star_schema as star
+from etl_state import file_sha256, load_state, save_state
+from ledger_store import load_ledger, LEDGER_FILE, EXCEL_FILE
+from calendar_engine import get_dim_date, HOLIDAYS_FILE
+from quality_rules import QUALITY_RULES_FILE
+from fact_writer import FACT_LAYOUT, write_fact, fact_path
+from aggregations import AGG_TABLES, MODEL_FOLDER, write_aggregations
+from etl_metrics import MetricsRun
+
+# ==========================================
+# 🧭 eCCP 流程總控 (一個指令跑完 flowchart.md 的 Phase 1 ~ 3)
+# ==========================================
+# python eccp.py run      -> 依 DAG 執行，輸入沒變的階段直接略過
+# python eccp.py status   -> 只列出哪些階段會重跑，不執行
+# - 階段指紋 = 輸入檔內容 SHA-256 + 程式碼 SHA-256 + 參數 + 上游階段指紋；與上次相同且輸出檔還在就略過
+#   (POS_Cleaned 重建但內容相同時，下游也不會重跑)
+# - 互不相依的階段 (各維度表 / Fact_Sales) 以 thread 平行執行
+# - 同一個 process 內 POS_Cleaned 只讀一次 (memory-map 的 Arrow Table)，建好的表直接在記憶體交給彙總表
+# - 只改 Excel 帳本：只有 Dim_Customer 與彙總表重跑 (Customer_Key 是自然鍵 hash，Fact_Sales 不受帳本影響)
+# - Phase 4 (Power BI Refresh) 仍需在 Desktop 手動執行
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+BASE_PATH = os.path.dirname(current_dir)
+RAW_DATA_PATH = os.path.join(BASE_PATH, "01_RawData", "POS_all.csv")
+PROCESSED_FOLDER = os.path.join(BASE_PATH, "02_ProcessedData")
+BI_FOLDER = os.path.join(PROCESSED_FOLDER, "BI_Tables")
+PIPELINE_STATE_FILE = "_pipeline_state.json"   # 放在 02_ProcessedData
+
+PARALLEL_MODE = True
+MAX_WORKERS = 5
+PIPELINE_VERSION = 1   # 流程本身的邏輯改變時 +1，所有階段視為過期
+
+STAR_CODE = ['create_star_schema', 'surrogate_keys', 'categorical_ops', 'scd2']
+MAPPING_CODE = ['generate_mapping', 'hard_rules', 'fuzzy_resolver', 'classification_cache', 'async_classifier']
+
+# ==========================================
+# 🔑 指紋
+# ==========================================
+
+def code_hash(module):
+    return file_sha256(os.path.join(current_dir, f"{module}.py"))
+
+def cached_file_hash(ctx, path):
+    """ 內容 SHA-256；大小與修改時間都沒變時沿用上次的結果，不重讀大檔 """
+    if not path or not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    memo = ctx['state'].setdefault('file_hashes', {})
+    entry = memo.get(path)
+    if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry['sha256']
+    digest = file_sha256(path)
+    memo[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest}
+    return digest
+
+def stage_fingerprint(name, spec, ctx, fingerprints):
+    payload = {
+        'stage': name,
+        'version': PIPELINE_VERSION,
+        'code': {m: code_hash(m) for m in spec['code']},
+        'inputs': {k: cached_file_hash(ctx, ctx['inputs'][k]) for k in spec['inputs']},
+        'deps': {d: fingerprints[d] for d in spec['deps']},
+        'params': ctx['params'].get(name),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+def is_up_to_date(name, spec, ctx, fingerprint):
+    previous = ctx['state'].get('stages', {}).get(name, {})
+    outputs = spec['outputs'](ctx)
+    return previous.get('fingerprint') == fingerprint and all(os.path.exists(p) for p in outputs)
+
+# ==========================================
+# 🔨 各階段
+# ==========================================
+
+def source(ctx):
+    """ POS_Cleaned 整個流程只讀一次 (Key 標準化後供各建表階段共用) """
+    with ctx['lock']:
+        if ctx.get('source') is None:
+            table = pq.read_table(ctx['inputs']['pos_cleaned'], memory_map=True)
+            ctx['source'] = star.load_source(table)
+            ctx['years'] = star.get_date_bounds(ctx['source'])
+        return ctx['source']
+
+def write_bi_table(ctx, table, name):
+    table.to_parquet(os.path.join(ctx['bi_folder'], f"{name}.parquet"), index=False)
+    ctx['tables'][name] = table
+    return len(table)
+
+def stage_clean(ctx):
+    params = ctx['params']['clean']
+    clean_data.clean_and_transform(ctx['inputs']['raw'], ctx['processed_folder'], **params)
+    ctx['source'] = None
+    return pq.ParquetFile(ctx['inputs']['pos_cleaned']).metadata.num_rows
+
+def stage_dim_product(ctx):
+    if ctx['params']['fact_sales']['scd']:
+        dim_prod, changes = star.build_scd_product(source(ctx), ctx['bi_folder'])
+        star.print_scd_changes("Dim_Product", changes)
+        return write_bi_table(ctx, dim_prod, "Dim_Product")
+    return write_bi_table(ctx, star.build_dim_product(source(ctx)), "Dim_Product")
+
+def stage_dim_distributor(ctx):
+    return write_bi_table(ctx, star.build_dim_distributor(source(ctx)), "Dim_Distributor")
+
+def stage_dim_customer(ctx):
+    if ctx['params']['fact_sales']['scd']:
+        dim_cust, changes = star.build_scd_customer(source(ctx), ctx['ledger'], ctx['bi_folder'])
+        star.print_scd_changes("Dim_Customer", changes)
+        return write_bi_table(ctx, dim_cust, "Dim_Customer")
+    dim_cust = star.build_customer_base(source(ctx))
+    dim_cust = star.attach_customer_mapping(dim_cust, ctx['ledger'])
+    return write_bi_table(ctx, star.assign_customer_keys(dim_cust), "Dim_Customer")
+
+def stage_dim_date(ctx):
+    source(ctx)
+    min_year, max_year = ctx['years']
+    return write_bi_table(ctx, get_dim_date(min_year, max_year, cache_folder=ctx['bi_folder']), "Dim_Date")
+
+def scd_dim(ctx, name):
+    """ 本次執行建好的版本表；維度沒重跑時讀現有檔案 """
+    if name not in ctx['tables']:
+        ctx['tables'][name] = pd.read_parquet(os.path.join(ctx['bi_folder'], f"{name}.parquet"))
+    return ctx['tables'][name]
+
+def stage_fact_sales(ctx):
+    scd_dims = {name: scd_dim(ctx, name) for name in ("Dim_Product", "Dim_Customer")} \
+        if ctx['params']['fact_sales']['scd'] else None
+    fact = star.build_fact(source(ctx), scd_dims)
+    ctx['tables']['Fact_Sales'] = fact
+    star.new_fact_write_id(ctx['bi_folder'])
+    return write_fact(fact, ctx['bi_folder'], ctx['params']['fact_sales']['layout'])
+
+def stage_aggregations(ctx):
+    tables = ctx['tables']
+    return write_aggregations(ctx['bi_folder'], fact=tables.get('Fact_Sales'),
+                              dim_product=tables.get('Dim_Product'), dim_cust=tables.get('Dim_Customer'))
+
+def stage_mapping(ctx):
+    # generate_mapping 需要 Gemini 套件，只有選用這個階段時才 import
+    from generate_mapping import run_detective
+    run_detective(input_file=os.path.join(ctx['bi_folder'], "Dim_Customer.parquet"),
+                  ledger_file=ctx['inputs']['ledger'], config_file=ctx['excel_file'])
+    return len(load_ledger(ctx['inputs']['ledger'], ctx['excel_file']))
+
+def bi_outputs(*names):
+    return lambda ctx: [os.path.join(ctx['bi_folder'], f"{n}.parquet") for n in names]
+
+# 階段名稱 -> 規格
+#   deps:    上游階段 (指紋會納入上游指紋)
+#   after:   只決定執行順序；資料相依改由 inputs 的檔案內容 hash 判斷
+#   inputs:  外部輸入檔 (ctx['inputs'] 的 key)
+#   code:    程式碼模組 (內容變了就重跑)
+PIPELINE = {
+    'clean': {'deps': [], 'after': [], 'inputs': ['raw', 'quality_rules'],
+              'code': ['clean_data', 'numeric_cleaner', 'categorical_ops', 'etl_state', 'quality_rules'],
+              'run': stage_clean, 'outputs': lambda ctx: [ctx['inputs']['pos_cleaned']]},
+    'dim_product': {'deps': [], 'after': ['clean'], 'inputs': ['pos_cleaned'], 'code': STAR_CODE,
+                    'run': stage_dim_product, 'outputs': bi_outputs("Dim_Product")},
+    'dim_distributor': {'deps': [], 'after': ['clean'], 'inputs': ['pos_cleaned'], 'code': STAR_CODE,
+                        'run': stage_dim_distributor, 'outputs': bi_outputs("Dim_Distributor")},
+    'dim_customer': {'deps': [], 'after': ['clean'], 'inputs': ['pos_cleaned', 'ledger'], 'code': STAR_CODE,
+                     'run': stage_dim_customer, 'outputs': bi_outputs("Dim_Customer")},
+    'dim_date': {'deps': [], 'after': ['clean'], 'inputs': ['pos_cleaned', 'holidays'],
+                 'code': STAR_CODE + ['calendar_engine'],
+                 'run': stage_dim_date, 'outputs': bi_outputs("Dim_Date")},
+    'fact_sales': {'deps': [], 'after': ['clean'], 'inputs': ['pos_cleaned'],
+                   'code': STAR_CODE + ['calendar_engine', 'fact_writer'],
+                   'run': stage_fact_sales, 'outputs': lambda ctx: [fact_path(ctx['bi_folder'])]},
+    'aggregations': {'deps': ['dim_product', 'dim_customer', 'fact_sales'], 'after': [], 'inputs': [],
+                     'code': ['aggregations', 'fact_writer'],
+                     'run': stage_aggregations, 'outputs': bi_outputs(*AGG_TABLES)},
+}
+
+# 選用 (--mapping)：新客戶送 AI 歸戶；帳本有變才重跑 Dim_Customer / 彙總表
+MAPPING_STAGE = {
+    'mapping': {'deps': ['dim_customer'], 'after': [], 'inputs': ['ledger'], 'code': MAPPING_CODE,
+                'run': stage_mapping, 'outputs': lambda ctx: [ctx['inputs']['ledger']]},
+}
+
+def scd_pipeline(pipeline):
+    """ SCD 模式下 Fact_Sales 要對應維度版本 Key：維度 (含帳本歸戶) 有變就要重跑 Fact_Sales """
+    return {**pipeline, 'fact_sales': {**pipeline['fact_sales'], 'deps': ['dim_product', 'dim_customer']}}
+
+STAR_STAGES = ['dim_product', 'dim_distributor', 'dim_customer', 'dim_date', 'fact_sales']
+
+# ==========================================
+# 🧭 排程
+# ==========================================
+
+def ready_stages(pending, finished):
+    return [name for name, spec in pending.items() if all(d in finished for d in spec['deps'] + spec['after'])]
+
+def run_dag(stages, ctx, force=False, parallel=PARALLEL_MODE, max_workers=MAX_WORKERS):
+    """ 依相依順序執行；上游完成才計算下游指紋 (此時輸入檔已是最新)，回傳 {階段: (筆數, 秒數)} """
+    pending = dict(stages)
+    fingerprints = ctx.setdefault('fingerprints', {})
+    finished = set()
+    timings = {}
+    stage_state = ctx['state'].setdefault('stages', {})
+
+    def timed(name, spec):
+        t0 = time.perf_counter()
+        with ctx['metrics'].stage(name, outputs=spec['outputs'](ctx)) as rec:
+            rows = spec['run'](ctx)
+            rec['rows_out'] = rows
+        return rows, time.perf_counter() - t0
+
+    with ThreadPoolExecutor(max_workers=max_workers if parallel else 1) as pool:
+        running = {}
+        while pending or running:
+            # 略過的階段立即算完成，可能讓更多下游變成可執行，掃到沒有新的為止
+            names = ready_stages(pending, finished)
+            while names:
+                for name in names:
+                    spec = pending.pop(name)
+                    fingerprint = stage_fingerprint(name, spec, ctx, fingerprints)
+                    fingerprints[name] = fingerprint
+                    if not force and is_up_to_date(name, spec, ctx, fingerprint):
+                        print(f"   - ⏭️ {name}: 輸入未變，略過")
+                        finished.add(name)
+                        continue
+                    print(f"   - ▶️ {name}")
+                    running[pool.submit(timed, name, spec)] = name
+                names = ready_stages(pending, finished)
+            if not running:
+                if pending:
+                    raise ValueError(f"流程相依有循環或缺少階段: {sorted(pending)}")
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                rows, sec = future.result()
+                timings[name] = (rows, sec)
+                stage_state[name] = {'fingerprint': fingerprints[name], 'rows': rows, 'seconds': round(sec, 3),
+                                     'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S')}
+                finished.add(name)
+    return timings
+
+def plan(stages, ctx):
+    """ [預覽] 回傳會重跑的階段 (上游會重跑的，下游一律視為會重跑) """
+    stale = []
+    fingerprints = {}
+    pending = dict(stages)
+    finished = set()
+    while pending:
+        names = ready_stages(pending, finished)
+        if not names:
+            raise ValueError(f"流程相依有循環或缺少階段: {sorted(pending)}")
+        for name in names:
+            spec = pending.pop(name)
+            fingerprints[name] = stage_fingerprint(name, spec, ctx, fingerprints)
+            upstream_stale = any(d in stale for d in spec['deps'] + spec['after'])
+            if upstream_stale or not is_up_to_date(name, spec, ctx, fingerprints[name]):
+                stale.append(name)
+            finished.add(name)
+    return stale
+
+def new_context(raw_file, processed_folder, bi_folder, ledger_file, excel_file, fact_layout):
+    os.makedirs(bi_folder, exist_ok=True)
+    return {
+        'processed_folder': processed_folder,
+        'bi_folder': bi_folder,
+        'excel_file': excel_file,
+        'inputs': {
+            'raw': raw_file,
+            'pos_cleaned': os.path.join(processed_folder, clean_data.OUTPUT_FILE),
+            'ledger': ledger_file,
+            'holidays': HOLIDAYS_FILE,
+            'quality_rules': QUALITY_RULES_FILE,
+        },
+        'params': {
+            'clean': {'stream': clean_data.STREAM_MODE, 'chunk_size': clean_data.CHUNK_SIZE,
+                      'incremental': clean_data.INCREMENTAL_MODE, 'categorical': clean_data.CATEGORICAL_MODE,
+                      'quality': clean_data.QUALITY_MODE, 'parallel': clean_data.PARALLEL_MODE},
+            'fact_sales': {'layout': fact_layout, 'scd': star.SCD_MODE},
+        },
+        'state': load_state(os.path.join(processed_folder, PIPELINE_STATE_FILE)),
+        'tables': {},
+        'source': None,
+        'lock': threading.Lock(),
+        'metrics': MetricsRun('eccp'),
+    }
+
+def run_pipeline(raw_file=RAW_DATA_PATH, processed_folder=PROCESSED_FOLDER, bi_folder=BI_FOLDER,
+                 ledger_file=LEDGER_FILE, excel_file=EXCEL_FILE, force=False, mapping=False,
+                 parallel=PARALLEL_MODE, max_workers=MAX_WORKERS, fact_layout=FACT_LAYOUT, model_folder=MODEL_FOLDER):
+    """ [主流程] clean -> 各維度表 / Fact_Sales -> 彙總表 (-> 選用: AI 歸戶)，回傳 {階段: (筆數, 秒數)} """
+    print("🧭 [eCCP 流程總控] 啟動中...")
+    star.check_model(star.SCD_MODE, model_folder)
+    ctx = new_context(raw_file, processed_folder, bi_folder, ledger_file, excel_file, fact_layout)
+    state_path = os.path.join(processed_folder, PIPELINE_STATE_FILE)
+    t0 = time.perf_counter()
+    timings = {}
+    try:
+        # Excel 有人工修改時先合併進帳本，帳本檔的 hash 才會反映這次的修改
+        ctx['ledger'] = load_ledger(ledger_file, excel_file)
+        pipeline = scd_pipeline(PIPELINE) if star.SCD_MODE else PIPELINE
+        timings.update(run_dag(pipeline, ctx, force, parallel, max_workers))
+
+        if mapping:
+            ledger_hash = cached_file_hash(ctx, ledger_file)
+            timings.update(run_dag({**pipeline, **MAPPING_STAGE}, ctx, force, parallel, max_workers))
+            if cached_file_hash(ctx, ledger_file) != ledger_hash:
+                print("   - 📒 帳本已更新，重新歸戶...")
+                ctx['ledger'] = load_ledger(ledger_file, excel_file)
+                ctx['fingerprints'] = {}
+                timings.update(run_dag(pipeline, ctx, force=False, parallel=parallel, max_workers=max_workers))
+
+        # 有建表就更新 _star_state.json，之後 create_star_schema.py 的增量模式可以接續
+        if ctx.get('source') is not None and any(name in timings for name in STAR_STAGES):
+            star.save_star_state(ctx['inputs']['pos_cleaned'], bi_folder, ledger_file,
+                                 len(ctx['source']), *ctx['years'])
+    finally:
+        save_state(state_path, ctx['state'])
+
+    if timings:
+        star.print_stage_timings(timings, time.perf_counter() - t0)
+        ctx['metrics'].summary()
+        print("\n🚀 [流程完成] 請在 Power BI Desktop 按下 Refresh")
+    else:
+        print("\n✅ 所有階段的輸入都沒變，BI_Tables 維持不變。")
+    return timings
+
+def print_status(raw_file=RAW_DATA_PATH, processed_folder=PROCESSED_FOLDER, bi_folder=BI_FOLDER,
+                 ledger_file=LEDGER_FILE, excel_file=EXCEL_FILE, fact_layout=FACT_LAYOUT):
+    ctx = new_context(raw_file, processed_folder, bi_folder, ledger_file, excel_file, fact_layout)
+    pipeline = scd_pipeline(PIPELINE) if star.SCD_MODE else PIPELINE
+    stale = plan(pipeline, ctx)
+    stages = ctx['state'].get('stages', {})
+    print("🧭 [eCCP 流程狀態]")
+    for name in pipeline:
+        last = stages.get(name, {})
+        mark = "🔄 會重跑" if name in stale else "✅ 最新"
+        print(f"   - {name:<16} {mark:<8} (上次: {last.get('finished_at', '-')}, {last.get('rows', 0):,} 筆)")
+    if os.path.exists(excel_file):
+        print("   💡 Excel 帳本若有未合併的修改，run 時會先合併 (Dim_Customer / 彙總表會重跑)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="eCCP 流程總控 (clean -> star schema -> 彙總表)")
+    parser.add_argument('action', choices=['run', 'status'], nargs='?', default='run')
+    parser.add_argument('--raw', default=RAW_DATA_PATH, help="POS_all.csv 路徑")
+    parser.add_argument('--force', action='store_true', help="忽略指紋，全部重跑")
+    parser.add_argument('--mapping', action='store_true', help="加跑 generate_mapping (需 Gemini API)")
+    parser.add_argument('--serial', action='store_true', help="不平行，依序執行")
+    args = parser.parse_args()
+    if args.action == 'status':
+        print_status(raw_file=args.raw)
+    else:
+        run_pipeline(raw_file=args.raw, force=args.force, mapping=args.mapping, parallel=not args.serial)
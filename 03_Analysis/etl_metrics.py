@@ -0,0 +1,308 @@
+import cProfile
+import glob
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import resource   # Windows 沒有，peak RSS 會記為 None
+except ImportError:
+    resource = None
+
+try:
+    import psutil     # 選用；沒有時 Linux 改讀 /proc
+except ImportError:
+    psutil = None
+
+# ==========================================
+# 📈 ETL 指標 (Metrics / Profiling)
+# ==========================================
+# clean_data.py / create_star_schema.py / generate_mapping.py / eccp.py 共用，每個階段記錄：
+# - 牆鐘時間、CPU 時間 (process 全部 thread + 該階段結束的子 process；thread_cpu_sec 只算執行該階段的 thread，
+#   children_cpu_sec 只算子 process，例如 clean_data 平行模式的 ProcessPool worker)
+# - 輸入 / 輸出筆數與每秒筆數
+# - peak RSS：階段執行期間背景 thread 每 RSS_SAMPLE_SEC 秒取樣一次的最高值 (本 process)，
+#   children_peak_rss_bytes 為同時存活的子 process RSS 合計最高值；需 psutil 或 Linux /proc，
+#   都沒有時 (macOS / Windows 未裝 psutil) 退回 process 至今最高值 (rss_sampled = False)
+# - 讀寫 bytes：有給 inputs / outputs 路徑時用檔案大小，否則用 /proc/self/io (僅 Linux)
+# - API 呼叫次數、延遲 (平均 / p95 / 最大)、錯誤與 429 次數
+# 輸出：
+# - JSON lines (每階段一行，METRICS_FOLDER/etl_metrics.jsonl)，可用 pandas.read_json(lines=True) 比較歷次執行
+# - 選用：Prometheus textfile (PROMETHEUS_FOLDER，給 node_exporter textfile collector 讀)
+# - 選用：PROFILE_STAGES 指定的階段跑 cProfile (.prof 可用 snakeviz / pstats 看)，
+#         或 PROFILER = 'py-spy' 時對本 process 啟動 py-spy record (需另外安裝 py-spy)
+# 平行建表時 cpu_sec / children_* 是整個 process 的數字，重疊的階段會重複計入 (peak RSS 則是各階段各自取樣)。
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+BASE_PATH = os.path.dirname(current_dir)
+
+METRICS_MODE = True
+METRICS_FOLDER = os.path.join(BASE_PATH, "02_ProcessedData", "_metrics")
+METRICS_FILE = "etl_metrics.jsonl"
+PROMETHEUS_FOLDER = None          # 例如 "/var/lib/node_exporter/textfile"；None = 不輸出
+PROFILE_STAGES = []               # 要剖析的階段名稱，['*'] = 全部
+PROFILER = 'cprofile'             # 'cprofile' / 'py-spy'
+RSS_SAMPLE_SEC = 0.05             # 各階段 RSS 取樣間隔 (比這更短的尖峰可能漏掉)
+
+def peak_rss_bytes():
+    """ process 至今的最高 RSS (整個 process 生命週期，不分階段) """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024   # Linux 單位是 KB，macOS 是 bytes
+
+def current_rss_bytes(pid=None):
+    """ 目前 RSS；pid = None 為本 process。無法取得 (process 已結束、非 Linux 且沒有 psutil) 時回傳 None """
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.Error:
+            return None
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+def child_pids():
+    """ 目前存活的子 process (ProcessPool worker 等) """
+    if psutil is not None:
+        try:
+            return [child.pid for child in psutil.Process().children(recursive=True)]
+        except psutil.Error:
+            return []
+    pids = []
+    for path in glob.glob('/proc/self/task/*/children'):
+        try:
+            with open(path) as f:
+                pids.extend(int(pid) for pid in f.read().split())
+        except (OSError, ValueError):
+            pass
+    return pids
+
+def children_cpu_sec():
+    """ 已結束 (已被 wait) 的子 process 累計 CPU 秒數 """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+class RssSampler:
+    """ 階段執行期間在背景取樣 RSS，記錄本 process 與子 process 合計的最高值 (各階段各自一個，重疊也互不影響) """
+
+    def __init__(self, interval=RSS_SAMPLE_SEC):
+        self.interval = interval
+        self.peak = None
+        self.children_peak = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def sample(self):
+        rss = current_rss_bytes()
+        if rss is not None:
+            self.peak = max(self.peak or 0, rss)
+        children = [current_rss_bytes(pid) for pid in child_pids()]
+        children = [r for r in children if r is not None]
+        if children:
+            self.children_peak = max(self.children_peak or 0, sum(children))
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self.sample()
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.sample()
+        return self
+
+def proc_io():
+    """ (讀取 bytes, 寫入 bytes)；非 Linux 回傳 None """
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(':') for line in f.read().splitlines())
+        return int(fields['rchar']), int(fields['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+def path_size(path):
+    """ 檔案大小；資料夾 (hive 分區) 則加總底下所有檔案 """
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+class MetricsRun:
+    """ 一次腳本執行；每個 stage() 區塊結束時寫一行 JSON (並更新 Prometheus textfile) """
+
+    def __init__(self, script, metrics_folder=METRICS_FOLDER, prometheus_folder=PROMETHEUS_FOLDER,
+                 profile_stages=PROFILE_STAGES, profiler=PROFILER, enabled=METRICS_MODE):
+        self.script = script
+        self.run_id = uuid.uuid4().hex[:12]
+        self.metrics_folder = metrics_folder
+        self.prometheus_folder = prometheus_folder
+        self.profile_stages = set(profile_stages or [])
+        self.profiler = profiler
+        self.enabled = enabled
+        self.records = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, rows_in=None, inputs=(), outputs=()):
+        """ 用法: with metrics.stage('read_csv', inputs=[path]) as rec: ...; rec['rows_out'] = len(df)
+        區塊內可設定 rec['rows_in'] / rec['rows_out'] / rec['extra']，API 呼叫用 metrics.api_call(rec, ...) """
+        rec = {'rows_in': rows_in, 'rows_out': None, 'api_latency': [], 'api_errors': 0, 'api_rate_limited': 0,
+               'extra': {}}
+        if not self.enabled:
+            yield rec
+            return
+        io_start = proc_io()
+        t0, cpu0, thread0 = time.perf_counter(), time.process_time(), time.thread_time()
+        children0 = children_cpu_sec()
+        sampler = RssSampler().start()
+        started_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+        stop_profile = self.start_profile(name)
+        status = 'ok'
+        try:
+            yield rec
+        except BaseException:
+            status = 'error'
+            raise
+        finally:
+            profile_file = stop_profile()
+            wall = time.perf_counter() - t0
+            sampler.stop()
+            children_cpu = children_cpu_sec() - children0 if children0 is not None else None
+            io_end = proc_io()
+            io_delta = (io_end[0] - io_start[0], io_end[1] - io_start[1]) if io_start and io_end else (None, None)
+            latency = rec['api_latency']
+            record = {
+                'run_id': self.run_id, 'script': self.script, 'stage': name, 'status': status,
+                'started_at': started_at, 'host': socket.gethostname(), 'pid': os.getpid(),
+                'wall_sec': round(wall, 4),
+                'cpu_sec': round(time.process_time() - cpu0 + (children_cpu or 0), 4),
+                'thread_cpu_sec': round(time.thread_time() - thread0, 4),
+                'children_cpu_sec': round(children_cpu, 4) if children_cpu is not None else None,
+                'rows_in': rec['rows_in'], 'rows_out': rec['rows_out'],
+                'rows_per_sec': round(rec['rows_out'] / wall, 1) if rec['rows_out'] and wall > 0 else None,
+                'peak_rss_bytes': sampler.peak if sampler.peak is not None else peak_rss_bytes(),
+                'children_peak_rss_bytes': sampler.children_peak,
+                'rss_sampled': sampler.peak is not None,
+                'bytes_read': sum(path_size(p) for p in inputs) if inputs else io_delta[0],
+                'bytes_written': sum(path_size(p) for p in outputs) if outputs else io_delta[1],
+                'api_calls': len(latency) + rec['api_errors'],
+                'api_errors': rec['api_errors'],
+                'api_rate_limited': rec['api_rate_limited'],
+                'api_latency_avg_sec': round(sum(latency) / len(latency), 4) if latency else None,
+                'api_latency_p95_sec': round(percentile(latency, 95), 4) if latency else None,
+                'api_latency_max_sec': round(max(latency), 4) if latency else None,
+                'profile_file': profile_file,
+                **rec['extra'],
+            }
+            self.emit(record)
+
+    def api_call(self, rec, latency_sec, error=None):
+        """ error: None (成功) / 'rate_limit' / 其他錯誤字串 """
+        with self.lock:
+            if error is None:
+                rec['api_latency'].append(latency_sec)
+            else:
+                rec['api_errors'] += 1
+                if error == 'rate_limit':
+                    rec['api_rate_limited'] += 1
+
+    def start_profile(self, name):
+        """ 回傳停止函式 (停止後回傳剖析檔路徑)；未指定剖析的階段回傳空操作 """
+        if not (self.profile_stages & {name, '*'}):
+            return lambda: None
+        folder = os.path.join(self.metrics_folder, "profiles")
+        os.makedirs(folder, exist_ok=True)
+        base = os.path.join(folder, f"{self.script}_{name}_{self.run_id}".replace(os.sep, '_'))
+
+        if self.profiler == 'py-spy':
+            if shutil.which('py-spy') is None:
+                print("   ⚠️ 找不到 py-spy，改用 cProfile")
+            else:
+                path = base + ".speedscope.json"
+                proc = subprocess.Popen(['py-spy', 'record', '--pid', str(os.getpid()), '--format', 'speedscope',
+                                         '--output', path, '--nonblocking'],
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+                def stop_py_spy():
+                    # py-spy 收到 SIGINT 才會寫出結果
+                    proc.send_signal(signal.SIGINT) if os.name != 'nt' else proc.terminate()
+                    proc.wait(timeout=30)
+                    return path
+                return stop_py_spy
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        def stop_cprofile():
+            profiler.disable()
+            path = base + ".prof"
+            profiler.dump_stats(path)
+            return path
+        return stop_cprofile
+
+    def emit(self, record):
+        with self.lock:
+            self.records.append(record)
+            os.makedirs(self.metrics_folder, exist_ok=True)
+            with open(os.path.join(self.metrics_folder, METRICS_FILE), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            if self.prometheus_folder:
+                self.write_prometheus()
+
+    def write_prometheus(self):
+        """ 每個腳本一個 .prom 檔 (整檔覆寫，只保留本次執行)；先寫暫存檔再替換，collector 不會讀到半份 """
+        metrics = [
+            ('wall_seconds', 'wall_sec'), ('cpu_seconds', 'cpu_sec'), ('rows_in', 'rows_in'),
+            ('rows_out', 'rows_out'), ('peak_rss_bytes', 'peak_rss_bytes'),
+            ('children_cpu_seconds', 'children_cpu_sec'), ('children_peak_rss_bytes', 'children_peak_rss_bytes'),
+            ('bytes_read', 'bytes_read'),
+            ('bytes_written', 'bytes_written'), ('api_calls', 'api_calls'), ('api_errors', 'api_errors'),
+            ('api_latency_avg_seconds', 'api_latency_avg_sec'), ('api_latency_p95_seconds', 'api_latency_p95_sec'),
+        ]
+        lines = []
+        for metric, field in metrics:
+            lines.append(f"# TYPE eccp_stage_{metric} gauge")
+            for rec in self.records:
+                if rec.get(field) is not None:
+                    labels = f'script="{self.script}",stage="{rec["stage"]}",status="{rec["status"]}"'
+                    lines.append(f"eccp_stage_{metric}{{{labels}}} {rec[field]}")
+        lines.append("# TYPE eccp_run_timestamp_seconds gauge")
+        lines.append(f'eccp_run_timestamp_seconds{{script="{self.script}"}} {time.time():.0f}')
+        os.makedirs(self.prometheus_folder, exist_ok=True)
+        path = os.path.join(self.prometheus_folder, f"eccp_{self.script}.prom")
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(path + ".tmp", path)
+
+    def summary(self):
+        """ 印出本次各階段耗時 (與 create_star_schema 的耗時表同格式) """
+        if not self.enabled or not self.records:
+            return
+        print(f"\n📈 [指標] run_id={self.run_id} -> {os.path.join(self.metrics_folder, METRICS_FILE)}")
+        for rec in self.records:
+            rows = f"{rec['rows_out']:>12,} 筆" if rec['rows_out'] is not None else " " * 15
+            rss = f"{rec['peak_rss_bytes'] / 1024 ** 2:>8,.0f} MB" if rec['peak_rss_bytes'] else ""
+            if rec.get('children_peak_rss_bytes'):
+                rss += f" + 子行程 {rec['children_peak_rss_bytes'] / 1024 ** 2:,.0f} MB"
+            print(f"   - {rec['stage']:<16} {rows} {rec['wall_sec']:>8.2f}s  CPU {rec['cpu_sec']:>7.2f}s {rss}")
@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+import pyarrow.parquet as pq
+
+# ==========================================
+# 📌 增量 ETL 狀態 (Watermark) 工具
+# ==========================================
+# clean_data.py / create_star_schema.py 的增量模式共用：
+# - 來源檔內容 hash：檔案沒變就整段跳過
+# - 狀態檔 (JSON)：記錄已處理的位元組數 / 筆數、build_id (create_star_schema 以 row group 接續)
+# - Parquet 附加：舊 row group 原封不動複製，新資料以新的 row group 接在後面
+
+def file_sha256(path, block_size=8 * 1024 * 1024, limit=None):
+    """ [指紋] 以 8MB 區塊計算檔案 SHA-256；limit: 只算前 limit 個位元組 (檢查前段是否不變) """
+    h = hashlib.sha256()
+    remaining = os.path.getsize(path) if limit is None else limit
+    with open(path, 'rb') as f:
+        while remaining > 0:
+            block = f.read(min(block_size, remaining))
+            if not block:
+                break
+            h.update(block)
+            remaining -= len(block)
+    return h.hexdigest()
+
+def load_state(path):
+    """ 讀取狀態檔，不存在或損毀時回傳空 dict (等同需要全量重建) """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_state(path, state):
+    """ 先寫暫存檔再替換，避免中途中斷留下半份 JSON """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def copy_row_groups(path, writer):
+    """ 把 path 的 row group 依序寫入已開啟的 ParquetWriter (schema 以 writer 為準)，回傳筆數 """
+    pf = pq.ParquetFile(path)
+    added = 0
+    for i in range(pf.num_row_groups):
+        table = pf.read_row_group(i).select(writer.schema.names).cast(writer.schema)
+        writer.write_table(table)
+        added += table.num_rows
+    return added
+
+def append_parquet(path, new_path, **writer_options):
+    """ [附加] 把 new_path 的 row group 接到 path 後面 (schema 以既有檔為準)，回傳新增筆數
+    writer_options: 傳給 ParquetWriter (例如 write_page_index) """
+    schema = pq.ParquetFile(path).schema_arrow
+    tmp_path = path + ".tmp"
+    with pq.ParquetWriter(tmp_path, schema, **writer_options) as writer:
+        copy_row_groups(path, writer)
+        added = copy_row_groups(new_path, writer)
+    os.replace(tmp_path, path)
+    return added
+
+def read_row_groups_from(path, start_row, columns=None):
+    """ [增量讀取] 只讀第 start_row 筆之後的 row group；邊界對不上時回傳 None (需全量重建) """
+    pf = pq.ParquetFile(path)
+    offset = 0
+    groups = []
+    for i in range(pf.num_row_groups):
+        n = pf.metadata.row_group(i).num_rows
+        if offset >= start_row:
+            groups.append(i)
+        elif offset + n > start_row:
+            return None
+        offset += n
+    if offset < start_row:
+        return None
+    if not groups:
+        return pf.schema_arrow.empty_table().select(columns or pf.schema_arrow.names).to_pandas()
+    return pf.read_row_groups(groups, columns=columns).to_pandas()
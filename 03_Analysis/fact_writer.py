@@ -0,0 +1,138 @@
+import os
+import shutil
+import uuid
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from etl_state import append_parquet
+
+# ==========================================
+# 🧱 Fact_Sales 寫出格式 (排序 / 分區 / 統計資訊)
+# ==========================================
+# 交易依「月 -> Customer_Key -> Product_Key」排序後寫出，每個 row group 只含單一月份：
+# - row group 的 min/max 統計與 page index 很精準，RFM / 增量 / 臨時分析用日期或客戶過濾時
+#   pyarrow 會直接跳過不相關的 row group，不必讀整個檔
+# - row group 內依 Customer_Key、Product_Key 排序 (寫入 sorting_columns metadata)
+# 兩種版面 (FACT_LAYOUT)：
+#   'file' -> 單一 Fact_Sales.parquet (Power BI partition 讀這個，預設)
+#   'hive' -> Fact_Sales/Year=2025/Month=6/part-*.parquet，可依分區直接略過整個資料夾
+#             (Power BI 需改用資料夾來源，請自行調整 partition)
+# pyarrow 目前不支援寫 bloom filter；Key 欄位以 dictionary 編碼 + page index 達到類似的跳讀效果。
+# 增量附加 (append_fact) 只在新交易內排序、接成新的 row group，不重排既有資料：內容與全量重建相同，
+# 但列順序不同 (RFM / PMF 的增量以「第 N 列之後是新資料」判斷，重排會破壞這個前提；
+# 全量重寫時 create_star_schema / eccp 會換新的 fact_write_id，讓 RFM / PMF 改為全量)。
+
+FACT_NAME = "Fact_Sales"
+FACT_LAYOUT = 'file'
+ROW_GROUP_SIZE = 250_000
+SORT_COLS = ['Customer_Key', 'Product_Key']
+PARTITION_COLS = ['Year', 'Month']
+
+def fact_path(folder):
+    """ 目前實際存在的 Fact_Sales 路徑 (hive 資料夾優先，否則為單一檔案) """
+    hive_dir = os.path.join(folder, FACT_NAME)
+    return hive_dir if os.path.isdir(hive_dir) else os.path.join(folder, f"{FACT_NAME}.parquet")
+
+def is_partitioned(folder):
+    return os.path.isdir(os.path.join(folder, FACT_NAME))
+
+def fact_dataset(folder):
+    """ 分區欄位 (Year / Month) 讀成一般整數，不用 dictionary (含空值分區時 pandas 才轉得過去) """
+    path = fact_path(folder)
+    if os.path.isdir(path):
+        return ds.dataset(path, format='parquet', partitioning=ds.HivePartitioning.discover(infer_dictionary=False))
+    return ds.dataset(path, format='parquet')
+
+def read_fact(folder, columns=None, filters=None):
+    """ 兩種版面都可讀；filters 會用分區與 row group 統計資訊跳讀 """
+    expression = pq.filters_to_expression(filters) if filters else None
+    return fact_dataset(folder).to_table(columns=columns, filter=expression).to_pandas()
+
+def count_fact_rows(folder):
+    return fact_dataset(folder).count_rows()
+
+def sort_fact(fact):
+    """ 依 (月, Customer_Key, Product_Key) 排序，回傳 (排序後的 DataFrame, 每列的月份 datetime64[M]) """
+    month = fact['POS_ShpDate'].to_numpy().astype('datetime64[M]')
+    keys = [fact[c].to_numpy() for c in reversed(SORT_COLS) if c in fact.columns]
+    # lexsort 以最後一個 key 為主；NaT 排在最後
+    month_code = np.where(np.isnat(month), np.iinfo('int64').max, month.view('int64'))
+    order = np.lexsort(keys + [month_code])
+    return fact.iloc[order].reset_index(drop=True), month[order]
+
+def month_slices(month):
+    """ 已排序月份陣列 -> [(start, length)]，每段為同一月份 """
+    codes = month.view('int64')
+    bounds = np.concatenate([[0], np.flatnonzero(codes[1:] != codes[:-1]) + 1, [len(codes)]])
+    return [(int(s), int(e - s)) for s, e in zip(bounds[:-1], bounds[1:])]
+
+def sorting_columns(schema):
+    names = [c for c in SORT_COLS if c in schema.names]
+    return pq.SortingColumn.from_ordering(schema, [(c, 'ascending') for c in names])
+
+def write_fact_file(fact, path, row_group_size=ROW_GROUP_SIZE):
+    """ 單一檔案：每個月份各自切 row group，不跨月 """
+    fact, month = sort_fact(fact)
+    table = pa.Table.from_pandas(fact, preserve_index=False)
+    tmp_path = path + ".tmp"
+    with pq.ParquetWriter(tmp_path, table.schema, write_statistics=True, write_page_index=True,
+                          sorting_columns=sorting_columns(table.schema)) as writer:
+        for start, length in month_slices(month):
+            writer.write_table(table.slice(start, length), row_group_size=row_group_size)
+        if table.num_rows == 0:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+    return table.num_rows
+
+def write_fact_hive(fact, base_dir, row_group_size=ROW_GROUP_SIZE, append=False):
+    """ Hive 分區：Year=/Month= 資料夾；append=True 時以新檔案加到既有分區 (增量) """
+    fact, month = sort_fact(fact)
+    table = pa.Table.from_pandas(fact, preserve_index=False)
+    years = month.astype('datetime64[Y]').astype('int64') + 1970
+    months = month.astype('int64') % 12 + 1
+    nat = np.isnat(month)
+    table = table.append_column('Year', pa.array(years, pa.int32(), mask=nat)) \
+                 .append_column('Month', pa.array(months, pa.int32(), mask=nat))
+    if not append and os.path.isdir(base_dir):
+        shutil.rmtree(base_dir)
+    file_options = ds.ParquetFileFormat().make_write_options(
+        write_statistics=True, write_page_index=True, sorting_columns=sorting_columns(table.schema))
+    ds.write_dataset(
+        table, base_dir, format='parquet',
+        partitioning=ds.partitioning(pa.schema([(c, pa.int32()) for c in PARTITION_COLS]), flavor='hive'),
+        file_options=file_options,
+        basename_template=f"part-{uuid.uuid4().hex[:8]}-{{i}}.parquet",
+        max_rows_per_group=row_group_size, min_rows_per_group=min(row_group_size, 10_000),
+        preserve_order=True, existing_data_behavior='overwrite_or_ignore',
+    )
+    return table.num_rows
+
+def write_fact(fact, folder, layout=FACT_LAYOUT, row_group_size=ROW_GROUP_SIZE):
+    """ [全量] 依版面寫出 Fact_Sales，並移除另一種版面的舊檔 (避免讀到過期資料) """
+    file_path = os.path.join(folder, f"{FACT_NAME}.parquet")
+    hive_dir = os.path.join(folder, FACT_NAME)
+    if layout == 'hive':
+        rows = write_fact_hive(fact, hive_dir, row_group_size)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    elif layout == 'file':
+        rows = write_fact_file(fact, file_path, row_group_size)
+        if os.path.isdir(hive_dir):
+            shutil.rmtree(hive_dir)
+    else:
+        raise ValueError(f"未知的 FACT_LAYOUT: {layout} (只接受 file / hive)")
+    return rows
+
+def append_fact(delta, folder, row_group_size=ROW_GROUP_SIZE):
+    """ [增量] 新交易附加到現有 Fact_Sales (沿用現有版面)，回傳新增筆數 """
+    if is_partitioned(folder):
+        return write_fact_hive(delta, os.path.join(folder, FACT_NAME), row_group_size, append=True)
+    path = os.path.join(folder, f"{FACT_NAME}.parquet")
+    delta_path = path + ".delta"
+    write_fact_file(delta, delta_path, row_group_size)
+    schema = pq.read_schema(path)
+    added = append_parquet(path, delta_path, write_statistics=True, write_page_index=True,
+                           sorting_columns=sorting_columns(schema))
+    os.remove(delta_path)
+    return added
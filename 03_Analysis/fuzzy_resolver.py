@@ -0,0 +1,85 @@
+from collections import defaultdict
+import numpy as np
+from rapidfuzz import fuzz, process
+from classification_cache import normalize_name
+
+# ==========================================
+# 🔍 模糊比對預先判讀 (Fuzzy Pre-Resolver)
+# ==========================================
+# 新客戶名稱先和帳本 (Original_CustName -> Parent_Group) 做模糊比對，
+# 夠像的直接沿用帳本的集團與分類，只有真正沒看過的名字才送 AI。
+# - 比對前去掉公司型態字尾 (INC / LLC / CORP...)，避免 "ACME INC" 只因字尾和 "ABC INC" 相似
+# - Blocking：只和「第一個字前綴」或「排序後第一個字前綴」相同的帳本名稱比，不做全配對
+# - 每個 block 用 rapidfuzz.process.cdist 一次算整個分數矩陣 (C++ 多執行緒)
+
+FUZZY_THRESHOLD = 92          # token_sort_ratio 分數 (0-100)，達到才算同一客戶
+BLOCK_PREFIX_LEN = 4          # blocking key 取前幾個字元 (容許字尾打錯)
+MAX_BLOCK_CELLS = 5_000_000   # 單次 cdist 矩陣上限 (筆數 x 筆數)，控制記憶體
+LEGAL_SUFFIXES = {'INC', 'INCORPORATED', 'LLC', 'LLP', 'LP', 'LTD', 'LIMITED', 'CORP', 'CORPORATION',
+                  'CO', 'COMPANY', 'PLC', 'GMBH', 'THE'}
+
+def match_key(name):
+    """ 標準化名稱去掉公司型態字尾，作為比對字串 """
+    return " ".join(t for t in normalize_name(name).split() if t not in LEGAL_SUFFIXES)
+
+def block_keys(key):
+    """ 一個名稱所屬的 block：第一個字前綴 + 字母序最小的字前綴 (處理字序顛倒) """
+    tokens = key.split()
+    if not tokens:
+        return set()
+    return {'F:' + tokens[0][:BLOCK_PREFIX_LEN], 'S:' + min(tokens)[:BLOCK_PREFIX_LEN]}
+
+def build_block_index(keys):
+    """ block key -> 名稱位置 (np.array) """
+    index = defaultdict(list)
+    for i, key in enumerate(keys):
+        for block in block_keys(key):
+            index[block].append(i)
+    return {block: np.array(idx) for block, idx in index.items()}
+
+def fuzzy_resolve(names, ledger_lookup, threshold=FUZZY_THRESHOLD, max_block_cells=MAX_BLOCK_CELLS):
+    """ [主流程] names: 新客戶原始名稱；ledger_lookup: {標準化名稱: {'Parent_Group', 'Category'}}
+    回傳 {原始名稱: {'Parent_Group', 'Category', 'Matched', 'Score'}}，只含達到門檻的名稱 """
+    if not names or not ledger_lookup:
+        return {}
+
+    ledger_norms = list(ledger_lookup)
+    ledger_keys = np.array([match_key(n) for n in ledger_norms], dtype=object)
+    ledger_index = build_block_index(ledger_keys)
+
+    # 同一個比對字串只算一次
+    query_names = defaultdict(list)
+    for name in names:
+        key = match_key(name)
+        if key:
+            query_names[key].append(name)
+    query_keys = np.array(list(query_names), dtype=object)
+    query_index = build_block_index(query_keys)
+
+    best_score = np.zeros(len(query_keys), dtype=np.uint8)
+    best_match = np.full(len(query_keys), -1, dtype=np.int64)
+    for block, q_idx in query_index.items():
+        l_idx = ledger_index.get(block)
+        if l_idx is None:
+            continue
+        step = max(1, max_block_cells // len(l_idx))
+        for start in range(0, len(q_idx), step):
+            chunk = q_idx[start:start+step]
+            # 低於門檻的分數為 0；小矩陣開執行緒反而慢，單執行緒即可
+            workers = -1 if len(chunk) * len(l_idx) >= 100_000 else 1
+            scores = process.cdist(query_keys[chunk], ledger_keys[l_idx], scorer=fuzz.token_sort_ratio,
+                                   score_cutoff=threshold, dtype=np.uint8, workers=workers)
+            top = scores.argmax(axis=1)
+            top_score = scores[np.arange(len(chunk)), top]
+            better = top_score > best_score[chunk]
+            best_score[chunk[better]] = top_score[better]
+            best_match[chunk[better]] = l_idx[top[better]]
+
+    results = {}
+    for q in np.flatnonzero(best_match >= 0):
+        matched = ledger_norms[best_match[q]]
+        row = ledger_lookup[matched]
+        for name in query_names[query_keys[q]]:
+            results[name] = {'Parent_Group': row['Parent_Group'], 'Category': row['Category'],
+                             'Matched': matched, 'Score': int(best_score[q])}
+    return results
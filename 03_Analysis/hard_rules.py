@@ -0,0 +1,55 @@
+import os
+import re
+import pandas as pd
+
+# ==========================================
+# 📏 硬規則引擎 (Config-Driven Hard Rules)
+# ==========================================
+# 規則放在 99_Config/Hard_Rules.csv，新增關鍵字不必改程式：
+#   Rule_Type = Category -> 名稱含 Keyword 時，Category = Value
+#   Rule_Type = Group    -> 已命中分類的名稱含 Keyword 時，Parent_Group = Value
+#   Priority 數字越小越優先 (例如 SI=1 先於 OEM=2，同一名稱同時命中時取 SI)
+# Keyword 為大寫子字串比對，前後空白有意義 ('GE ' 不會命中 'GENERAL')，請保留引號。
+# 同一 Priority 的關鍵字編譯成一條 alternation regex，整欄向量化比對 (Arrow / RE2)，
+# 每個 Priority 只掃一次名稱欄位，不再逐列逐關鍵字 any(...)。
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+RULES_FILE = os.path.join(os.path.dirname(current_dir), "99_Config", "Hard_Rules.csv")
+
+def load_rules(rules_file=RULES_FILE):
+    """ 讀取規則表 -> {'Category': [(pattern, value), ...], 'Group': [...]}，依 Priority 排序 """
+    df = pd.read_csv(rules_file, dtype={'Rule_Type': str, 'Value': str, 'Keyword': str}, keep_default_na=False)
+    df = df[df['Keyword'] != ''].sort_values('Priority', kind='stable')
+    rules = {'Category': [], 'Group': []}
+    for (rule_type, _, value), group in df.groupby(['Rule_Type', 'Priority', 'Value'], sort=False):
+        if rule_type not in rules:
+            raise ValueError(f"未知的 Rule_Type: {rule_type} (只接受 Category / Group)")
+        pattern = "|".join(re.escape(k.upper()) for k in group['Keyword'])
+        rules[rule_type].append((pattern, value))
+    return rules
+
+def apply_rules(names, rules):
+    """ [向量化] names (list / Series) -> DataFrame(Original_CustName, Category, Parent_Group)
+    沒命中任何分類規則的 Category 為 NaN；命中者 Parent_Group 預設為原名稱 """
+    names = pd.Series(names, dtype=object).reset_index(drop=True)
+    upper = names.astype(str).astype('string[pyarrow]').str.upper()
+
+    category = pd.Series(None, index=names.index, dtype=object)
+    for pattern, value in rules['Category']:
+        todo = category.isna()
+        if not todo.any():
+            break
+        hit = upper[todo].str.contains(pattern, regex=True)
+        category[hit[hit].index] = value
+
+    parent_group = names.where(category.notna())
+    matched = category.notna()
+    group_todo = matched.copy()
+    for pattern, value in rules['Group']:
+        if not group_todo.any():
+            break
+        hit = upper[group_todo].str.contains(pattern, regex=True)
+        parent_group[hit[hit].index] = value
+        group_todo[hit[hit].index] = False
+
+    return pd.DataFrame({'Original_CustName': names, 'Category': category, 'Parent_Group': parent_group})
@@ -0,0 +1,136 @@
+import argparse
+import os
+import warnings
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.worksheet.table import Table, TableColumn, TableStyleInfo
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.datavalidation import DataValidation
+from etl_state import load_state, save_state
+
+# ==========================================
+# 📒 黃金帳本儲存 (Ledger Store)
+# ==========================================
+# 帳本正本改存 Parquet (欄式、秒讀秒寫)，Excel 只是給人工確認用的「匯出/匯入」介面：
+# - generate_mapping.py / create_star_schema.py 都讀寫 Parquet，不再來回開 openpyxl
+# - 需要人工確認時: python ledger_store.py export  (write-only 模式產生格式化 xlsx)
+# - 人工改完 Excel:  python ledger_store.py import  (依 Original_CustName 合併回帳本)
+# - 忘記 import 也沒關係：Excel 比上次同步還新時，load_ledger() 會自動合併
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+BASE_PATH = os.path.dirname(current_dir)
+LEDGER_FILE = os.path.join(BASE_PATH, "99_Config", "Customer_Parent_Mapping.parquet")
+EXCEL_FILE = os.path.join(BASE_PATH, "99_Config", "Customer_Parent_Mapping.xlsx")
+LEDGER_STATE_FILE = "_ledger_state.json"   # 與帳本 Parquet 同資料夾，記錄上次同步的 Excel 時間戳
+
+LEDGER_COLS = ['Original_CustName', 'Parent_Group', 'Category', 'Source']
+KEY_COL = 'Original_CustName'
+
+CATEGORY_OPTIONS = ['OEM', 'SI', 'EMS', 'Education', 'Government', 'Distributor', 'Healthcare', 'Uncategorized', 'Other']
+SOURCE_OPTIONS = ['Manual', 'Gemini-AI', 'Hard-Rule', 'Cache', 'Fuzzy-Match', 'Check-Manually']
+
+def empty_ledger():
+    return pd.DataFrame({c: pd.Series(dtype=object) for c in LEDGER_COLS})
+
+def normalize_ledger(df):
+    """ 欄位對齊 (舊版欄名 Tag / Note)、補空值，依 Key 去重 (保留最後一筆) """
+    df = df.rename(columns=lambda c: str(c).strip()).rename(columns={'Tag': 'Category', 'Note': 'Source'})
+    for col in LEDGER_COLS:
+        if col not in df.columns:
+            df[col] = ''
+    df = df[LEDGER_COLS].astype(object)
+    df = df[df[KEY_COL].notna()]
+    df['Category'] = df['Category'].fillna('Uncategorized').replace('', 'Uncategorized')
+    df['Parent_Group'] = df['Parent_Group'].fillna(df[KEY_COL])
+    return df.drop_duplicates(subset=[KEY_COL], keep='last').reset_index(drop=True)
+
+def save_ledger(df, ledger_file=LEDGER_FILE):
+    """ 先寫暫存檔再替換，避免中斷留下半個檔案 """
+    df = df.sort_values(by=['Source', KEY_COL], kind='stable').reset_index(drop=True)
+    tmp_path = ledger_file + ".tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, ledger_file)
+    return df
+
+def upsert(ledger, new_rows):
+    """ 依 Original_CustName 更新或新增 (new_rows 優先) """
+    if new_rows is None or len(new_rows) == 0:
+        return ledger
+    return normalize_ledger(pd.concat([ledger, pd.DataFrame(new_rows)], ignore_index=True))
+
+def state_path(ledger_file, state_name=LEDGER_STATE_FILE):
+    return os.path.join(os.path.dirname(ledger_file), state_name)
+
+def excel_mtime(excel_file):
+    return os.path.getmtime(excel_file) if os.path.exists(excel_file) else None
+
+def load_ledger(ledger_file=LEDGER_FILE, excel_file=EXCEL_FILE, state_name=LEDGER_STATE_FILE):
+    """ [讀取] 回傳帳本 DataFrame；首次使用時由既有 Excel 轉入，Excel 有新的人工修改時自動合併 """
+    if os.path.exists(ledger_file):
+        ledger = normalize_ledger(pd.read_parquet(ledger_file))
+    else:
+        ledger = empty_ledger()
+
+    mtime = excel_mtime(excel_file)
+    if mtime is not None and mtime != load_state(state_path(ledger_file, state_name)).get('excel_mtime'):
+        print("   📥 Excel 帳本有更新，合併人工修改...")
+        ledger = import_excel(excel_file, ledger_file, state_name, ledger=ledger)
+    return ledger
+
+def import_excel(excel_file=EXCEL_FILE, ledger_file=LEDGER_FILE, state_name=LEDGER_STATE_FILE, ledger=None):
+    """ [匯入] Excel 的每一列依 Key 覆蓋帳本 (人工修改優先)，Excel 沒有的列保留不動 """
+    if ledger is None:
+        ledger = normalize_ledger(pd.read_parquet(ledger_file)) if os.path.exists(ledger_file) else empty_ledger()
+    edited = normalize_ledger(pd.read_excel(excel_file))
+    ledger = save_ledger(upsert(ledger, edited), ledger_file)
+    save_state(state_path(ledger_file, state_name), {'excel_mtime': excel_mtime(excel_file)})
+    print(f"   ✅ 已合併 {len(edited):,} 筆 Excel 資料，帳本共 {len(ledger):,} 筆")
+    return ledger
+
+def export_excel(ledger=None, excel_file=EXCEL_FILE, ledger_file=LEDGER_FILE, state_name=LEDGER_STATE_FILE):
+    """ [匯出] write-only 模式產生格式化 xlsx (表格樣式、欄寬、下拉選單)，不逐格回讀 """
+    if ledger is None:
+        ledger = load_ledger(ledger_file, excel_file, state_name)
+    ledger = ledger[LEDGER_COLS]
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Mapping")
+    # 欄寬：向量化算最長字串長度，上限 50
+    for i, col in enumerate(LEDGER_COLS, start=1):
+        length = max(len(col), int(ledger[col].astype(str).str.len().max() or 0)) if len(ledger) else len(col)
+        ws.column_dimensions[get_column_letter(i)].width = min(length + 2, 50)
+
+    last_row = max(len(ledger) + 1, 2)
+    dv_cat = DataValidation(type="list", formula1=f'"{",".join(CATEGORY_OPTIONS)}"', allow_blank=True)
+    dv_cat.add(f'C2:C{last_row}')
+    dv_source = DataValidation(type="list", formula1=f'"{",".join(SOURCE_OPTIONS)}"', allow_blank=True)
+    dv_source.add(f'D2:D{last_row}')
+    ws.data_validations.append(dv_cat)
+    ws.data_validations.append(dv_source)
+
+    tab = Table(displayName="CustomerMapping", ref=f"A1:{get_column_letter(len(LEDGER_COLS))}{last_row}")
+    tab.tableStyleInfo = TableStyleInfo(name="TableStyleMedium9", showFirstColumn=False,
+                                        showLastColumn=False, showRowStripes=True, showColumnStripes=False)
+    # write-only 模式不會回讀表頭，欄名要自己給
+    tab.tableColumns = [TableColumn(id=i, name=col) for i, col in enumerate(LEDGER_COLS, start=1)]
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')   # 欄名已手動給，略過 openpyxl 的 write-only 提醒
+        ws.add_table(tab)
+
+    ws.append(LEDGER_COLS)
+    for row in ledger.itertuples(index=False, name=None):
+        ws.append(row)
+    wb.save(excel_file)
+    # 剛匯出的 Excel 與帳本一致，記下時間戳，之後有人工修改才會觸發合併
+    save_state(state_path(ledger_file, state_name), {'excel_mtime': excel_mtime(excel_file)})
+    print(f"   📤 已匯出 {len(ledger):,} 筆到 {excel_file}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="黃金帳本 Excel 匯出 / 匯入")
+    parser.add_argument('action', choices=['export', 'import'])
+    parser.add_argument('--excel', default=EXCEL_FILE)
+    args = parser.parse_args()
+    if args.action == 'export':
+        export_excel(excel_file=args.excel)
+    else:
+        import_excel(excel_file=args.excel)
@@ -0,0 +1,62 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# ==========================================
+# 💲 金額 / 數量清洗引擎 (Arrow 向量化)
+# ==========================================
+# 取代 astype(str) -> str.replace x2 -> str.strip -> pd.to_numeric 的逐欄 Python 物件處理：
+# 直接在 Arrow 字串陣列上做去符號 + regex 驗證 + 轉型，全部是 C++ kernel。
+# 規則與舊版一致：金額去掉 $ 與 ,；數量只去 ,；前後空白忽略；無法解析的值 (含空值) 補 0。
+
+# 去符號用字面值取代 (比 regex 取代快約 3 倍)
+MONEY_STRIP_CHARS = ['$', ',']
+QTY_STRIP_CHARS = [',']
+# 一般十進位 / 科學記號 (例如 1234.50、-3、.5、1e5)
+NUMBER_PATTERN = r"^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$"
+
+def to_arrow_strings(series):
+    """ pandas Series -> Arrow 字串陣列 (NaN 轉為 null) """
+    if isinstance(series.dtype, pd.ArrowDtype) or str(series.dtype).startswith('string'):
+        return pa.array(series, type=pa.string(), from_pandas=True)
+    try:
+        return pa.array(series.to_numpy(dtype=object), type=pa.string(), from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # 混合型別 (例如同欄有數字與字串) 才退回逐筆轉字串
+        return pa.array(series.astype(str).to_numpy(dtype=object), type=pa.string(), from_pandas=True)
+
+def parse_numeric(arr, strip_chars):
+    """ [核心] Arrow 字串陣列 -> (float64 陣列 (無法解析補 0), 被補 0 的 mask) """
+    for ch in strip_chars:
+        arr = pc.replace_substring(arr, ch, "")
+    cleaned = pc.utf8_trim_whitespace(arr)
+    valid = pc.fill_null(pc.match_substring_regex(cleaned, NUMBER_PATTERN), False)
+    values = pc.cast(pc.if_else(valid, cleaned, pa.scalar(None, pa.string())), pa.float64())
+    return pc.fill_null(values, 0.0), pc.invert(valid)
+
+def clean_numeric_series(series, strip_chars=MONEY_STRIP_CHARS, return_mask=False):
+    """ 單一欄位清洗，回傳 (float64 Series, 被補 0 的筆數)
+    return_mask=True 時改回傳 (float64 Series, 被補 0 的 bool 陣列)，供品質規則使用 """
+    if pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+        # 讀檔時已是數字 (例如沒有 $ 的 Qty)，只需補空值
+        mask = series.isna().to_numpy()
+        return series.astype('float64').fillna(0), mask if return_mask else int(mask.sum())
+    values, coerced_mask = parse_numeric(to_arrow_strings(series), strip_chars)
+    result = pd.Series(values.to_numpy(zero_copy_only=False), index=series.index, name=series.name)
+    if return_mask:
+        return result, coerced_mask.to_numpy(zero_copy_only=False)
+    return result, int(pc.sum(pc.cast(coerced_mask, pa.int64())).as_py() or 0)
+
+def clean_numeric_columns(df, money_cols, qty_cols, masks=None):
+    """ [批次] 一次處理所有金額與數量欄位，回傳 (df, {欄位: 被補 0 的筆數})
+    masks: 傳入 dict 時另外記下每欄「被補 0」的 bool 陣列 (不必再掃一次字串) """
+    coerced = {}
+    for cols, strip_chars in [(money_cols, MONEY_STRIP_CHARS), (qty_cols, QTY_STRIP_CHARS)]:
+        for col in cols:
+            if col in df.columns:
+                if masks is None:
+                    df[col], coerced[col] = clean_numeric_series(df[col], strip_chars)
+                else:
+                    df[col], masks[col] = clean_numeric_series(df[col], strip_chars, return_mask=True)
+                    coerced[col] = int(masks[col].sum())
+    return df, coerced
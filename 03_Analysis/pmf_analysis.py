@@ -0,0 +1,303 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from etl_state import load_state, save_state, read_row_groups_from
+from fact_writer import fact_path, fact_dataset, read_fact, count_fact_rows, is_partitioned
+from aggregations import lookup, tmdl_table, write_tmdl, add_model_refs, MODEL_FOLDER
+
+# ==========================================
+# 🧺 PMF (Product-Market-Fit) 分析引擎：同期群留存 + 購物籃關聯
+# ==========================================
+# 讀 BI_Tables/Fact_Sales + Dim_Product，產出 (Power BI 直接讀 Parquet)：
+#   Fact_PMF_Cohort    (Level x Item x Cohort_Month x Month_Offset) 同期群留存
+#   Fact_PMF_Repeat    (Level x Item x Cohort_Month) 回購率
+#   Fact_PMF_Affinity  (Level x Item_A x Item_B) 共同購買關聯 (Support / Confidence / Lift)
+# - 同期群：客戶第一次購買某產品群 (Level = All / Group Roll-UP / Product Group) 的月份；
+#   Month_Offset = k 代表首購後第 k 個月仍有購買該產品群的客戶數 / 同期群人數
+# - 購物籃：以客戶為籃 (截至最後交易日曾買過的品項)，Level = AdjPtNo / Product Line
+#   客戶 x 品項建成 CSR 稀疏矩陣 (indptr / indices)，共同購買數 = X^T X 的上三角，
+#   依客戶分批展開 (每批最多 PAIR_CHUNK 個組合)，不做 pandas self-join，記憶體不隨全目錄的品項數平方成長
+# - 增量：中間結果只存「客戶 x 品項 x 月份」的購買紀錄 (_pmf_activity.parquet，去重後遠小於交易數)；
+#   新月份只讀上次最後一個月 (可能不完整) 之後的交易 + 上次之後才附加的補登交易，聯集後重算三張表
+#   (三張表都由購買紀錄算出，只需幾秒)。Fact_Sales 全量重寫 (fact_write_id 換了) 或 hive 版面時一律全量。
+# - SCD2 (create_star_schema.SCD_MODE) 時以 Product_Version_Key 取交易當時的產品群
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+BASE_PATH = os.path.dirname(current_dir)
+BI_FOLDER = os.path.join(BASE_PATH, "02_ProcessedData", "BI_Tables")
+
+PMF_STATE_FILE = "_pmf_state.json"             # 放在 BI_Tables
+PMF_ACTIVITY_FILE = "_pmf_activity.parquet"    # 客戶 x 品項 x 月份 購買紀錄
+STAR_STATE_FILE = "_star_state.json"
+
+COHORT_LEVELS = ['All', 'Group Roll-UP', 'Product Group']
+AFFINITY_LEVELS = ['AdjPtNo', 'Product Line']
+MIN_PAIR_CUSTOMERS = 3       # 共同購買客戶數低於此值的組合不輸出 (品項多時組合數很大)
+PAIR_CHUNK = 5_000_000       # 每批最多展開的品項組合數 (控制記憶體)
+
+ACTIVITY_COLS = ['Level', 'Item', 'Customer_Key', 'Month_Start']
+PMF_TABLES = {
+    'Fact_PMF_Cohort': ['Level', 'Item', 'Cohort_Month', 'Month_Offset', 'Active_Customers', 'Cohort_Size',
+                        'Retention_Rate'],
+    'Fact_PMF_Repeat': ['Level', 'Item', 'Cohort_Month', 'Customers', 'Repeat_Customers', 'Repeat_Rate',
+                        'Avg_Active_Months'],
+    'Fact_PMF_Affinity': ['Level', 'Item_A', 'Item_B', 'Customers_A', 'Customers_B', 'Pair_Customers',
+                          'Support', 'Confidence_A_B', 'Confidence_B_A', 'Lift'],
+}
+
+# ==========================================
+# 📒 購買紀錄 (增量基底)
+# ==========================================
+
+def read_sales(bi_folder, start=None):
+    """ 只讀 PMF 需要的 Key 與日期 (有 Product_Version_Key 時一併讀取)；start 以前的月份交給 Parquet 跳讀 """
+    names = fact_dataset(bi_folder).schema.names
+    columns = [c for c in ['Customer_Key', 'Product_Key', 'Product_Version_Key', 'POS_ShpDate'] if c in names]
+    filters = [('POS_ShpDate', '>=', pd.Timestamp(start))] if start is not None else None
+    return read_fact(bi_folder, columns=columns, filters=filters)
+
+def build_activity(sales, dim_product):
+    """ 交易 -> 每個 Level 的 (品項, 客戶, 月份) 去重購買紀錄 """
+    sales = sales[sales['POS_ShpDate'].notna()]
+    month = sales['POS_ShpDate'].to_numpy().astype('datetime64[M]').astype('datetime64[ns]')
+    keys = [c for c in ['Customer_Key', 'Product_Key', 'Product_Version_Key'] if c in sales.columns]
+    base = sales[keys].assign(Month_Start=month).drop_duplicates()
+    frames = []
+    for level in dict.fromkeys(COHORT_LEVELS + AFFINITY_LEVELS):
+        if level == 'All':
+            item = pd.Series('All', index=base.index)
+        else:
+            item = lookup(base, dim_product, 'Product_Key', level).fillna('Unknown').astype(str)
+        frames.append(pd.DataFrame({'Level': level, 'Item': item.to_numpy(), 'Customer_Key': base['Customer_Key'].to_numpy(),
+                                    'Month_Start': base['Month_Start'].to_numpy()}).drop_duplicates())
+    return pd.concat(frames, ignore_index=True)[ACTIVITY_COLS]
+
+def load_activity(bi_folder, dim_product, full=False):
+    """ 取得截至最新交易的購買紀錄；條件允許時由上次的紀錄增量更新。回傳 (紀錄, Fact_Sales 筆數) """
+    state = load_state(os.path.join(bi_folder, PMF_STATE_FILE))
+    star_state = load_state(os.path.join(bi_folder, STAR_STATE_FILE))
+    activity_path = os.path.join(bi_folder, PMF_ACTIVITY_FILE)
+    total_rows = count_fact_rows(bi_folder)
+
+    can_increment = (
+        not full and state and os.path.exists(activity_path) and not is_partitioned(bi_folder)
+        and star_state.get('fact_write_id') is not None
+        and state.get('fact_write_id') == star_state.get('fact_write_id')
+        and total_rows >= state.get('source_rows', 0)
+    )
+    if can_increment:
+        last_month = pd.Timestamp(state['last_month'])
+        # 1) 上次最後一個月 (可能只有部分交易) 以後的交易
+        window = read_sales(bi_folder, start=last_month)
+        # 2) 上次之後才附加、但日期在上次最後一個月以前的補登交易
+        late = read_row_groups_from(fact_path(bi_folder), state['source_rows'], columns=list(window.columns))
+        if late is not None:
+            late = late[late['POS_ShpDate'] < last_month]
+            print(f"   - ♻️ 由 {last_month:%Y-%m} 起增量更新 (新月份 {len(window):,} 筆，補登 {len(late):,} 筆)")
+            delta = build_activity(pd.concat([window, late], ignore_index=True), dim_product)
+            activity = pd.concat([pd.read_parquet(activity_path), delta], ignore_index=True).drop_duplicates()
+            return activity.reset_index(drop=True), total_rows
+        print("   - 📌 Fact_Sales row group 邊界與上次不符，改為全量計算")
+
+    print("   - 📖 全量計算 (讀取所有歷史交易)...")
+    return build_activity(read_sales(bi_folder), dim_product), total_rows
+
+# ==========================================
+# 📈 同期群 / 回購
+# ==========================================
+
+def month_index(month_start):
+    return month_start.to_numpy().astype('datetime64[M]').astype('int64')
+
+def customer_months(activity):
+    """ 同期群層級的紀錄 + 每位客戶在該品項的首購月 (整數月份) 與購買月數 """
+    cohort = activity[activity['Level'].isin(COHORT_LEVELS)]
+    group = cohort.groupby(['Level', 'Item'], sort=False).ngroup().to_numpy()
+    months = month_index(cohort['Month_Start'])
+    frame = pd.DataFrame({'group': group, 'Customer_Key': cohort['Customer_Key'].to_numpy(), 'month': months})
+    by_customer = frame.groupby(['group', 'Customer_Key'], sort=False)['month']
+    frame['first'] = by_customer.transform('min').to_numpy()
+    frame['n_months'] = by_customer.transform('size').to_numpy()
+    labels = cohort[['Level', 'Item']].assign(group=group).drop_duplicates('group').set_index('group')
+    return frame, labels
+
+def to_month_start(month_codes):
+    return np.asarray(month_codes, dtype='int64').astype('datetime64[M]').astype('datetime64[ns]')
+
+def attach_labels(table, labels):
+    table = table.join(labels, on='group').drop(columns=['group'])
+    return table[['Level', 'Item'] + [c for c in table.columns if c not in ('Level', 'Item')]]
+
+def build_cohorts(frame, labels):
+    """ 首購月 x 經過月數 -> 仍有購買的客戶數 / 同期群人數 """
+    offsets = frame.assign(Month_Offset=frame['month'] - frame['first'])
+    cohort = offsets.groupby(['group', 'first', 'Month_Offset'], sort=True).size().rename('Active_Customers').reset_index()
+    size = cohort[cohort['Month_Offset'] == 0].set_index(['group', 'first'])['Active_Customers']
+    cohort['Cohort_Size'] = pd.MultiIndex.from_frame(cohort[['group', 'first']]).map(size).to_numpy()
+    cohort['Retention_Rate'] = cohort['Active_Customers'] / cohort['Cohort_Size']
+    cohort['Cohort_Month'] = to_month_start(cohort.pop('first'))
+    return attach_labels(cohort, labels)[PMF_TABLES['Fact_PMF_Cohort']]
+
+def build_repeat(frame, labels):
+    """ 每個同期群中，在兩個 (含) 以上月份購買該品項的客戶比例 """
+    customers = frame.drop_duplicates(['group', 'Customer_Key'])
+    repeat = customers.assign(is_repeat=customers['n_months'] >= 2).groupby(['group', 'first'], sort=True).agg(
+        Customers=('Customer_Key', 'size'),
+        Repeat_Customers=('is_repeat', 'sum'),
+        Avg_Active_Months=('n_months', 'mean'),
+    ).reset_index()
+    repeat['Repeat_Rate'] = repeat['Repeat_Customers'] / repeat['Customers']
+    repeat['Cohort_Month'] = to_month_start(repeat.pop('first'))
+    return attach_labels(repeat, labels)[PMF_TABLES['Fact_PMF_Repeat']]
+
+# ==========================================
+# 🛒 購物籃關聯 (稀疏矩陣)
+# ==========================================
+
+def incidence_matrix(customers, items):
+    """ 客戶 x 品項 0/1 矩陣 (CSR)：回傳 (indptr, indices, 品項標籤)，每列的 indices 由小到大
+    品項標籤依名稱排序 (不依出現順序)：組合固定為 Item_A < Item_B，增量與全量結果相同 """
+    cust_codes, _ = pd.factorize(customers)
+    item_codes, item_labels = pd.factorize(items, sort=True)
+    n_customers = int(cust_codes.max()) + 1 if len(cust_codes) else 0
+    pairs = np.unique(cust_codes.astype('int64') * len(item_labels) + item_codes)    # 去重 + 依 (客戶, 品項) 排序
+    rows = pairs // max(len(item_labels), 1)
+    indices = pairs - rows * len(item_labels)
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=n_customers))])
+    return indptr, indices, np.asarray(item_labels)
+
+def cooccurrence(indptr, indices, n_items, chunk_pairs=PAIR_CHUNK):
+    """ [X^T X 上三角] 回傳 (品項 a, 品項 b, 共同購買客戶數)，a < b
+    依客戶 (列) 分批：每批把每列的非零元素兩兩展開成 a * n_items + b，np.unique 計數後再跨批加總 """
+    sizes = np.diff(indptr)
+    cumulative = np.cumsum(sizes * (sizes - 1) // 2)
+    codes, counts = [], []
+    row, n_rows = 0, len(sizes)
+    while row < n_rows:
+        done = cumulative[row - 1] if row else 0
+        end = max(int(np.searchsorted(cumulative, done + chunk_pairs, side='right')), row + 1)
+        end = min(end, n_rows)
+        lo, hi = indptr[row], indptr[end]
+        if cumulative[end - 1] > done:
+            pos = np.arange(lo, hi)
+            partners = np.repeat(indptr[row + 1:end + 1], sizes[row:end]) - pos - 1    # 同一列中排在後面的元素數
+            left = np.repeat(pos, partners)
+            starts = np.cumsum(partners) - partners
+            right = left + 1 + (np.arange(len(left)) - np.repeat(starts, partners))
+            chunk_codes, chunk_counts = np.unique(indices[left] * n_items + indices[right], return_counts=True)
+            codes.append(chunk_codes)
+            counts.append(chunk_counts)
+        row = end
+    if not codes:
+        empty = np.array([], dtype='int64')
+        return empty, empty, empty
+    codes, counts = np.concatenate(codes), np.concatenate(counts)
+    order = np.argsort(codes, kind='stable')
+    codes, counts = codes[order], counts[order]
+    starts = np.flatnonzero(np.concatenate([[True], codes[1:] != codes[:-1]]))
+    codes, counts = codes[starts], np.add.reduceat(counts, starts)
+    return codes // n_items, codes % n_items, counts
+
+def build_affinity(activity, min_pair_customers=MIN_PAIR_CUSTOMERS, chunk_pairs=PAIR_CHUNK):
+    """ 每個 AFFINITY_LEVELS 的品項組合：Support / Confidence / Lift (以客戶數計) """
+    tables = []
+    for level in AFFINITY_LEVELS:
+        rows = activity[activity['Level'] == level]
+        indptr, indices, labels = incidence_matrix(rows['Customer_Key'].to_numpy(), rows['Item'].to_numpy())
+        n_customers = len(indptr) - 1
+        if n_customers == 0:
+            continue
+        a, b, pair = cooccurrence(indptr, indices, len(labels), chunk_pairs)
+        keep = pair >= min_pair_customers
+        a, b, pair = a[keep], b[keep], pair[keep]
+        item_customers = np.bincount(indices, minlength=len(labels))
+        count_a, count_b = item_customers[a], item_customers[b]
+        tables.append(pd.DataFrame({
+            'Level': level,
+            'Item_A': pd.Categorical.from_codes(a, labels),
+            'Item_B': pd.Categorical.from_codes(b, labels),
+            'Customers_A': count_a,
+            'Customers_B': count_b,
+            'Pair_Customers': pair,
+            'Support': pair / n_customers,
+            'Confidence_A_B': pair / count_a,
+            'Confidence_B_A': pair / count_b,
+            'Lift': pair * n_customers / (count_a.astype('float64') * count_b),
+        }))
+    if not tables:
+        return pd.DataFrame(columns=PMF_TABLES['Fact_PMF_Affinity'])
+    return pd.concat(tables, ignore_index=True).sort_values(['Level', 'Lift'], ascending=[True, False],
+                                                            kind='stable').reset_index(drop=True)
+
+# ==========================================
+# 🚀 主流程
+# ==========================================
+
+def run_pmf(bi_folder=BI_FOLDER, full=False, min_pair_customers=MIN_PAIR_CUSTOMERS):
+    """ [主流程] 更新購買紀錄並重算三張 PMF 表 """
+    print("🧺 [PMF 分析引擎] 啟動中...")
+    prod_file = os.path.join(bi_folder, "Dim_Product.parquet")
+    if not os.path.exists(fact_path(bi_folder)) or not os.path.exists(prod_file):
+        print(f"❌ 找不到 Fact_Sales / Dim_Product: {bi_folder}")
+        return
+
+    dim_product = pd.read_parquet(prod_file)
+    if 'AdjPtNo' not in dim_product.columns and 'PtNo' in dim_product.columns:
+        dim_product = dim_product.assign(AdjPtNo=dim_product['PtNo'])
+    activity, total_rows = load_activity(bi_folder, dim_product, full)
+    if activity.empty:
+        print("⚠️ 沒有有效日期的交易資料")
+        return
+
+    frame, labels = customer_months(activity)
+    tables = {
+        'Fact_PMF_Cohort': build_cohorts(frame, labels),
+        'Fact_PMF_Repeat': build_repeat(frame, labels),
+        'Fact_PMF_Affinity': build_affinity(activity, min_pair_customers),
+    }
+    for name, table in tables.items():
+        table.to_parquet(os.path.join(bi_folder, f"{name}.parquet"), index=False)
+
+    last_month = activity['Month_Start'].max()
+    activity.to_parquet(os.path.join(bi_folder, PMF_ACTIVITY_FILE), index=False)
+    star_state = load_state(os.path.join(bi_folder, STAR_STATE_FILE))
+    save_state(os.path.join(bi_folder, PMF_STATE_FILE), {
+        'fact_write_id': star_state.get('fact_write_id'),
+        'source_rows': total_rows,
+        'last_month': last_month.strftime('%Y-%m-%d'),
+    })
+
+    overall = tables['Fact_PMF_Repeat'][tables['Fact_PMF_Repeat']['Level'] == 'All']
+    print(f"   ✅ 截至 {last_month:%Y-%m}：{len(overall):,} 個同期群，"
+          f"整體回購率 {overall['Repeat_Customers'].sum() / max(overall['Customers'].sum(), 1):.1%}")
+    for name, table in tables.items():
+        print(f"      {name:<20} {len(table):>10,} 列")
+
+def pmf_column_kind(name):
+    if name == 'Cohort_Month':
+        return 'date'
+    if name in ('Month_Offset', 'Cohort_Size', 'Customers_A', 'Customers_B'):
+        return 'key'                 # 每列重複的分母，加總沒有意義
+    if name.endswith('Customers') or name == 'Customers':
+        return 'sum_int'
+    if name.endswith('_Rate') or name in ('Support', 'Lift', 'Avg_Active_Months') or name.startswith('Confidence'):
+        return 'double'
+    return 'string'
+
+def export_tmdl(model_folder=MODEL_FOLDER):
+    """ 產生 PMF 三張表的 .tmdl 並補上 model.tmdl 的 ref (以 Level / Item 篩選，不建關聯) """
+    for name, columns in PMF_TABLES.items():
+        write_tmdl(os.path.join(model_folder, "tables", f"{name}.tmdl"), tmdl_table(name, columns, pmf_column_kind))
+    add_model_refs(list(PMF_TABLES), model_folder)
+    print(f"   ✅ 已產生 {len(PMF_TABLES)} 個 PMF 表的 TMDL: {model_folder}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PMF 同期群 / 購物籃分析")
+    parser.add_argument('--full', action='store_true', help="忽略上次的購買紀錄，全量重算")
+    parser.add_argument('--tmdl', action='store_true', help="只產生 TMDL 表定義")
+    args = parser.parse_args()
+    if args.tmdl:
+        export_tmdl()
+    else:
+        run_pmf(full=args.full)
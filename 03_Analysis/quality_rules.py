@@ -0,0 +1,181 @@
+import os
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# 🚦 資料品質規則引擎 (Data-Quality Rules + Quarantine)
+# ==========================================
+# 規則放在 99_Config/Quality_Rules.csv，新增 / 調整門檻不必改程式：
+#   Check   = unparsable        -> Columns 任一欄原始值無法解析 (清洗時原本默默補 0)
+#             all_unparsable    -> Columns 每一欄都無法解析 (例如金額與數量都沒有，整列沒有可用數值)
+#             negative          -> Columns 任一欄 < 0
+#             missing           -> Columns 任一欄為空 (日期含無法解析的 NaT)
+#             product_mismatch  -> Columns = 總額|單價|數量，|總額 - 單價 x 數量| 超過 Param (相對誤差) 且超過 1 分錢
+#             equals            -> Columns 任一欄等於 Param (例如修復後仍為 Unknown)
+#   Action  = quarantine -> 該列移出 POS_Cleaned，寫入 POS_Quarantine.parquet (附 Reason_Code、CSV 行號、原始值)
+#             warn       -> 保留該列，只計數
+# 預設規則全部為 warn：POS_Cleaned 與未啟用品質規則前逐列相同 (無法解析補 0、日期空白保留為 NaT)，
+# 只多出 _quality_metrics 的計數；要隔離時再把個別規則改成 quarantine (例如 NO_MEASURE)。
+# 規則在 clean_frame 同一輪內以整欄 bool mask 評估：數值欄的「無法解析」直接沿用清洗引擎的 mask，
+# 不必再掃一次字串；每次執行各規則的失敗筆數附加到 _quality_metrics.parquet，可在 BI 看趨勢。
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+QUALITY_RULES_FILE = os.path.join(os.path.dirname(current_dir), "99_Config", "Quality_Rules.csv")
+QUARANTINE_FILE = "POS_Quarantine.parquet"       # 與 POS_Cleaned.parquet 同資料夾
+QUALITY_METRICS_FILE = "_quality_metrics.parquet"
+MIN_MISMATCH = 0.01                              # product_mismatch 的絕對誤差下限 (四捨五入誤差)
+
+ACTIONS = ['quarantine', 'warn']
+
+def any_mask(n, masks):
+    result = np.zeros(n, dtype=bool)
+    for mask in masks:
+        result |= mask
+    return result
+
+def check_unparsable(df, cols, param, unparsable):
+    return any_mask(len(df), [unparsable[c] for c in cols if c in unparsable])
+
+def check_all_unparsable(df, cols, param, unparsable):
+    masks = [unparsable.get(c, np.zeros(len(df), dtype=bool)) for c in cols]
+    result = np.ones(len(df), dtype=bool)
+    for mask in masks:
+        result &= mask
+    return result
+
+def check_negative(df, cols, param, unparsable):
+    return any_mask(len(df), [df[c].to_numpy() < 0 for c in cols if c in df.columns])
+
+def check_missing(df, cols, param, unparsable):
+    return any_mask(len(df), [df[c].isna().to_numpy() for c in cols if c in df.columns])
+
+def check_product_mismatch(df, cols, param, unparsable):
+    if not all(c in df.columns for c in cols):
+        return np.zeros(len(df), dtype=bool)
+    total, unit, qty = (df[c].to_numpy(dtype='float64') for c in cols)
+    diff = np.abs(total - unit * qty)
+    fail = (diff > np.abs(total) * float(param or 0)) & (diff > MIN_MISMATCH)
+    # 任一欄無法解析時已由 unparsable 規則抓到，不重複計算
+    return fail & ~check_unparsable(df, cols, param, unparsable)
+
+def check_equals(df, cols, param, unparsable):
+    return any_mask(len(df), [(df[c] == param).to_numpy(dtype=bool) for c in cols if c in df.columns])
+
+CHECKS = {
+    'unparsable': check_unparsable,
+    'all_unparsable': check_all_unparsable,
+    'negative': check_negative,
+    'missing': check_missing,
+    'product_mismatch': check_product_mismatch,
+    'equals': check_equals,
+}
+
+def load_quality_rules(rules_file=QUALITY_RULES_FILE):
+    """ 讀取規則表 -> [{'code', 'check', 'columns', 'param', 'action', 'description'}]；檔案不存在則不檢查 """
+    if not rules_file or not os.path.exists(rules_file):
+        return []
+    df = pd.read_csv(rules_file, dtype=str, keep_default_na=False)
+    rules = []
+    for row in df.itertuples(index=False):
+        if row.Check not in CHECKS:
+            raise ValueError(f"未知的 Check: {row.Check} (只接受 {' / '.join(CHECKS)})")
+        if row.Action not in ACTIONS:
+            raise ValueError(f"未知的 Action: {row.Action} (只接受 {' / '.join(ACTIONS)})")
+        columns = row.Columns.split('|')
+        if row.Check == 'product_mismatch' and len(columns) != 3:
+            raise ValueError(f"{row.Rule_Code}: product_mismatch 需要三個欄位 (總額|單價|數量)")
+        rules.append({'code': row.Rule_Code, 'check': row.Check, 'columns': columns, 'param': row.Param,
+                      'action': row.Action, 'description': row.Description})
+    return rules
+
+class QualityGate:
+    """ 一次清洗執行的品質關卡：逐批 (chunk) 評估規則、收集隔離資料、累計各規則失敗筆數 """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.rows_checked = 0
+        self.failed = {r['code']: 0 for r in rules}
+        self.quarantined = []
+        self.quarantined_rows = 0
+
+    def check(self, df, unparsable, raw):
+        """ unparsable: {欄位: 補 0 的 bool 陣列}；raw: {欄位: 清洗前的原始 Series}
+        回傳通過的列 (quarantine 規則失敗的列移到隔離區) """
+        self.rows_checked += len(df)
+        quarantine = np.zeros(len(df), dtype=bool)
+        failures = []
+        for rule in self.rules:
+            mask = CHECKS[rule['check']](df, rule['columns'], rule['param'], unparsable)
+            self.failed[rule['code']] += int(mask.sum())
+            if rule['action'] == 'quarantine' and mask.any():
+                quarantine |= mask
+                failures.append((rule['code'], mask))
+        if not quarantine.any():
+            return df
+
+        # 只對失敗的列組 Reason_Code (同一列命中多條規則以 | 串接)
+        idx = np.flatnonzero(quarantine)
+        reason = np.full(len(idx), '', dtype=object)
+        for code, mask in failures:
+            hit = mask[idx]
+            reason[hit] = np.where(reason[hit] == '', code, reason[hit] + '|' + code)
+        bad = df.iloc[idx].copy()
+        bad.insert(0, 'Reason_Code', reason)
+        bad.insert(1, 'Source_Row', df.index[idx] + 2)      # CSV 行號 (第 1 行是表頭)
+        for col, series in raw.items():
+            bad[f"Raw_{col}"] = series.iloc[idx].astype('string').to_numpy()
+        self.quarantined.append(bad)
+        self.quarantined_rows += len(idx)
+        return df[~quarantine]
+
+    def merge(self, other, row_offset=0):
+        """ [平行模式] 併入另一個 shard 的關卡結果；row_offset = 前面各 shard 的原始列數 (修正 Source_Row) """
+        self.rows_checked += other.rows_checked
+        for code, n in other.failed.items():
+            self.failed[code] += n
+        for bad in other.quarantined:
+            bad['Source_Row'] += row_offset
+            self.quarantined.append(bad)
+        self.quarantined_rows += other.quarantined_rows
+
+    def write(self, output_folder, source_name, append=False):
+        """ 寫出隔離資料 (全量覆寫 / 增量附加) 並在指標表附加本次各規則結果 """
+        quarantine_path = os.path.join(output_folder, QUARANTINE_FILE)
+        bad = pd.concat(self.quarantined, ignore_index=True) if self.quarantined else None
+        if append and os.path.exists(quarantine_path):
+            if bad is not None:
+                bad = pd.concat([pd.read_parquet(quarantine_path), bad], ignore_index=True)
+                bad.to_parquet(quarantine_path, index=False)
+        elif bad is not None:
+            bad.to_parquet(quarantine_path, index=False)
+        else:
+            pd.DataFrame({'Reason_Code': pd.Series(dtype=str), 'Source_Row': pd.Series(dtype='int64')}) \
+              .to_parquet(quarantine_path, index=False)
+
+        run_at = pd.Timestamp.now().floor('s')
+        metrics = pd.DataFrame({
+            'Run_At': run_at,
+            'Source_File': source_name,
+            'Rule_Code': [r['code'] for r in self.rules],
+            'Action': [r['action'] for r in self.rules],
+            'Rows_Checked': self.rows_checked,
+            'Failed_Rows': [self.failed[r['code']] for r in self.rules],
+        })
+        metrics['Failed_Pct'] = metrics['Failed_Rows'] / max(self.rows_checked, 1) * 100
+        metrics_path = os.path.join(output_folder, QUALITY_METRICS_FILE)
+        if os.path.exists(metrics_path):
+            metrics = pd.concat([pd.read_parquet(metrics_path), metrics], ignore_index=True)
+        metrics.to_parquet(metrics_path, index=False)
+        return quarantine_path
+
+    def report(self):
+        """ 印出各規則失敗筆數 (接在資料品質快報後面) """
+        if not self.rules:
+            return
+        print(f"\n🚦 [品質規則] 檢查 {self.rows_checked:,} 筆，隔離 {self.quarantined_rows:,} 筆")
+        for rule in self.rules:
+            n = self.failed[rule['code']]
+            if n > 0:
+                icon = "⛔" if rule['action'] == 'quarantine' else "⚠️"
+                pct = n / max(self.rows_checked, 1) * 100
+                print(f"   {icon} {rule['code']:<20} {n:>10,} 筆 ({pct:.2f}%)  {rule['description']}")
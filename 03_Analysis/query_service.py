@@ -0,0 +1,442 @@
+import argparse
+import json
+import operator
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from fact_writer import FACT_NAME, fact_path, fact_dataset
+
+# ==========================================
+# 🔍 BI_Tables 查詢服務 (不必開 Power BI 也能拿數字)
+# ==========================================
+# Python: from query_service import QueryService
+#         QueryService().query({'group_by': ['YearMonth', 'Group Roll-UP'], 'metrics': [['ResExt', 'sum']]})
+# HTTP:   python query_service.py serve  ->  GET /tables、GET /presets、GET /query?preset=top_distributors&limit=5
+#                                           POST /query (body 為同樣格式的 JSON)
+# CLI:    python query_service.py query '{"preset": "top_distributors"}'
+# 查詢格式 (JSON)：
+#   table    預設 Fact_Sales，也可查 Agg_* / Fact_RFM / Dim_*
+#   filters  [[欄位, 運算子, 值], ...] (AND)；運算子 = / != / < / <= / > / >= / in / not in
+#   group_by [欄位, ...]；metrics [[欄位, sum|mean|min|max|count|count_distinct], ...] (["*", "count"] = 筆數)
+#   columns  明細查詢要的欄位 (沒有 group_by / metrics 時)；order_by [[欄位, asc|desc], ...]；limit
+# - 欄位可直接用維度屬性 (Group Roll-UP、Parent_Group、DistName、YearMonth...)，依 Key 自動對應維度表
+# - 事實表欄位的條件直接推進 Parquet 掃描 (分區 / row group 統計跳讀)；維度屬性的條件先在維度表算出
+#   符合的 Key，再以 Key in (...) 推進事實表掃描 (Fact_Sales 依 Customer_Key 排序，跳讀效果好)
+# - 維度屬性以 Key 向量化對應 (index_in + take)，彙總用 Arrow group_by，全程不轉 pandas
+# - 結果放在 LRU 快取，Key = 查詢內容 + 用到的表的檔案版本 (大小 + 修改時間)；
+#   create_star_schema / eccp 重寫檔案後版本不同，舊結果自動失效
+# - SCD2 (create_star_schema.SCD_MODE) 時以 *_Version_Key 對應交易當時的屬性
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+BASE_PATH = os.path.dirname(current_dir)
+BI_FOLDER = os.path.join(BASE_PATH, "02_ProcessedData", "BI_Tables")
+
+CACHE_SIZE = 256           # 快取的查詢結果數
+MAX_ROWS = 10_000          # 明細查詢 (沒有 group_by / metrics) 最多回傳筆數
+HTTP_HOST = '127.0.0.1'    # 只給本機 / 內部工具；要開放給其他主機請改 0.0.0.0
+HTTP_PORT = 8765
+
+# (維度表, 自然鍵 Key, SCD2 版本 Key)；查詢表有這個 Key 就能用該維度的屬性
+DIMENSIONS = [
+    ('Dim_Product', 'Product_Key', 'Product_Version_Key'),
+    ('Dim_Customer', 'Customer_Key', 'Customer_Version_Key'),
+    ('Dim_Distributor', 'Distributor_Key', None),
+    ('Dim_Date', 'DateKey', None),
+]
+AGGREGATES = ['sum', 'mean', 'min', 'max', 'count', 'count_distinct']
+FILTER_OPS = {'=': operator.eq, '==': operator.eq, '!=': operator.ne,
+              '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+# 常用查詢；可再加上 filters / limit 覆寫，例如 {"preset": "top_distributors", "limit": 20}
+PRESETS = {
+    'sales_by_month_rollup_parent': {
+        'group_by': ['YearMonth', 'Group Roll-UP', 'Parent_Group'],
+        'metrics': [['ResExt', 'sum'], ['Qty', 'sum'], ['*', 'count']],
+        'order_by': [['YearMonth', 'asc'], ['ResExt_sum', 'desc']],
+    },
+    'top_distributors': {
+        'group_by': ['DistName'],
+        'metrics': [['ResExt', 'sum'], ['Customer_Key', 'count_distinct']],
+        'order_by': [['ResExt_sum', 'desc']],
+        'limit': 10,
+    },
+    'top_parent_groups': {
+        'group_by': ['Parent_Group'],
+        'metrics': [['ResExt', 'sum'], ['Qty', 'sum']],
+        'order_by': [['ResExt_sum', 'desc']],
+        'limit': 20,
+    },
+    'sales_by_quarter_rollup': {
+        'group_by': ['YearQuarter', 'Group Roll-UP'],
+        'metrics': [['ResExt', 'sum']],
+        'order_by': [['YearQuarter', 'asc']],
+    },
+}
+
+def file_version(path):
+    """ 檔案 (大小, 修改時間)；hive 資料夾為所有分區檔的組合 """
+    if os.path.isdir(path):
+        entries = []
+        for root, _, files in os.walk(path):
+            for name in files:
+                stat = os.stat(os.path.join(root, name))
+                entries.append((os.path.relpath(os.path.join(root, name), path), stat.st_size, stat.st_mtime_ns))
+        return tuple(sorted(entries))
+    stat = os.stat(path)
+    return (stat.st_size, stat.st_mtime_ns)
+
+def plain_type(arrow_type):
+    return arrow_type.value_type if pa.types.is_dictionary(arrow_type) else arrow_type
+
+def decode(table):
+    """ dictionary 欄位 (Categorical) 轉回一般型別，方便比較、對應與 group_by """
+    if not any(pa.types.is_dictionary(t) for t in table.schema.types):
+        return table
+    return pa.table({name: pc.cast(col, plain_type(col.type)) for name, col in zip(table.column_names, table.columns)})
+
+def filter_expression(col, op, value, arrow_type):
+    """ [col, op, value] -> Arrow expression；值依欄位型別轉換 (日期可用 '2025-01-01' 字串) """
+    field = pc.field(col)
+    arrow_type = plain_type(arrow_type)
+    if op in ('in', 'not in'):
+        values = value if isinstance(value, (list, tuple)) else [value]
+        expr = field.isin(pa.array(list(values)).cast(arrow_type))
+        return ~expr if op == 'not in' else expr
+    if op not in FILTER_OPS:
+        raise ValueError(f"未知的運算子: {op} (只接受 {' / '.join(list(FILTER_OPS) + ['in', 'not in'])})")
+    if value is None and op in ('=', '==', '!='):
+        return field.is_valid() if op == '!=' else field.is_null()
+    return FILTER_OPS[op](field, pa.scalar(value).cast(arrow_type))
+
+def normalize_query(spec):
+    """ 套用 preset、補預設值並檢查格式；回傳新的 dict (快取 Key 用) """
+    if isinstance(spec, str):
+        spec = {'preset': spec}
+    spec = dict(spec)
+    preset = spec.pop('preset', None)
+    if preset is not None:
+        if preset not in PRESETS:
+            raise ValueError(f"未知的 preset: {preset} (可用: {', '.join(PRESETS)})")
+        spec = {**PRESETS[preset], **spec}
+    query = {
+        'table': spec.get('table', FACT_NAME),
+        'filters': [list(f) for f in spec.get('filters', [])],
+        'group_by': list(spec.get('group_by', [])),
+        'metrics': [list(m) for m in spec.get('metrics', [])],
+        'columns': list(spec.get('columns', [])),
+        'order_by': [[o, 'asc'] if isinstance(o, str) else list(o) for o in spec.get('order_by', [])],
+        'limit': spec.get('limit'),
+    }
+    for f in query['filters']:
+        if len(f) != 3:
+            raise ValueError(f"filters 每項需為 [欄位, 運算子, 值]: {f}")
+    for m in query['metrics']:
+        if len(m) != 2 or m[1] not in AGGREGATES:
+            raise ValueError(f"metrics 每項需為 [欄位, {' | '.join(AGGREGATES)}]: {m}")
+    for o in query['order_by']:
+        if o[1] not in ('asc', 'desc', 'ascending', 'descending'):
+            raise ValueError(f"order_by 方向只接受 asc / desc: {o}")
+    is_detail = not query['group_by'] and not query['metrics']
+    if is_detail and not query['columns']:
+        raise ValueError("需指定 group_by / metrics，或明細查詢的 columns")
+    if query['limit'] is not None:
+        try:
+            query['limit'] = int(query['limit'])
+        except (TypeError, ValueError):
+            raise ValueError(f"limit 需為非負整數: {query['limit']!r}") from None
+        if query['limit'] < 0:
+            raise ValueError(f"limit 需為非負整數: {query['limit']}")
+    if is_detail:
+        query['limit'] = min(query['limit'] or MAX_ROWS, MAX_ROWS)
+    return query
+
+def metric_name(col, agg):
+    return 'Rows' if col == '*' else f"{col}_{agg}"
+
+class QueryService:
+    """ BI_Tables 的查詢引擎：表的 schema / 維度表依檔案版本快取，查詢結果放 LRU 快取 """
+
+    def __init__(self, bi_folder=BI_FOLDER, cache_size=CACHE_SIZE):
+        self.bi_folder = bi_folder
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.datasets = {}      # 表名 -> (版本, dataset)
+        self.dims = {}          # 表名 -> (版本, 解碼後的 Arrow Table)
+        self.lock = threading.Lock()
+
+    # ---------- 表的註冊 ----------
+
+    def table_paths(self):
+        """ BI_Tables 中的所有表 (底線開頭的內部檔除外)；Fact_Sales 兩種版面都可 """
+        paths = {}
+        if os.path.isdir(self.bi_folder):
+            for name in sorted(os.listdir(self.bi_folder)):
+                if name.endswith('.parquet') and not name.startswith('_'):
+                    paths[name[:-len('.parquet')]] = os.path.join(self.bi_folder, name)
+        if os.path.exists(fact_path(self.bi_folder)):
+            paths[FACT_NAME] = fact_path(self.bi_folder)
+        return paths
+
+    def dataset(self, name):
+        paths = self.table_paths()
+        if name not in paths:
+            raise ValueError(f"找不到資料表: {name} ({self.bi_folder})")
+        version = file_version(paths[name])
+        cached = self.datasets.get(name)
+        if cached is None or cached[0] != version:
+            data = fact_dataset(self.bi_folder) if name == FACT_NAME else ds.dataset(paths[name], format='parquet')
+            cached = self.datasets[name] = (version, data)
+        return cached
+
+    def dim_table(self, name):
+        version, data = self.dataset(name)
+        cached = self.dims.get(name)
+        if cached is None or cached[0] != version:
+            cached = self.dims[name] = (version, decode(data.to_table()))
+        return cached[1]
+
+    def tables(self):
+        """ {表名: [欄位, ...]} """
+        with self.lock:
+            return {name: self.dataset(name)[1].schema.names for name in self.table_paths()}
+
+    # ---------- 查詢規劃 ----------
+
+    def plan(self, query):
+        """ 每個欄位屬於查詢表或哪個維度表；回傳 (維度對應 {維度: (Key, [欄位])}, 用到的表) """
+        base_names = self.dataset(query['table'])[1].schema.names
+        needed = [f[0] for f in query['filters']] + query['group_by'] + query['columns'] \
+            + [m[0] for m in query['metrics'] if m[0] != '*']
+        outputs = {metric_name(col, agg) for col, agg in query['metrics']}
+        needed += [o[0] for o in query['order_by'] if o[0] not in outputs]
+
+        paths = self.table_paths()
+        lookups = {}
+        for col in dict.fromkeys(needed):
+            if col in base_names:
+                continue
+            for dim, key, version_key in DIMENSIONS:
+                if dim == query['table'] or dim not in paths:
+                    continue
+                dim_names = self.dataset(dim)[1].schema.names
+                if col not in dim_names:
+                    continue
+                join_key = version_key if version_key in base_names and version_key in dim_names else key
+                if join_key in base_names:
+                    lookups.setdefault(dim, (join_key, []))[1].append(col)
+                    break
+            else:
+                raise ValueError(f"找不到欄位: {col} ({query['table']} 與可對應的維度表都沒有)")
+        return lookups, [query['table']] + list(lookups)
+
+    @staticmethod
+    def dim_lookup(table, join_key):
+        """ 以 join_key 對應的維度表；SCD 表用自然鍵對應時只取目前版本 """
+        if 'Is_Current' in table.column_names and not join_key.endswith('_Version_Key'):
+            table = table.filter(pc.field('Is_Current'))
+        return table
+
+    # ---------- 執行 ----------
+
+    def execute(self, spec):
+        """ 回傳 (結果 Arrow Table, 是否來自快取)
+        鎖只保護快取與資料表登錄；查詢本身在鎖外執行 (Arrow 表不可變，多個請求可同時掃描) """
+        query = normalize_query(spec)
+        with self.lock:
+            lookups, used = self.plan(query)
+            versions = tuple(self.dataset(name)[0] for name in used)
+            key = (json.dumps(query, sort_keys=True, default=str), versions)
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return self.cache[key], True
+            self.misses += 1
+            data = self.dataset(query['table'])[1]
+            dims = {dim: self.dim_table(dim) for dim in lookups}
+
+        result = self.run(query, lookups, data, dims)
+
+        with self.lock:
+            # 同一張表有新版本時，舊版本的結果不會再被用到，先清掉
+            for old_key in [k for k in self.cache if k[0] == key[0] and k != key]:
+                del self.cache[old_key]
+            self.cache[key] = result
+            self.cache.move_to_end(key)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return result, False
+
+    def run(self, query, lookups, data, dims):
+        """ data: 查詢表的 dataset；dims: {維度: 維度表}，皆由 execute 在鎖內取得 """
+        base_types = {f.name: f.type for f in data.schema}
+
+        # 1) 條件推進掃描：事實表欄位直接下推；維度屬性先換成 Key in (...)
+        expression = None
+        dim_filters = {}
+        for col, op, value in query['filters']:
+            if col in base_types:
+                expr = filter_expression(col, op, value, base_types[col])
+                expression = expr if expression is None else expression & expr
+            else:
+                dim_filters.setdefault(next(d for d, (_, cols) in lookups.items() if col in cols), []).append((col, op, value))
+        for dim, conditions in dim_filters.items():
+            join_key = lookups[dim][0]
+            table = self.dim_lookup(dims[dim], join_key)
+            types = {f.name: f.type for f in table.schema}
+            dim_expr = None
+            for col, op, value in conditions:
+                expr = filter_expression(col, op, value, types[col])
+                dim_expr = expr if dim_expr is None else dim_expr & expr
+            keys = table.filter(dim_expr)[join_key].combine_chunks()
+            expr = pc.field(join_key).isin(keys)
+            expression = expr if expression is None else expression & expr
+
+        base_cols = [c for c in query['group_by'] + query['columns'] + [m[0] for m in query['metrics']]
+                     + [o[0] for o in query['order_by']] if c in base_types]
+        join_keys = [join_key for join_key, _ in lookups.values()]
+        table = decode(data.to_table(columns=list(dict.fromkeys(base_cols + join_keys)), filter=expression))
+
+        # 2) 維度屬性：Key 在維度表的位置 -> take (找不到的 Key 為 null)
+        for dim, (join_key, cols) in lookups.items():
+            dim_table = self.dim_lookup(dims[dim], join_key)
+            positions = pc.index_in(table[join_key], value_set=dim_table[join_key].combine_chunks())
+            for col in cols:
+                if col not in table.column_names:
+                    table = table.append_column(col, dim_table[col].take(positions))
+
+        # 3) 彙總 / 明細
+        if query['group_by'] or query['metrics']:
+            aggregations = [([], 'count_all') if col == '*' else (col, agg) for col, agg in query['metrics']]
+            grouped = table.group_by(query['group_by']).aggregate(aggregations)
+            table = pa.table({**{col: grouped[col] for col in query['group_by']},
+                              **{metric_name(col, agg): grouped['count_all' if col == '*' else f"{col}_{agg}"]
+                                 for col, agg in query['metrics']}})
+            order = query['order_by'] or [[c, 'asc'] for c in query['group_by']]
+        else:
+            table = table.select(query['columns'])
+            order = query['order_by']
+
+        # 4) 排序 / 取前 N 筆 (有 limit 時用 select_k，不必整表排序)
+        sort_keys = [(col, 'descending' if direction.startswith('desc') else 'ascending') for col, direction in order]
+        if query['limit'] is not None and sort_keys:
+            table = table.take(pc.select_k_unstable(table, k=query['limit'], sort_keys=sort_keys))
+        elif sort_keys:
+            table = table.sort_by(sort_keys)
+        if query['limit'] is not None:
+            table = table.slice(0, query['limit'])
+        return table
+
+    def query(self, spec):
+        """ [Python API] 回傳 pandas DataFrame """
+        return self.execute(spec)[0].to_pandas()
+
+    def cache_info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.cache), 'max_size': self.cache_size}
+
+# ==========================================
+# 🌐 HTTP 端點
+# ==========================================
+
+def to_json_result(table, cached, elapsed):
+    return {
+        'columns': table.column_names,
+        'rows': [list(row) for row in zip(*(col.to_pylist() for col in table.columns))] if table.num_columns else [],
+        'row_count': table.num_rows,
+        'cached': cached,
+        'elapsed_ms': round(elapsed * 1000, 2),
+    }
+
+class QueryHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def run_query(self, spec):
+        t0 = time.perf_counter()
+        try:
+            table, cached = self.service.execute(spec)
+        except (ValueError, KeyError, pa.ArrowException) as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        self.send_json(200, to_json_result(table, cached, time.perf_counter() - t0))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if url.path == '/tables':
+            self.send_json(200, self.service.tables())
+        elif url.path == '/presets':
+            self.send_json(200, PRESETS)
+        elif url.path == '/cache':
+            self.send_json(200, self.service.cache_info())
+        elif url.path == '/query':
+            # ?q=<JSON> 或 ?preset=名稱 (&limit=N)
+            try:
+                spec = json.loads(params['q']) if 'q' in params else {}
+            except json.JSONDecodeError as e:
+                self.send_json(400, {'error': f"q 不是合法的 JSON: {e}"})
+                return
+            if 'preset' in params:
+                spec['preset'] = params['preset']
+            if 'limit' in params:
+                spec['limit'] = params['limit']   # 由 normalize_query 轉型檢查，不合法時回 400
+            self.run_query(spec)
+        else:
+            self.send_json(404, {'error': f"未知的路徑: {url.path} (可用 /query /tables /presets /cache)"})
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/query':
+            self.send_json(404, {'error': "POST 只接受 /query"})
+            return
+        try:
+            spec = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except json.JSONDecodeError as e:
+            self.send_json(400, {'error': f"body 不是合法的 JSON: {e}"})
+            return
+        self.run_query(spec)
+
+    def log_message(self, format, *args):
+        print(f"   - 🌐 {self.address_string()} {format % args}")
+
+def serve(bi_folder=BI_FOLDER, host=HTTP_HOST, port=HTTP_PORT, cache_size=CACHE_SIZE):
+    handler = type('Handler', (QueryHandler,), {'service': QueryService(bi_folder, cache_size)})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"🔍 [查詢服務] http://{host}:{port}/query  (資料: {bi_folder})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 查詢服務已停止")
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="BI_Tables 查詢服務")
+    sub = parser.add_subparsers(dest='command', required=True)
+    serve_parser = sub.add_parser('serve', help="啟動 HTTP 端點")
+    serve_parser.add_argument('--host', default=HTTP_HOST)
+    serve_parser.add_argument('--port', type=int, default=HTTP_PORT)
+    query_parser = sub.add_parser('query', help="執行一次查詢並印出結果")
+    query_parser.add_argument('spec', help="查詢 JSON，或 preset 名稱")
+    for p in (serve_parser, query_parser):
+        p.add_argument('--bi-folder', default=BI_FOLDER)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args.bi_folder, args.host, args.port)
+    else:
+        spec = json.loads(args.spec) if args.spec.lstrip().startswith('{') else args.spec
+        print(QueryService(args.bi_folder).query(spec).to_string(index=False))
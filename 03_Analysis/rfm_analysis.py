@@ -0,0 +1,232 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from etl_state import load_state, save_state, read_row_groups_from
+from fact_writer import fact_path, count_fact_rows, is_partitioned
+
+# ==========================================
+# 🎯 RFM 客戶分群引擎
+# ==========================================
+# 讀 BI_Tables/Fact_Sales + Dim_Customer，以某個基準日 (as-of) 計算：
+#   Recency   = 基準日 - 最後一次購買日 (天)
+#   Frequency = 交易筆數
+#   Monetary  = ResExt 加總
+# 依百分位數打 1~5 分 (同值同分)，再由 R / F 分數對應到 Dim_Segment。
+# 產出 (Power BI 以 Customer_Key / Segment_Key 建關聯)：
+#   Fact_RFM        (Snapshot_Date x Customer_Key)
+#   Fact_RFM_Group  (Snapshot_Date x Parent_Group)
+#   Dim_Segment
+# 增量快照：每次計算後把「每位客戶截至基準日的累計值」存成 _rfm_base.parquet，
+# 下個月只要讀 (上次基準日, 本次基準日] 的交易 + 上次之後才附加的補登交易，不必重掃全部歷史。
+# Fact_Sales 被全量重寫 (_star_state.json 的 fact_write_id 換了，列順序已重排) 時一律全量。
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+BASE_PATH = os.path.dirname(current_dir)
+BI_FOLDER = os.path.join(BASE_PATH, "02_ProcessedData", "BI_Tables")
+
+AS_OF_DATE = None        # None = 以 Fact_Sales 最後一筆交易日為基準
+SCORE_BINS = 5
+RFM_STATE_FILE = "_rfm_state.json"   # 放在 BI_Tables
+RFM_BASE_FILE = "_rfm_base.parquet"  # 每位客戶截至上次基準日的累計值
+STAR_STATE_FILE = "_star_state.json"
+
+BASE_COLS = ['Customer_Key', 'Last_Purchase', 'Frequency', 'Monetary']
+
+# (Segment_Key, Segment, 說明)
+SEGMENTS = [
+    (1, 'Champions', '最近買、常買'),
+    (2, 'Loyal Customers', '常買的忠實客戶'),
+    (3, 'Potential Loyalists', '最近有買，頻率中等'),
+    (4, 'New Customers', '最近第一次購買'),
+    (5, 'Promising', '最近有買但次數少'),
+    (6, 'Need Attention', '各項中等，需要關注'),
+    (7, 'About to Sleep', '一陣子沒買且次數少'),
+    (8, 'At Risk', '曾經常買，但很久沒買'),
+    (9, "Can't Lose Them", '最常買的客戶，但很久沒買'),
+    (10, 'Hibernating', '很久沒買且次數少'),
+]
+# R 分數 (列) x F 分數 (欄) -> Segment_Key，業界常用的 RF 分群表
+SEGMENT_GRID = np.array([
+    # F=1 F=2 F=3 F=4 F=5
+    [10, 10,  8,  8,  9],   # R=1
+    [10, 10,  8,  8,  9],   # R=2
+    [7,  7,   6,  2,  2],   # R=3
+    [5,  3,   3,  2,  2],   # R=4
+    [4,  3,   3,  1,  1],   # R=5
+])
+
+def build_dim_segment():
+    return pd.DataFrame(SEGMENTS, columns=['Segment_Key', 'Segment', 'Description'])
+
+def read_sales(fact_file, start=None, end=None):
+    """ 只讀 RFM 需要的三個欄位，日期範圍 (start, end] 交給 Parquet 過濾 """
+    filters = []
+    if start is not None:
+        filters.append(('POS_ShpDate', '>', pd.Timestamp(start)))
+    if end is not None:
+        filters.append(('POS_ShpDate', '<=', pd.Timestamp(end)))
+    table = pq.read_table(fact_file, columns=['Customer_Key', 'POS_ShpDate', 'ResExt'], filters=filters or None)
+    return table.to_pandas()
+
+def aggregate_sales(sales):
+    """ 交易 -> 每位客戶的 (最後購買日, 筆數, 金額)，可相加 """
+    sales = sales[sales['POS_ShpDate'].notna()]
+    agg = sales.groupby('Customer_Key', sort=False).agg(
+        Last_Purchase=('POS_ShpDate', 'max'),
+        Frequency=('POS_ShpDate', 'size'),
+        Monetary=('ResExt', 'sum'),
+    )
+    return agg.reset_index()[BASE_COLS]
+
+def merge_base(base, delta):
+    """ 累計值 + 新區間的累計值 (最後購買日取較晚者，筆數/金額相加) """
+    combined = pd.concat([base, delta], ignore_index=True)
+    return combined.groupby('Customer_Key', sort=False).agg(
+        Last_Purchase=('Last_Purchase', 'max'),
+        Frequency=('Frequency', 'sum'),
+        Monetary=('Monetary', 'sum'),
+    ).reset_index()[BASE_COLS]
+
+def quantile_score(values, bins=SCORE_BINS, ascending=True):
+    """ 百分位排名 -> 1~bins 分；同值同分，ascending=False 代表數值越小分數越高 """
+    pct = values.rank(method='average', pct=True, ascending=ascending)
+    return np.ceil(pct * bins).clip(1, bins).astype('int64')
+
+def score_rfm(agg, as_of, bins=SCORE_BINS):
+    """ 累計值 -> Recency / R,F,M 分數 / Segment_Key """
+    scored = agg.copy()
+    scored['Recency_Days'] = (pd.Timestamp(as_of) - scored['Last_Purchase']).dt.days.astype('int64')
+    scored['R_Score'] = quantile_score(scored['Recency_Days'], bins, ascending=False)
+    scored['F_Score'] = quantile_score(scored['Frequency'], bins)
+    scored['M_Score'] = quantile_score(scored['Monetary'], bins)
+    scored['RFM_Score'] = (scored['R_Score'] * 100 + scored['F_Score'] * 10 + scored['M_Score']).astype('int64')
+    # 分群表固定 5x5，分數級距不是 5 時先換算到 1~5
+    r5 = np.ceil(scored['R_Score'] * 5 / bins).astype(int) - 1
+    f5 = np.ceil(scored['F_Score'] * 5 / bins).astype(int) - 1
+    scored['Segment_Key'] = SEGMENT_GRID[r5.to_numpy(), f5.to_numpy()]
+    scored.insert(0, 'Snapshot_Date', pd.Timestamp(as_of))
+    return scored
+
+def group_rfm(base, dim_cust):
+    """ 客戶累計值依 Parent_Group 彙總 (集團層級 RFM)；SCD 維度取目前版本的歸戶 """
+    if 'Is_Current' in dim_cust.columns:
+        dim_cust = dim_cust[dim_cust['Is_Current']]
+    groups = dim_cust[['Customer_Key', 'Parent_Group']].drop_duplicates('Customer_Key')
+    merged = base.merge(groups, on='Customer_Key', how='left')
+    merged['Parent_Group'] = merged['Parent_Group'].fillna('UNKNOWN')
+    return merged.groupby('Parent_Group', sort=False).agg(
+        Last_Purchase=('Last_Purchase', 'max'),
+        Frequency=('Frequency', 'sum'),
+        Monetary=('Monetary', 'sum'),
+    ).reset_index()
+
+def build_base(fact_file, as_of, bi_folder):
+    """ 取得「截至 as_of」每位客戶的累計值；條件允許時由上次快照增量計算。
+    回傳 (base, 是否可存為新的增量基準) """
+    state = load_state(os.path.join(bi_folder, RFM_STATE_FILE))
+    star_state = load_state(os.path.join(bi_folder, STAR_STATE_FILE))
+    base_path = os.path.join(bi_folder, RFM_BASE_FILE)
+    total_rows = count_fact_rows(bi_folder)
+
+    # hive 版面沒有固定的列順序，無法判斷哪些是上次之後補登的交易，一律全量 (仍會依日期跳讀分區)
+    can_increment = (
+        state and os.path.exists(base_path) and not is_partitioned(bi_folder)
+        and star_state.get('fact_write_id') is not None
+        and state.get('fact_write_id') == star_state.get('fact_write_id')
+        and total_rows >= state.get('source_rows', 0)
+        and pd.Timestamp(as_of) >= pd.Timestamp(state['as_of'])
+    )
+    if can_increment:
+        prev_as_of = pd.Timestamp(state['as_of'])
+        # 1) 上次基準日之後、本次基準日以前的交易
+        window = read_sales(fact_file, start=prev_as_of, end=as_of)
+        # 2) 上次快照之後才附加、但日期落在上次基準日以前的補登交易
+        late = read_row_groups_from(fact_file, state['source_rows'], columns=['Customer_Key', 'POS_ShpDate', 'ResExt'])
+        if late is not None:
+            late = late[late['POS_ShpDate'] <= prev_as_of]
+            print(f"   - ♻️ 由 {prev_as_of.date()} 的快照增量計算 (區間 {len(window):,} 筆，補登 {len(late):,} 筆)")
+            delta = aggregate_sales(pd.concat([window, late], ignore_index=True))
+            return merge_base(pd.read_parquet(base_path), delta), True
+        print("   - 📌 Fact_Sales row group 邊界與上次不符，改為全量計算")
+
+    print("   - 📖 全量計算 (讀取所有歷史交易)...")
+    base = aggregate_sales(read_sales(fact_file, end=as_of))
+    # 回補較早的基準日時不覆蓋現有的增量基準
+    is_latest = not state or pd.Timestamp(as_of) >= pd.Timestamp(state.get('as_of', as_of))
+    return base, is_latest
+
+def upsert_snapshot(path, snapshot):
+    """ 同一個 Snapshot_Date 重跑時取代舊資料，其他月份保留 """
+    if os.path.exists(path):
+        existing = pd.read_parquet(path)
+        existing = existing[existing['Snapshot_Date'] != snapshot['Snapshot_Date'].iloc[0]]
+        snapshot = pd.concat([existing, snapshot], ignore_index=True)
+    snapshot.sort_values(['Snapshot_Date'], kind='stable').to_parquet(path, index=False)
+
+def run_rfm(as_of=AS_OF_DATE, bi_folder=BI_FOLDER, bins=SCORE_BINS):
+    """ [主流程] 計算單一基準日的 RFM 快照 """
+    print("🎯 [RFM 分群引擎] 啟動中...")
+    fact_file = fact_path(bi_folder)
+    cust_file = os.path.join(bi_folder, "Dim_Customer.parquet")
+    if not os.path.exists(fact_file) or not os.path.exists(cust_file):
+        print(f"❌ 找不到 Fact_Sales / Dim_Customer: {bi_folder}")
+        return
+
+    if as_of is None:
+        as_of = pc.max(pq.read_table(fact_file, columns=['POS_ShpDate'])['POS_ShpDate']).as_py()
+    as_of = pd.Timestamp(as_of).normalize()
+    print(f"   - 基準日: {as_of.date()}")
+
+    base, save_as_base = build_base(fact_file, as_of, bi_folder)
+    if base.empty:
+        print("⚠️ 基準日以前沒有交易資料")
+        return
+
+    cust_cols = ['Customer_Key', 'Parent_Group'] + (['Is_Current'] if 'Is_Current' in pq.read_schema(cust_file).names else [])
+    dim_cust = pd.read_parquet(cust_file, columns=cust_cols)
+    fact_rfm = score_rfm(base, as_of, bins)
+    fact_group = score_rfm(group_rfm(base, dim_cust), as_of, bins)
+
+    upsert_snapshot(os.path.join(bi_folder, "Fact_RFM.parquet"), fact_rfm.drop(columns=['Last_Purchase']))
+    upsert_snapshot(os.path.join(bi_folder, "Fact_RFM_Group.parquet"), fact_group.drop(columns=['Last_Purchase']))
+    build_dim_segment().to_parquet(os.path.join(bi_folder, "Dim_Segment.parquet"), index=False)
+
+    if save_as_base:
+        base.to_parquet(os.path.join(bi_folder, RFM_BASE_FILE), index=False)
+        star_state = load_state(os.path.join(bi_folder, STAR_STATE_FILE))
+        save_state(os.path.join(bi_folder, RFM_STATE_FILE), {
+            'fact_write_id': star_state.get('fact_write_id'),
+            'source_rows': count_fact_rows(bi_folder),
+            'as_of': as_of.strftime('%Y-%m-%d'),
+        })
+
+    summary = fact_rfm['Segment_Key'].map(dict((k, n) for k, n, _ in SEGMENTS)).value_counts()
+    print(f"   ✅ {len(fact_rfm):,} 個客戶 / {len(fact_group):,} 個集團")
+    for seg, n in summary.items():
+        print(f"      {seg:<20} {n:>8,}")
+
+def run_monthly(start=None, end=None, bi_folder=BI_FOLDER, bins=SCORE_BINS):
+    """ 依序計算每個月底的快照 (每個月都由上個月增量而來) """
+    state = load_state(os.path.join(bi_folder, RFM_STATE_FILE))
+    fact_file = fact_path(bi_folder)
+    dates = pq.read_table(fact_file, columns=['POS_ShpDate'])['POS_ShpDate']
+    start = pd.Timestamp(start or state.get('as_of') or pc.min(dates).as_py())
+    end = pd.Timestamp(end or pc.max(dates).as_py())
+    month_ends = list(pd.date_range(start, end, freq='ME'))
+    if not month_ends or month_ends[-1] < end.normalize():
+        month_ends.append(end.normalize())
+    for as_of in month_ends:
+        run_rfm(as_of, bi_folder, bins)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RFM 客戶分群")
+    parser.add_argument('--as-of', default=AS_OF_DATE, help="基準日 YYYY-MM-DD (預設為最後交易日)")
+    parser.add_argument('--monthly', action='store_true', help="從上次快照起逐月計算到最後交易日")
+    args = parser.parse_args()
+    if args.monthly:
+        run_monthly(end=args.as_of)
+    else:
+        run_rfm(args.as_of)
@@ -0,0 +1,215 @@
+import os
+import re
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from categorical_ops import to_plain
+from surrogate_keys import surrogate_key, check_unique_keys
+from calendar_engine import date_key
+from aggregations import MODEL_FOLDER, lineage_tag, tmdl_column, read_tmdl, write_tmdl
+
+# ==========================================
+# 🕰️ 緩慢變動維度 (SCD Type 2)
+# ==========================================
+# Dim_Product / Dim_Customer 保留屬性歷史，不再被「第一筆 / 最新帳本」整張覆寫：
+# - 每個自然鍵 (Product_Key / Customer_Key，仍是自然鍵 hash) 可有多個版本，
+#   版本 Key = hash(自然鍵 Key, Valid_From)，重跑結果不變
+# - Valid_From / Valid_To 為 yyyymmdd 整數 (與 DateKey 相同格式)，目前版本 Valid_To = 99991231、Is_Current = True
+# - 本次傳入的維度 (每個自然鍵一列) 與既有目前版本比對 Row_Hash (屬性欄整欄 hash)：
+#   沒變的版本原封不動；有變的關閉舊版本 (Valid_To = 新版本前一天) 並開新版本；只有這些列會被改寫
+# - 新版本生效日：交易帶來的屬性 (產品階層、Channel District) 取該組屬性最後一段連續出現的起日；
+#   帳本帶來的屬性 (Parent_Group...) 沒有日期，以 as_of (預設執行當天) 生效，舊交易維持舊的歸戶
+# - Fact_Sales 依 POS_ShpDate 對應版本：版本表依 (Key, Valid_From) 排序後 searchsorted (as-of join)，
+#   不必排序交易資料
+# 第一次啟用時每個自然鍵只有一個版本 (Valid_From = 19000101)，歷史從啟用後開始累積。
+# Power BI 關聯需改為 Fact_Sales.*_Version_Key -> Dim_*.*_Version_Key：python create_star_schema.py --tmdl 依 SCD_MODE
+# 產生 (見檔尾「Power BI 模型同步」)，模型與 SCD_MODE 不一致時建表直接中止。
+
+VALID_FROM_MIN = 19000101
+VALID_TO_MAX = 99991231
+SCD_COLS = ['Valid_From', 'Valid_To', 'Is_Current', 'Row_Hash']
+DATE_SPAN = 100_000_000      # 組合鍵 = 自然鍵序號 x DATE_SPAN + yyyymmdd
+
+def to_date_key(value):
+    """ Timestamp / 字串 / None (今天) -> yyyymmdd 整數 """
+    ts = pd.Timestamp.today() if value is None else pd.Timestamp(value)
+    return int(ts.strftime('%Y%m%d'))
+
+def shift_days(keys, days):
+    """ yyyymmdd 整數陣列加減天數 """
+    dates = pd.to_datetime(pd.Series(keys).astype(str), format='%Y%m%d') + pd.Timedelta(days=days)
+    return np.asarray(date_key(dates), dtype='int64')
+
+def latest_snapshot(df, key_cols, attr_cols, date_col='POS_ShpDate'):
+    """ [傳入維度] 每個自然鍵取「最近一筆交易」的屬性 (不是第一筆)，並附上這組屬性最後一段連續出現的起日
+    (Effective_From：晚於其他屬性組合最後出現日的最早日期)。屬性來回切換時取最近一次切換，
+    全量與增量 (只看新資料) 算出的日期相同 """
+    cols = key_cols + [c for c in attr_cols if c in df.columns]
+    if date_col in df.columns:
+        dates = date_key(df[date_col]).fillna(0).to_numpy(dtype='int64')
+    else:
+        dates = np.zeros(len(df), dtype='int64')
+    frame = pd.DataFrame({'key': surrogate_key(df, key_cols).to_numpy(), 'combo': surrogate_key(df, cols).to_numpy(),
+                          'date': dates, 'row': np.arange(len(df))}).sort_values(['key', 'date'], kind='stable')
+    latest = frame.groupby('key', sort=False).tail(1).set_index('key')
+    is_latest = frame['combo'].to_numpy() == frame['key'].map(latest['combo']).to_numpy()
+    other_seen = frame['key'].map(frame[~is_latest].groupby('key')['date'].max()).fillna(-1).to_numpy()
+    streak = frame[is_latest & (frame['date'].to_numpy() >= other_seen)]
+    latest['Effective_From'] = streak.groupby('key')['date'].min()
+    latest = latest.sort_values('row')
+    combos = to_plain(df[cols].iloc[latest['row'].to_numpy()]).reset_index(drop=True)
+    combos['Effective_From'] = latest['Effective_From'].to_numpy(dtype='int64')
+    return combos
+
+def is_scd(dim):
+    return dim is not None and all(c in dim.columns for c in SCD_COLS)
+
+def is_scd_file(path):
+    return all(c in pq.read_schema(path).names for c in SCD_COLS)
+
+def read_scd_dim(path):
+    """ 既有的 SCD 維度表；不存在或是舊版 (非 SCD) 表時回傳 None (重新開始累積歷史) """
+    if not os.path.exists(path):
+        return None
+    dim = pd.read_parquet(path)
+    return dim if is_scd(dim) else None
+
+def current_versions(dim):
+    """ 每個自然鍵的目前版本 (非 SCD 表原樣回傳) """
+    return dim[dim['Is_Current']] if 'Is_Current' in dim.columns else dim
+
+def open_versions(rows, key_col, attr_cols, version_col, valid_from):
+    rows = rows.drop(columns=['Effective_From'], errors='ignore').copy()
+    rows['Valid_From'] = np.asarray(valid_from, dtype='int64')
+    rows['Valid_To'] = VALID_TO_MAX
+    rows['Is_Current'] = True
+    rows['Row_Hash'] = surrogate_key(rows, attr_cols)
+    rows[version_col] = surrogate_key(rows, [key_col, 'Valid_From'])
+    return rows
+
+def scd2_merge(stored, incoming, key_col, attr_cols, version_col, dated_cols=None, as_of=None):
+    """ [主流程] stored: 既有版本表 (None = 第一次)；incoming: 每個自然鍵一列 (含 Effective_From)
+    dated_cols: 變動日期取自交易的屬性 (預設全部)；其餘屬性變動以 as_of 生效
+    回傳 (新版本表, {'new': 新自然鍵數, 'changed': 開新版本數, 'unchanged': 未變數}) """
+    attr_cols = [c for c in attr_cols if c in incoming.columns]
+    dated_cols = [c for c in (attr_cols if dated_cols is None else dated_cols) if c in attr_cols]
+    if 'Effective_From' not in incoming.columns:
+        incoming = incoming.assign(Effective_From=0)
+
+    if stored is None or stored.empty:
+        dim = open_versions(incoming, key_col, attr_cols, version_col, np.full(len(incoming), VALID_FROM_MIN))
+        check_unique_keys(dim, version_col, [key_col, 'Valid_From'])
+        return dim, {'new': len(dim), 'changed': 0, 'unchanged': 0}
+
+    stored = stored.reset_index(drop=True)
+    current = current_versions(stored)
+    position = pd.Series(current.index, index=current[key_col])
+    incoming = incoming.reset_index(drop=True)
+    row = incoming[key_col].map(position)          # 目前版本在 stored 中的位置 (新自然鍵為 NaN)
+    is_new = row.isna().to_numpy()
+    known = incoming[~is_new]
+    known_row = row[~is_new].astype('int64').to_numpy()
+
+    new_hash = surrogate_key(known, attr_cols).to_numpy()
+    changed = new_hash != stored['Row_Hash'].to_numpy()[known_row]
+    changed_rows = known[changed]
+    old_row = known_row[changed]
+
+    # 生效日：交易屬性有變且晚於舊版本起日 -> 首次出現日；否則 (只有帳本屬性變) -> as_of；且必須晚於舊版本起日
+    old_from = stored['Valid_From'].to_numpy()[old_row]
+    effective = changed_rows['Effective_From'].to_numpy(dtype='int64')
+    if dated_cols:
+        dated_changed = surrogate_key(changed_rows, dated_cols).to_numpy() != \
+            surrogate_key(stored.iloc[old_row], dated_cols).to_numpy()
+    else:
+        dated_changed = np.zeros(len(changed_rows), dtype=bool)
+    valid_from = np.where(dated_changed & (effective > old_from), effective, to_date_key(as_of))
+    if len(old_from):
+        valid_from = np.maximum(valid_from, shift_days(old_from, 1))
+
+    # 只改寫被關閉的舊版本，新版本接在後面
+    updated = stored.copy()
+    if len(old_row):
+        updated.loc[old_row, 'Valid_To'] = shift_days(valid_from, -1)
+        updated.loc[old_row, 'Is_Current'] = False
+    opened = open_versions(pd.concat([changed_rows, incoming[is_new]], ignore_index=True), key_col, attr_cols,
+                           version_col, np.concatenate([valid_from, np.full(int(is_new.sum()), VALID_FROM_MIN)]))
+    dim = pd.concat([updated, opened], ignore_index=True) if len(opened) else updated
+    check_unique_keys(dim, version_col, [key_col, 'Valid_From'])
+    return dim, {'new': int(is_new.sum()), 'changed': len(changed_rows), 'unchanged': int((~changed).sum())}
+
+def bind_versions(keys, date_keys, dim, key_col, version_col):
+    """ [as-of join] 每筆交易 (自然鍵 Key, DateKey) -> 當天有效的版本 Key
+    日期為空的交易對應目前版本；找不到自然鍵時為 <NA> """
+    keys = np.asarray(keys, dtype='int64')
+    if dim.empty:
+        return pd.arrays.IntegerArray(np.zeros(len(keys), dtype='int64'), np.ones(len(keys), dtype=bool))
+    dates = pd.array(date_keys, dtype='Int32').fillna(VALID_TO_MAX).to_numpy(dtype='int64')
+    versions = dim[[key_col, 'Valid_From', version_col]].sort_values([key_col, 'Valid_From'], kind='stable')
+    dim_keys = versions[key_col].to_numpy(dtype='int64')
+    uniques = np.unique(dim_keys)
+    dim_code = np.searchsorted(uniques, dim_keys)
+    code = np.minimum(np.searchsorted(uniques, keys), len(uniques) - 1)
+    found = uniques[code] == keys
+
+    boundaries = dim_code * DATE_SPAN + versions['Valid_From'].to_numpy(dtype='int64')
+    pos = np.searchsorted(boundaries, code * DATE_SPAN + dates, side='right') - 1
+    pos_safe = np.maximum(pos, 0)
+    valid = found & (pos >= 0) & (dim_code[pos_safe] == code)
+    result = versions[version_col].to_numpy(dtype='int64')[pos_safe]
+    return pd.arrays.IntegerArray(np.where(valid, result, 0), ~valid)
+
+# ==========================================
+# 📐 Power BI 模型同步
+# ==========================================
+# SCD 表的自然鍵不再唯一，Fact_Sales 仍以自然鍵關聯會變成多對多 (或 Refresh 失敗)；
+# 反過來關閉 SCD 後模型還指向版本 Key，Refresh 會找不到欄位。
+# - export_tmdl: 依 SCD 模式補上 / 移除版本欄位，並把 Fact_Sales -> Dim_Product / Dim_Customer 的關聯
+#   切到版本 Key 或自然鍵 (python create_star_schema.py --tmdl)
+# - check_model: 建表前確認 relationships.tmdl 與 SCD 模式一致，不一致就中止 (不產生對不上的 Parquet)
+
+# 自然鍵 -> (維度表, 版本 Key)
+MODEL_KEYS = {'Product_Key': ('Dim_Product', 'Product_Version_Key'),
+              'Customer_Key': ('Dim_Customer', 'Customer_Version_Key')}
+SCD_COL_KINDS = {'Valid_From': 'key', 'Valid_To': 'key', 'Is_Current': 'bool', 'Row_Hash': 'key'}
+# 表 -> {SCD 模式才有的欄位: tmdl_column kind}
+SCD_MODEL_COLS = {'Fact_Sales': {version: 'key' for _, version in MODEL_KEYS.values()},
+                  **{dim: {version: 'key', **SCD_COL_KINDS} for dim, version in MODEL_KEYS.values()}}
+
+def relationship_lines(dim, col):
+    return f"\tfromColumn: Fact_Sales.{col}\n\ttoColumn: {dim}.{col}\n"
+
+def check_model(scd, model_folder=MODEL_FOLDER):
+    """ relationships.tmdl 的 Fact_Sales 維度關聯必須與 SCD 模式相同 (沒有模型資料夾時略過) """
+    rel_path = os.path.join(model_folder, "relationships.tmdl") if model_folder else None
+    if rel_path is None or not os.path.exists(rel_path):
+        return
+    relationships = read_tmdl(rel_path)
+    for key, (dim, version) in MODEL_KEYS.items():
+        want, other = (version, key) if scd else (key, version)
+        if relationship_lines(dim, want) not in relationships or relationship_lines(dim, other) in relationships:
+            raise ValueError(f"Power BI 模型與 SCD_MODE={scd} 不符: Fact_Sales -> {dim} 應以 {want} 關聯，"
+                             f"請先執行 python create_star_schema.py --tmdl ({rel_path})")
+
+def export_tmdl(scd, model_folder=MODEL_FOLDER):
+    """ 依 SCD 模式補上 / 移除版本欄位，並切換 Fact_Sales 的維度關聯 (已是目標狀態則不變) """
+    for table, columns in SCD_MODEL_COLS.items():
+        path = os.path.join(model_folder, "tables", f"{table}.tmdl")
+        text = read_tmdl(path)
+        for col, kind in columns.items():
+            text = re.sub(rf"\tcolumn {re.escape(col)}\n(?:\t\t.*\n|\n)*", "", text)
+            if scd:
+                text = text.replace("\tpartition ", "\n".join(tmdl_column(table, col, kind)) + "\n\tpartition ", 1)
+        write_tmdl(path, text)
+
+    rel_path = os.path.join(model_folder, "relationships.tmdl")
+    relationships = read_tmdl(rel_path)
+    for key, (dim, version) in MODEL_KEYS.items():
+        old, new = (key, version) if scd else (version, key)
+        if relationship_lines(dim, old) in relationships:
+            relationships = relationships.replace(relationship_lines(dim, old), relationship_lines(dim, new))
+        elif relationship_lines(dim, new) not in relationships:
+            relationships += f"relationship {lineage_tag('Fact_Sales', new, 'relationship')}\n" \
+                             f"{relationship_lines(dim, new)}\n"
+    write_tmdl(rel_path, relationships)
+    print(f"   ✅ Power BI 模型已改為{'版本 Key (SCD)' if scd else '自然鍵'} 關聯: {model_folder}")
@@ -0,0 +1,25 @@
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# 🔑 Surrogate Key 引擎 (Hash-Based)
+# ==========================================
+# Key 由「標準化後的自然鍵」向量化 hash 而來，不依賴資料列順序：
+# - 每次重跑、增量附加，同一個客戶/產品/經銷商永遠拿到同一個 Key
+# - Fact_Sales 直接對交易列算 hash 就有 Key，不必再和維度表 merge
+# hash 使用 pandas 內建的 SipHash (固定 hash key)，object 與 category 欄位結果相同。
+# 取 63 bit 確保為正整數 (Power BI int64)。
+
+CUSTOMER_KEY_COLS = ['CustName', 'CustCity', 'CustSt', 'CustZIP']
+
+def surrogate_key(df, cols):
+    """ 自然鍵欄位 -> 穩定的 int64 Key (欄位順序固定，請勿更動) """
+    hashed = pd.util.hash_pandas_object(df[cols], index=False, categorize=True)
+    return pd.Series((hashed.to_numpy() >> np.uint64(1)).astype(np.int64), index=df.index)
+
+def check_unique_keys(dim, key_col, natural_cols):
+    """ 維度表已依自然鍵去重，Key 若重複代表 hash 碰撞 (機率極低，但寧可中止也不要錯帳) """
+    dup = dim[key_col].duplicated(keep=False)
+    if dup.any():
+        sample = dim.loc[dup, natural_cols].head(5).to_dict('records')
+        raise ValueError(f"{key_col} hash 碰撞，請檢查自然鍵: {sample}")
@@ -0,0 +1,217 @@
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+from clean_data import L2_TO_L1_MAP, L3_TO_L1_MAP
+
+# ==========================================
+# 🧪 合成 POS 資料產生器 (可重現，不含任何真實客戶)
+# ==========================================
+# 用法: python synthetic_pos.py 1000000 POS_synthetic.csv [--customers 50000 --products 3000 --seed 42]
+# 欄位與真實匯出檔 POS_all.csv 相同 (含前後空白的欄名、"$1,234.50" 金額、"1,234" 數量、M/D/YYYY 日期)，
+# 並刻意放入清洗程式要處理的髒資料：
+# - CustName 同一客戶多種拼法 (大小寫、尾端空白、INC / INC. / , Inc.、少一個字母)，部分命中硬規則關鍵字
+# - Product Group / Division 走 L2_TO_L1_MAP、L3_TO_L1_MAP 修復路徑，Division 有 'SYS' 縮寫
+# - 金額少量 'N/A' / 空值、日期少量空值、Channel District 有 Unknown
+# 先產生各維度的字串池，再以亂數索引抽樣組成每一批，大量資料也不必逐列組字串 (只有小計金額需逐列格式化)。
+
+HEADER = ['POS_ShpDate', ' DistName', 'CustName', 'CustCty', 'CustSt', 'CustZIP', 'Adj PtNo', 'PtNo',
+          'Product Line', 'Product Division', 'Product Group', 'Group Roll-UP', 'Channel District',
+          'Channel GeoGroup', 'Channel Manager', 'TerrNo', 'DIST TYPE', 'UnitCst', 'CstExt', 'UnitResale',
+          'ResExt', 'Qty']
+
+N_CUSTOMERS = 50_000
+N_PRODUCTS = 3_000
+N_DISTRIBUTORS = 12
+START_DATE = "2023-01-01"
+END_DATE = "2025-12-31"
+CHUNK_SIZE = 500_000
+
+# 髒資料比例
+VARIANT_RATE = 0.25          # 客戶名稱使用變體拼法的比例
+UNKNOWN_DISTRICT_RATE = 0.03
+BAD_MONEY_RATE = 0.002       # 'N/A' / 空值
+MISSING_DATE_RATE = 0.002
+
+NAME_WORDS = ['ACME', 'APEX', 'NOVA', 'ORBIT', 'SUMMIT', 'PIONEER', 'VECTOR', 'QUANTUM', 'TITAN', 'ATLAS',
+              'HORIZON', 'FUSION', 'MERIDIAN', 'VERTEX', 'SILVER', 'NORTHSTAR', 'BLUE RIVER', 'REDWOOD',
+              'GRANITE', 'CASCADE', 'PACIFIC', 'EAGLE', 'FALCON', 'LIBERTY', 'UNION', 'CENTURY']
+NAME_TAILS = ['SYSTEMS', 'TECHNOLOGIES', 'AUTOMATION', 'CONTROLS', 'ROBOTICS', 'MEDICAL', 'DEFENSE', 'ENERGY',
+              'SOLUTIONS', 'DYNAMICS', 'NETWORKS', 'LABS', 'MANUFACTURING', 'ELECTRONICS', 'INDUSTRIES']
+LEGAL_SUFFIXES = ['INC', 'LLC', 'CORP', 'CO', 'LTD', '']
+# 硬規則會命中的名稱 (對應 99_Config/Hard_Rules.csv)
+RULE_NAMES = ['LEIDOS', 'GDIT', 'SPACEX', 'HONEYWELL', 'UNIVERSITY OF {}', '{} COLLEGE', 'CITY OF {}',
+              'STATE OF {}', '{} HOSPITAL']
+CITIES = [('SAN JOSE', 'CA', '95131'), ('AUSTIN', 'TX', '78701'), ('BOSTON', 'MA', '02110'),
+          ('SEATTLE', 'WA', '98101'), ('DENVER', 'CO', '80202'), ('CHICAGO', 'IL', '60601'),
+          ('IRVINE', 'CA', '92618'), ('RALEIGH', 'NC', '27601'), ('PHOENIX', 'AZ', '85001'),
+          ('MUNICH', 'GERMANY', ''), ('TORONTO', 'ON', 'M5H'), ('', '', '')]
+DISTRIBUTORS = ['MOUSER', 'DIGI-KEY', 'ARROW', 'AVNET', 'FUTURE', 'NEWARK', 'TTI', 'WPG', 'RS COMPONENTS',
+                'ALLIED', 'SAGER', 'HEILIND']
+DISTRICTS = ['West', 'East', 'Central', 'South', 'Northeast']
+GEO_GROUPS = ['NA', 'EU', 'APAC']
+PRODUCT_LINES = ['EAIM', 'TERM', 'AIMB', 'SOM', 'MIO', 'UNO', 'ADAM', 'WISE', 'PPC', 'FPM']
+# 不在對照表裡的值 (修復後應為 Unknown)
+EXTRA_GROUPS = ['Other Group', '']
+EXTRA_DIVISIONS = ['SYS', 'Storage', '']
+
+def misspell(name, rng):
+    """ 刪掉中間一個字母 (模擬打錯字) """
+    if len(name) < 6:
+        return name
+    i = int(rng.integers(1, len(name) - 1))
+    return name[:i] + name[i + 1:]
+
+def name_variants(name, rng):
+    """ 同一客戶的各種拼法 (第一個是標準寫法) """
+    variants = [name, name.title(), name + " ", name.replace(" INC", " INC."), name.replace(" INC", ", Inc."),
+                misspell(name, rng)]
+    return list(dict.fromkeys(variants))
+
+def customer_name(i, rng):
+    """ 第 i 位客戶的標準名稱；每 50 位有一位命中硬規則關鍵字 """
+    if i % 50 == 0:
+        template = RULE_NAMES[(i // 50) % len(RULE_NAMES)]
+        return template.format(f"{NAME_WORDS[i % len(NAME_WORDS)]} {i}") if '{}' in template else f"{template} {i}"
+    word = NAME_WORDS[int(rng.integers(len(NAME_WORDS)))]
+    tail = NAME_TAILS[int(rng.integers(len(NAME_TAILS)))]
+    suffix = LEGAL_SUFFIXES[int(rng.integers(len(LEGAL_SUFFIXES)))]
+    return f"{word} {tail} {i} {suffix}".strip()
+
+def build_customers(n_customers, rng):
+    """ 回傳 (所有拼法攤平的名稱池, 每位客戶的城市/州/郵遞區號, 每位客戶在名稱池的 (起點, 拼法數)) """
+    pool, offsets = [], []
+    for i in range(n_customers):
+        variants = name_variants(customer_name(i, rng), rng)
+        offsets.append((len(pool), len(variants)))
+        pool.extend(variants)
+    cities = np.array(CITIES, dtype=object)[rng.integers(0, len(CITIES), n_customers)]
+    return np.array(pool, dtype=object), cities, np.array(offsets)
+
+def build_products(n_products, rng):
+    """ 每個料號固定一組產品階層與單價；約 4 成 Group Roll-UP 空白，交給清洗程式修復 """
+    groups = list(L2_TO_L1_MAP) + EXTRA_GROUPS
+    divisions = list(L3_TO_L1_MAP) + EXTRA_DIVISIONS
+    group = np.array(groups, dtype=object)[rng.integers(0, len(groups), n_products)]
+    division = np.array(divisions, dtype=object)[rng.integers(0, len(divisions), n_products)]
+    rollup = np.array([L2_TO_L1_MAP.get(g, '') for g in group], dtype=object)
+    rollup[rng.random(n_products) < 0.4] = ''
+    unit_resale = np.round(rng.lognormal(5, 1, n_products), 2)
+    unit_cost = np.round(unit_resale * rng.uniform(0.55, 0.85, n_products), 2)
+    return pd.DataFrame({
+        'Adj PtNo': [f"P{i:06d}" for i in range(n_products)],
+        'PtNo': [f"PT{i:06d}-{'A' if i % 3 else 'B'}" for i in range(n_products)],
+        'Product Line': np.array(PRODUCT_LINES, dtype=object)[rng.integers(0, len(PRODUCT_LINES), n_products)],
+        'Product Division': division,
+        'Product Group': group,
+        'Group Roll-UP': rollup,
+        'UnitResale': unit_resale,
+        'UnitCst': unit_cost,
+    })
+
+def build_distributors(n_distributors):
+    names = [DISTRIBUTORS[i % len(DISTRIBUTORS)] + (f" {i // len(DISTRIBUTORS)}" if i >= len(DISTRIBUTORS) else "")
+             for i in range(n_distributors)]
+    # 原始匯出檔的經銷商名稱常有前後空白
+    raw = [f" {n}" if i % 4 == 1 else f"{n} " if i % 4 == 2 else n for i, n in enumerate(names)]
+    return pd.DataFrame({
+        'DistName': raw,
+        'Channel Manager': [f"CM{i % 5}" for i in range(n_distributors)],
+        'TerrNo': ['INTERNATIONAL' if i % 3 == 0 else 'DOMESTIC' for i in range(n_distributors)],
+        'DIST TYPE': ['GLOBAL' if i % 2 == 0 else 'CAT' for i in range(n_distributors)],
+    })
+
+def money(values):
+    return [f"${v:,.2f}" for v in values]
+
+def make_chunk(rows, rng, customers, products, distributors, date_pool):
+    """ 產生一批 rows 筆 (字串欄位由池子抽樣，只有小計金額逐列格式化) """
+    name_pool, cities, offsets = customers
+    cust = rng.integers(0, len(offsets), rows)
+    # 客戶名稱：大部分用標準寫法，VARIANT_RATE 比例改用其他拼法
+    start, count = offsets[cust, 0], offsets[cust, 1]
+    use_variant = rng.random(rows) < VARIANT_RATE
+    variant = np.where(use_variant, rng.integers(0, 1 << 30, rows) % count, 0)
+    names = name_pool[start + variant]
+    city = cities[cust]
+
+    prod = rng.integers(0, len(products), rows)
+    p = products.iloc[prod].reset_index(drop=True)
+    dist = distributors.iloc[rng.integers(0, len(distributors), rows)].reset_index(drop=True)
+
+    qty = rng.integers(1, 5_000, rows)
+    res_ext = p['UnitResale'].to_numpy() * qty
+    cst_ext = p['UnitCst'].to_numpy() * qty
+
+    dates = date_pool[rng.integers(0, len(date_pool), rows)]
+    dates[rng.random(rows) < MISSING_DATE_RATE] = ''
+    district = np.array(DISTRICTS, dtype=object)[rng.integers(0, len(DISTRICTS), rows)]
+    district[rng.random(rows) < UNKNOWN_DISTRICT_RATE] = 'Unknown'
+
+    chunk = pd.DataFrame({
+        'POS_ShpDate': dates,
+        ' DistName': dist['DistName'],
+        'CustName': names,
+        'CustCty': city[:, 0],
+        'CustSt': city[:, 1],
+        'CustZIP': city[:, 2],
+        'Adj PtNo': p['Adj PtNo'],
+        'PtNo': p['PtNo'],
+        'Product Line': p['Product Line'],
+        'Product Division': p['Product Division'],
+        'Product Group': p['Product Group'],
+        'Group Roll-UP': p['Group Roll-UP'],
+        'Channel District': district,
+        'Channel GeoGroup': np.array(GEO_GROUPS, dtype=object)[rng.integers(0, len(GEO_GROUPS), rows)],
+        'Channel Manager': dist['Channel Manager'],
+        'TerrNo': dist['TerrNo'],
+        'DIST TYPE': dist['DIST TYPE'],
+        'UnitCst': money(p['UnitCst']),
+        'CstExt': money(cst_ext),
+        'UnitResale': money(p['UnitResale']),
+        'ResExt': money(res_ext),
+        'Qty': [f"{q:,}" for q in qty],
+    })
+    for col in ['UnitCst', 'CstExt', 'UnitResale', 'ResExt']:
+        bad = np.flatnonzero(rng.random(rows) < BAD_MONEY_RATE)
+        chunk.loc[bad[::2], col] = 'N/A'
+        chunk.loc[bad[1::2], col] = ''
+    return chunk[HEADER]
+
+def generate_pos(rows, output_path, seed=42, n_customers=N_CUSTOMERS, n_products=N_PRODUCTS,
+                 n_distributors=N_DISTRIBUTORS, start_date=START_DATE, end_date=END_DATE, chunk_size=CHUNK_SIZE):
+    """ [主流程] 分批寫出 rows 筆合成 POS CSV；同一組參數與 seed 產生的檔案完全相同 """
+    print(f"🧪 [合成 POS] {rows:,} 筆 (客戶 {n_customers:,} / 料號 {n_products:,} / 經銷商 {n_distributors}, seed={seed})")
+    t0 = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    customers = build_customers(n_customers, rng)
+    products = build_products(n_products, rng)
+    distributors = build_distributors(n_distributors)
+    days = pd.date_range(start_date, end_date, freq='D')
+    date_pool = np.array([f"{d.month}/{d.day}/{d.year}" for d in days], dtype=object)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    tmp_path = output_path + ".tmp"
+    written = 0
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+        f.write(",".join(HEADER) + "\n")
+        while written < rows:
+            n = min(chunk_size, rows - written)
+            make_chunk(n, rng, customers, products, distributors, date_pool).to_csv(f, header=False, index=False)
+            written += n
+            print(f"     已產生 {written:,} 筆")
+    os.replace(tmp_path, output_path)
+    print(f"   ✅ 完成 ({time.perf_counter() - t0:.1f}s): {output_path}")
+    return output_path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="產生合成 POS 匯出檔 (CSV)")
+    parser.add_argument('rows', type=int)
+    parser.add_argument('output')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--customers', type=int, default=N_CUSTOMERS)
+    parser.add_argument('--products', type=int, default=N_PRODUCTS)
+    parser.add_argument('--distributors', type=int, default=N_DISTRIBUTORS)
+    args = parser.parse_args()
+    generate_pos(args.rows, args.output, args.seed, args.customers, args.products, args.distributors)
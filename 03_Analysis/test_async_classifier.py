@@ -0,0 +1,72 @@
+import asyncio
+import pytest
+import async_classifier
+from async_classifier import RateLimitError, TokenBucket, classify_batches
+
+# ==========================================
+# 🧪 非同步分類：重試、失敗批次、回呼
+# ==========================================
+# 假 client 依劇本對每個批次先拋例外、再成功；退避時間設為 0，速率設很高，不用真的等。
+# 執行: python -m pytest -q 03_Analysis
+
+FAST_RPM = 600_000
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(async_classifier, 'backoff_delay', lambda attempt: 0)
+
+class ScriptedClient:
+    """ 假 async client：script[批次第一個名稱] 是依序要拋的例外，拋完才成功 """
+
+    def __init__(self, script):
+        self.script = {key: list(errors) for key, errors in script.items()}
+        self.calls = {}
+
+    async def __call__(self, names_list):
+        key = names_list[0]
+        self.calls[key] = self.calls.get(key, 0) + 1
+        errors = self.script.get(key, [])
+        if errors:
+            raise errors.pop(0)
+        return {name: {'Category': 'OEM', 'Group': name.upper()} for name in names_list}
+
+def run(batches, client, **options):
+    results, calls = [], []
+    out = asyncio.run(classify_batches(batches, client, rate_per_min=FAST_RPM,
+                                       on_result=lambda batch, result: results.append(batch),
+                                       on_call=lambda latency, error: calls.append(error), **options))
+    return out, results, calls
+
+def test_retries_until_success():
+    client = ScriptedClient({'a': [RateLimitError('429'), ValueError('bad json')]})
+    out, results, calls = run([['a', 'b']], client, max_retries=3)
+    assert client.calls == {'a': 3}
+    assert out == [{'a': {'Category': 'OEM', 'Group': 'A'}, 'b': {'Category': 'OEM', 'Group': 'B'}}]
+    assert results == [['a', 'b']]
+    assert calls == ['rate_limit', 'ValueError', None]
+
+def test_failed_batch_returns_none_and_skips_on_result():
+    client = ScriptedClient({'x': [RateLimitError('429')] * 3, 'y': [TimeoutError()]})
+    out, results, calls = run([['x'], ['y'], ['z']], client, max_retries=2)
+    assert client.calls == {'x': 3, 'y': 2, 'z': 1}
+    assert out[0] is None
+    assert out[1] == {'y': {'Category': 'OEM', 'Group': 'Y'}}
+    assert out[2] == {'z': {'Category': 'OEM', 'Group': 'Z'}}
+    assert sorted(results) == [['y'], ['z']]
+    assert calls.count('rate_limit') == 3 and calls.count('TimeoutError') == 1 and calls.count(None) == 2
+
+def test_custom_rate_limit_errors():
+    """ 自訂 rate_limit_errors 內的例外 (例如 Gemini 的 ResourceExhausted) 視為 429 並降速 """
+    client = ScriptedClient({'a': [KeyError('quota')]})
+    out, _, calls = run([['a']], client, max_retries=1, rate_limit_errors=(KeyError,))
+    assert out[0] is not None
+    assert calls == ['rate_limit', None]
+
+def test_bucket_slows_down_and_recovers():
+    bucket = TokenBucket(60)
+    for _ in range(5):
+        bucket.slow_down()
+    assert bucket.rate == pytest.approx(bucket.max_rate / 8)
+    for _ in range(100):
+        bucket.speed_up()
+    assert bucket.rate == pytest.approx(bucket.max_rate)
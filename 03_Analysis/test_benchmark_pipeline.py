@@ -0,0 +1,88 @@
+import json
+import os
+import pytest
+import benchmark_pipeline
+from benchmark_pipeline import check_regression
+
+# ==========================================
+# 🧪 效能基準：退步判斷與輸出位置
+# ==========================================
+# 執行: python -m pytest -q 03_Analysis
+
+MB = 1024 ** 2
+BASE = {'wall_sec': 10.0, 'cpu_sec': 9.0, 'peak_rss_bytes': 1000 * MB}
+
+def result(wall_sec=10.0, peak_mb=1000):
+    return {'wall_sec': wall_sec, 'cpu_sec': wall_sec, 'peak_rss_bytes': peak_mb * MB}
+
+def test_within_threshold_passes():
+    assert check_regression(result(11.9, 1190), BASE, threshold=0.2) == []
+
+def test_slower_than_threshold_fails():
+    problems = check_regression(result(12.5), BASE, threshold=0.2)
+    assert len(problems) == 1 and problems[0].startswith('時間')
+
+def test_more_memory_than_threshold_fails():
+    problems = check_regression(result(peak_mb=1300), BASE, threshold=0.2)
+    assert len(problems) == 1 and problems[0].startswith('記憶體')
+
+def test_both_regressions_reported():
+    assert len(check_regression(result(20.0, 2000), BASE, threshold=0.2)) == 2
+
+def test_short_baseline_ignores_time():
+    """ 基準低於 MIN_SECONDS 的階段時間雜訊太大，只比記憶體 """
+    short = {**BASE, 'wall_sec': 0.2}
+    assert check_regression(result(0.9), short, threshold=0.2, min_seconds=1.0) == []
+
+def test_missing_rss_ignores_memory():
+    """ 無法取得 peak RSS (Windows) 時不比記憶體 """
+    assert check_regression({**result(), 'peak_rss_bytes': None}, BASE) == []
+    assert check_regression(result(peak_mb=5000), {**BASE, 'peak_rss_bytes': None}) == []
+
+@pytest.mark.parametrize('faster', [True, False])
+def test_run_benchmark_outputs_stay_in_bench_folder(tmp_path, monkeypatch, faster):
+    """ 與基準比較後回傳是否通過，results.jsonl 寫在 bench_folder 並標記退步 """
+    def fake_stage(stage, csv_path, paths):
+        return result(5.0 if faster else 30.0)
+    monkeypatch.setattr(benchmark_pipeline, 'run_stage', fake_stage)
+    monkeypatch.setattr(benchmark_pipeline, 'ProcessPoolExecutor', InlineExecutor)
+    monkeypatch.setattr(benchmark_pipeline, 'generate_pos', fake_generate_pos)
+    (tmp_path / 'baseline.json').write_text(json.dumps({'100:clean_data': BASE}))
+
+    ok = benchmark_pipeline.run_benchmark([100], stages=['clean_data'], bench_folder=str(tmp_path))
+    assert ok is faster
+    records = [json.loads(line) for line in (tmp_path / 'results.jsonl').read_text().splitlines()]
+    assert [bool(r['regression']) for r in records] == [not faster]
+
+def test_stage_metrics_go_to_bench_folder(tmp_path, monkeypatch):
+    import clean_data
+    import etl_metrics
+    monkeypatch.setattr(etl_metrics, 'METRICS_FOLDER', etl_metrics.METRICS_FOLDER)
+    monkeypatch.setattr(etl_metrics, 'PROMETHEUS_FOLDER', etl_metrics.PROMETHEUS_FOLDER)
+    monkeypatch.setattr(clean_data, 'MetricsRun', clean_data.MetricsRun)
+    paths = benchmark_pipeline.bench_paths(100, str(tmp_path))
+    benchmark_pipeline.use_bench_metrics(clean_data, paths)
+    run = clean_data.MetricsRun('clean_data')
+    assert run.metrics_folder == paths['metrics'] and run.prometheus_folder is None
+    assert paths['metrics'].startswith(str(tmp_path))
+
+def fake_generate_pos(rows, path, *args):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'w').close()
+
+class InlineExecutor:
+    """ 取代 spawn 子行程，在測試行程內直接執行 """
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def submit(self, fn, *args):
+        from concurrent.futures import Future
+        future = Future()
+        future.set_result(fn(*args))
+        return future
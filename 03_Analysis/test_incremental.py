@@ -0,0 +1,183 @@
+import functools
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+import clean_data
+import create_star_schema
+import etl_metrics
+import pmf_analysis
+import quality_rules
+import rfm_analysis
+from etl_state import read_row_groups_from
+from synthetic_pos import generate_pos
+
+# ==========================================
+# 🧪 增量 vs 全量：結果必須相同
+# ==========================================
+# 合成 POS 依日期排序後切成 v1 (前 70%) / v2 (v1 + 檔尾附加)，v1 的最後一天在 v2 還有新列 (同日邊界)，
+# 附加段另含日期為空與日期較舊的補登列。增量 (v1 -> v2) 與全量 (v2) 比對：
+# 預設規則 (日期為空的列保留在 Fact_Sales) 與嚴格規則 (日期為空的列移到隔離區) 各跑一次；
+# POS_Cleaned / POS_Quarantine 逐列相同；所有 Dim_* / Agg_* 相同；
+# Fact_Sales 內容相同但不比列順序 (增量的新交易是接在檔尾的新 row group，只在新資料內排序，
+# 全量則整個檔依月份重排；RFM / PMF 的增量依賴這個附加順序，所以不重排舊資料)。
+# 執行: python -m pytest -q 03_Analysis
+
+ROWS = 6_000
+CHUNK_SIZE = 1_000
+DIMS = ['Dim_Product', 'Dim_Distributor', 'Dim_Customer', 'Dim_Date']
+AGGS = ['Agg_Sales_Month_Product_Group', 'Agg_Sales_Month_Distributor', 'Agg_Sales_Quarter_Parent_Group']
+
+@pytest.fixture(autouse=True)
+def no_metrics(monkeypatch):
+    """ 測試不寫 02_ProcessedData/_metrics """
+    quiet = functools.partial(etl_metrics.MetricsRun, enabled=False)
+    monkeypatch.setattr(clean_data, 'MetricsRun', quiet)
+    monkeypatch.setattr(create_star_schema, 'MetricsRun', quiet)
+
+@pytest.fixture(scope='module')
+def exports(tmp_path_factory):
+    """ (v1 列, 附加列)：字串 DataFrame，附加段含同日邊界列、日期為空與補登列 """
+    folder = tmp_path_factory.mktemp('raw')
+    raw = pd.read_csv(generate_pos(ROWS, str(folder / 'POS.csv'), seed=7, n_customers=400, n_products=150),
+                      dtype=str, keep_default_na=False)
+    dates = pd.to_datetime(raw['POS_ShpDate'], format='%m/%d/%Y', errors='coerce')
+    raw = raw.iloc[np.argsort(dates.to_numpy(), kind='stable')].reset_index(drop=True)
+    dates = dates.sort_values(kind='stable').reset_index(drop=True)
+
+    # 切點落在某一天的中間：v1 的最後一天在附加段還有資料
+    cut = int(len(raw) * 0.7)
+    while dates[cut - 1] != dates[cut]:
+        cut += 1
+    old, new = raw.iloc[:cut], raw.iloc[cut:].copy()
+    assert dates[cut - 1] == dates[cut]
+
+    new.iloc[:5, new.columns.get_loc('POS_ShpDate')] = ''              # 日期為空
+    late = old.iloc[::97].copy()                                       # 日期早於 v1 最後一天的補登
+    late['CustName'] = late['CustName'] + ' LATE'
+    return old, pd.concat([new, late], ignore_index=True)
+
+@pytest.fixture(params=['default', 'strict'])
+def rules_file(request, tmp_path):
+    """ 預設規則表，或把 SHIPDATE_MISSING 改成 quarantine 的嚴格版 (增量時隔離區也要正確附加) """
+    if request.param == 'default':
+        return quality_rules.QUALITY_RULES_FILE
+    rules = pd.read_csv(quality_rules.QUALITY_RULES_FILE, dtype=str, keep_default_na=False)
+    rules.loc[rules['Rule_Code'] == 'SHIPDATE_MISSING', 'Action'] = 'quarantine'
+    path = tmp_path / 'Quality_Rules_strict.csv'
+    rules.to_csv(path, index=False)
+    return str(path)
+
+def write_export(path, parts):
+    """ 先寫 v1，再以附加方式寫入後續段落 (前段位元組與上一版完全相同) """
+    parts[0].to_csv(path, index=False)
+    for part in parts[1:]:
+        part.to_csv(path, index=False, header=False, mode='a')
+
+def build(source, folder, incremental, star_incremental=None, **clean_options):
+    """ star_incremental: None = 同 incremental (False 可模擬增量清洗後又全量建表) """
+    clean_data.clean_and_transform(str(source), str(folder), stream=True, chunk_size=CHUNK_SIZE,
+                                   incremental=incremental, **clean_options)
+    create_star_schema.create_star_schema(str(folder / clean_data.OUTPUT_FILE), str(folder / 'BI'),
+                                          str(folder / 'no_mapping.xlsx'), str(folder / 'ledger.parquet'),
+                                          incremental=incremental if star_incremental is None else star_incremental,
+                                          fact_layout='file')
+
+def run_analysis(folder):
+    rfm_analysis.run_rfm(bi_folder=str(folder / 'BI'))
+    pmf_analysis.run_pmf(bi_folder=str(folder / 'BI'))
+
+def read_table(folder, name, unordered=False):
+    df = pd.read_parquet(folder / f"{name}.parquet")
+    if unordered:
+        df = df.sort_values(list(df.columns), kind='stable').reset_index(drop=True)
+    return df
+
+def assert_same_outputs(inc, full):
+    for name in ['POS_Cleaned', 'POS_Quarantine']:
+        pd.testing.assert_frame_equal(read_table(inc, name), read_table(full, name))
+    for name in DIMS + AGGS:
+        pd.testing.assert_frame_equal(read_table(inc / 'BI', name), read_table(full / 'BI', name))
+    pd.testing.assert_frame_equal(read_table(inc / 'BI', 'Fact_Sales', unordered=True),
+                                  read_table(full / 'BI', 'Fact_Sales', unordered=True))
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_incremental_matches_full(tmp_path, exports, rules_file, parallel):
+    old, appended = exports
+    options = {'parallel': parallel, 'max_workers': 2, 'quality_rules_file': rules_file}
+
+    source = tmp_path / 'inc' / 'POS_all.csv'
+    source.parent.mkdir()
+    write_export(source, [old])
+    build(source, tmp_path / 'inc', incremental=True, **options)
+    first_id = clean_data.load_state(str(tmp_path / 'inc' / clean_data.STATE_FILE))['build_id']
+    write_export(source, [old, appended])
+    build(source, tmp_path / 'inc', incremental=True, **options)
+    # 真的走增量 (沒有退回全量重建)
+    assert clean_data.load_state(str(tmp_path / 'inc' / clean_data.STATE_FILE))['build_id'] == first_id
+
+    full_source = tmp_path / 'full' / 'POS_all.csv'
+    full_source.parent.mkdir()
+    write_export(full_source, [old, appended])
+    build(full_source, tmp_path / 'full', incremental=False, quality_rules_file=rules_file)
+
+    assert_same_outputs(tmp_path / 'inc', tmp_path / 'full')
+    if rules_file != quality_rules.QUALITY_RULES_FILE:
+        assert len(read_table(tmp_path / 'inc', 'POS_Quarantine')) >= 5
+    assert len(read_table(tmp_path / 'inc', 'POS_Cleaned')) + len(read_table(tmp_path / 'inc', 'POS_Quarantine')) \
+        == len(old) + len(appended)
+
+def test_rewritten_prefix_rebuilds(tmp_path, exports):
+    """ 舊資料被改動 (不是只在檔尾附加) 時，增量模式必須改為全量重建 """
+    old, appended = exports
+    source = tmp_path / 'inc' / 'POS_all.csv'
+    source.parent.mkdir()
+    write_export(source, [old])
+    build(source, tmp_path / 'inc', incremental=True)
+    first_id = clean_data.load_state(str(tmp_path / 'inc' / clean_data.STATE_FILE))['build_id']
+
+    edited = old.copy()
+    edited.iloc[0, edited.columns.get_loc('CustName')] = 'EDITED CUSTOMER'
+    write_export(source, [edited, appended])
+    build(source, tmp_path / 'inc', incremental=True)
+    assert clean_data.load_state(str(tmp_path / 'inc' / clean_data.STATE_FILE))['build_id'] != first_id
+
+    full_source = tmp_path / 'full' / 'POS_all.csv'
+    full_source.parent.mkdir()
+    write_export(full_source, [edited, appended])
+    build(full_source, tmp_path / 'full', incremental=False)
+    assert_same_outputs(tmp_path / 'inc', tmp_path / 'full')
+
+def test_full_star_rebuild_resets_analysis_base(tmp_path, exports):
+    """ 增量清洗後全量重建 Fact_Sales (依月份重排)：RFM / PMF 不可再用「第 N 列之後是新資料」接續 """
+    old, _ = exports
+    source = tmp_path / 'inc' / 'POS_all.csv'
+    source.parent.mkdir()
+    write_export(source, [old])
+    build(source, tmp_path / 'inc', incremental=True)
+    run_analysis(tmp_path / 'inc')
+
+    # 補登筆數 = 最後一個 row group 的筆數，且日期在最早的月份：重排後舊筆數恰好落在 row group 邊界，
+    # 只看邊界會把最後一個月的舊交易當成新資料
+    fact_file = tmp_path / 'inc' / 'BI' / 'Fact_Sales.parquet'
+    meta = pq.ParquetFile(fact_file).metadata
+    old_rows, last_group = meta.num_rows, meta.row_group(meta.num_row_groups - 1).num_rows
+    dates = pd.to_datetime(old['POS_ShpDate'], format='%m/%d/%Y', errors='coerce')
+    first_month = old[dates.dt.to_period('M') == dates.min().to_period('M')]
+    late = first_month.sample(last_group, replace=True, random_state=1).copy()
+    late['CustName'] = late['CustName'] + ' REBUILD'
+
+    write_export(source, [old, late])
+    build(source, tmp_path / 'inc', incremental=True, star_incremental=False)
+    assert read_row_groups_from(str(fact_file), old_rows) is not None
+    run_analysis(tmp_path / 'inc')
+
+    full_source = tmp_path / 'full' / 'POS_all.csv'
+    full_source.parent.mkdir()
+    write_export(full_source, [old, late])
+    build(full_source, tmp_path / 'full', incremental=False)
+    run_analysis(tmp_path / 'full')
+
+    for name in ['Fact_RFM', 'Fact_RFM_Group', 'Fact_PMF_Cohort', 'Fact_PMF_Repeat', 'Fact_PMF_Affinity']:
+        pd.testing.assert_frame_equal(read_table(tmp_path / 'inc' / 'BI', name, unordered=True),
+                                      read_table(tmp_path / 'full' / 'BI', name, unordered=True))
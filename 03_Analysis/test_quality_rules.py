@@ -0,0 +1,58 @@
+import functools
+import pandas as pd
+import pytest
+import clean_data
+import etl_metrics
+import quality_rules
+from synthetic_pos import generate_pos
+
+# ==========================================
+# 🧪 品質規則：預設規則不改變清洗結果
+# ==========================================
+# 預設規則全部為 warn：含無法解析金額 / 數量、負數量、日期為空的列時，POS_Cleaned 仍與關閉品質規則逐列相同，
+# 改成 quarantine 的規則才會把列移到 POS_Quarantine。
+# 執行: python -m pytest -q 03_Analysis
+
+@pytest.fixture(autouse=True)
+def no_metrics(monkeypatch):
+    monkeypatch.setattr(clean_data, 'MetricsRun', functools.partial(etl_metrics.MetricsRun, enabled=False))
+
+@pytest.fixture(scope='module')
+def dirty_export(tmp_path_factory):
+    """ 合成 POS，前幾列塞入各規則會命中的值 """
+    path = tmp_path_factory.mktemp('raw') / 'POS.csv'
+    raw = pd.read_csv(generate_pos(500, str(path), seed=3), dtype=str, keep_default_na=False)
+    raw.loc[0, ['ResExt', 'Qty']] = ['N/A', 'abc']      # NO_MEASURE
+    raw.loc[1, 'ResExt'] = '#VALUE!'                    # RESEXT_UNPARSABLE
+    raw.loc[2, 'Qty'] = '-4'                            # QTY_NEGATIVE
+    raw.loc[3, 'POS_ShpDate'] = ''                      # SHIPDATE_MISSING
+    raw.to_csv(path, index=False)
+    return path
+
+def clean(source, folder, **options):
+    clean_data.clean_and_transform(str(source), str(folder), stream=True, chunk_size=200, **options)
+    return pd.read_parquet(folder / clean_data.OUTPUT_FILE)
+
+def test_default_rules_match_baseline(tmp_path, dirty_export):
+    baseline = clean(dirty_export, tmp_path / 'off', quality=False)
+    checked = clean(dirty_export, tmp_path / 'on', quality=True)
+    pd.testing.assert_frame_equal(checked, baseline)
+    assert len(baseline) == 500
+    assert pd.read_parquet(tmp_path / 'on' / quality_rules.QUARANTINE_FILE).empty
+
+    metrics = pd.read_parquet(tmp_path / 'on' / quality_rules.QUALITY_METRICS_FILE).set_index('Rule_Code')
+    assert set(metrics['Action']) == {'warn'}
+    for code in ['NO_MEASURE', 'RESEXT_UNPARSABLE', 'QTY_NEGATIVE', 'SHIPDATE_MISSING']:
+        assert metrics.loc[code, 'Failed_Rows'] >= 1
+
+def test_quarantine_rule_moves_rows(tmp_path, dirty_export):
+    rules = pd.read_csv(quality_rules.QUALITY_RULES_FILE, dtype=str, keep_default_na=False)
+    rules.loc[rules['Rule_Code'] == 'NO_MEASURE', 'Action'] = 'quarantine'
+    rules_file = tmp_path / 'rules.csv'
+    rules.to_csv(rules_file, index=False)
+
+    cleaned = clean(dirty_export, tmp_path / 'strict', quality_rules_file=str(rules_file))
+    quarantine = pd.read_parquet(tmp_path / 'strict' / quality_rules.QUARANTINE_FILE)
+    assert len(cleaned) == 499
+    assert quarantine['Reason_Code'].tolist() == ['NO_MEASURE']
+    assert quarantine['Source_Row'].tolist() == [2]
@@ -0,0 +1,162 @@
+import functools
+import shutil
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pytest
+import clean_data
+import create_star_schema
+import etl_metrics
+import scd2
+from aggregations import MODEL_FOLDER
+from scd2 import VALID_FROM_MIN, VALID_TO_MAX, scd2_merge, bind_versions, is_scd_file
+from synthetic_pos import generate_pos
+
+# ==========================================
+# 🧪 SCD Type 2：版本切分、as-of 對應、增量模式切換
+# ==========================================
+# 單元: 屬性變動開新版本 (交易日期 / 帳本 as_of 生效)、bind_versions 依出貨日對應版本
+# 流程: 增量附加的交易換了產品群 -> Dim_Product 開新版本，Fact_Sales 依日期對應新舊版本；
+#       既有表格式與 SCD 模式不同時增量改為全量重建；Power BI 模型與 SCD 模式同步 / 不一致時中止。
+# 執行: python -m pytest -q 03_Analysis
+
+ROWS = 2_000
+CHUNK_SIZE = 500
+
+@pytest.fixture(autouse=True)
+def no_metrics(monkeypatch):
+    quiet = functools.partial(etl_metrics.MetricsRun, enabled=False)
+    monkeypatch.setattr(clean_data, 'MetricsRun', quiet)
+    monkeypatch.setattr(create_star_schema, 'MetricsRun', quiet)
+
+def products(groups, effective=20240101):
+    return pd.DataFrame({'Product_Key': np.arange(1, len(groups) + 1, dtype='int64'), 'Product Group': groups,
+                         'Effective_From': effective})
+
+def merge(stored, incoming, **options):
+    return scd2_merge(stored, incoming, 'Product_Key', ['Product Group'], 'Product_Version_Key', **options)
+
+def versions(dim, key):
+    return dim[dim['Product_Key'] == key].sort_values('Valid_From').reset_index(drop=True)
+
+def test_attribute_change_opens_version():
+    first, stats = merge(None, products(['A', 'B']))
+    assert stats == {'new': 2, 'changed': 0, 'unchanged': 0}
+    assert (first['Valid_From'] == VALID_FROM_MIN).all() and first['Is_Current'].all()
+
+    dim, stats = merge(first, products(['C', 'B'], effective=20240315))
+    assert stats == {'new': 0, 'changed': 1, 'unchanged': 1}
+    changed = versions(dim, 1)
+    assert changed['Product Group'].tolist() == ['A', 'C']
+    assert changed['Valid_From'].tolist() == [VALID_FROM_MIN, 20240315]
+    assert changed['Valid_To'].tolist() == [20240314, VALID_TO_MAX]
+    assert changed['Is_Current'].tolist() == [False, True]
+    assert changed['Product_Version_Key'].is_unique
+    # 沒變的版本原封不動
+    pd.testing.assert_frame_equal(versions(dim, 2), versions(first, 2))
+
+def test_undated_change_uses_as_of():
+    """ 帳本類屬性沒有交易日期：以 as_of 生效，舊交易維持舊版本 """
+    first, _ = merge(None, products(['A']))
+    dim, _ = merge(first, products(['B'], effective=20230101), dated_cols=[], as_of='2024-06-01')
+    assert versions(dim, 1)['Valid_From'].tolist() == [VALID_FROM_MIN, 20240601]
+
+def test_bind_versions_as_of():
+    first, _ = merge(None, products(['A', 'B']))
+    dim, _ = merge(first, products(['C', 'B'], effective=20240315))
+    old, new = versions(dim, 1)['Product_Version_Key']
+    other = versions(dim, 2)['Product_Version_Key'][0]
+
+    keys = [1, 1, 1, 2, 1, 99]
+    dates = pd.array([20240314, 20240315, 20250101, 20240101, None, 20240101], dtype='Int32')
+    bound = bind_versions(keys, dates, dim, 'Product_Key', 'Product_Version_Key')
+    assert bound[:5].tolist() == [old, new, new, other, new]      # 日期為空 -> 目前版本
+    assert bound[5] is pd.NA                                      # 不存在的自然鍵
+
+@pytest.fixture(scope='module')
+def export(tmp_path_factory):
+    """ 依日期排序的合成 POS 與切點 (v1 = 前 70%) """
+    path = tmp_path_factory.mktemp('raw') / 'POS.csv'
+    raw = pd.read_csv(generate_pos(ROWS, str(path), seed=11, n_customers=200, n_products=40),
+                      dtype=str, keep_default_na=False)
+    dates = pd.to_datetime(raw['POS_ShpDate'], format='%m/%d/%Y', errors='coerce')
+    raw = raw.iloc[np.argsort(dates.to_numpy(), kind='stable')].reset_index(drop=True)
+    return raw, int(len(raw) * 0.7)
+
+def build(source, folder, incremental, scd, model_folder=None):
+    clean_data.clean_and_transform(str(source), str(folder), stream=True, chunk_size=CHUNK_SIZE, incremental=True)
+    create_star_schema.create_star_schema(str(folder / clean_data.OUTPUT_FILE), str(folder / 'BI'),
+                                          str(folder / 'no_mapping.xlsx'), str(folder / 'ledger.parquet'),
+                                          incremental=incremental, fact_layout='file', scd=scd,
+                                          model_folder=model_folder)
+
+def write_export(path, parts):
+    parts[0].to_csv(path, index=False)
+    for part in parts[1:]:
+        part.to_csv(path, index=False, header=False, mode='a')
+
+def test_incremental_change_binds_facts_to_versions(tmp_path, export):
+    raw, cut = export
+    old, new = raw.iloc[:cut], raw.iloc[cut:].copy()
+    product = new['Adj PtNo'].value_counts().index[0]
+    new.loc[new['Adj PtNo'] == product, 'Product Group'] = 'MOVED GROUP'
+
+    source = tmp_path / 'POS_all.csv'
+    write_export(source, [old])
+    build(source, tmp_path, incremental=True, scd=True)
+    write_export(source, [old, new])
+    build(source, tmp_path, incremental=True, scd=True)
+
+    dim = pd.read_parquet(tmp_path / 'BI' / 'Dim_Product.parquet')
+    history = dim[dim['AdjPtNo'] == product.strip().upper()].sort_values('Valid_From')
+    assert history['Product Group'].tolist()[-1] == 'MOVED GROUP'
+    assert len(history) == 2 and history['Is_Current'].tolist() == [False, True]
+
+    fact = pd.read_parquet(tmp_path / 'BI' / 'Fact_Sales.parquet')
+    fact = fact[fact['Product_Key'] == history['Product_Key'].iloc[0]]
+    bound = fact.merge(history, on='Product_Version_Key', validate='many_to_one')
+    assert bound['DateKey'].between(bound['Valid_From'], bound['Valid_To']).all()
+    assert set(bound['Product Group']) == {history['Product Group'].iloc[0], 'MOVED GROUP'}
+
+@pytest.mark.parametrize('scd', [True, False])
+def test_incremental_switches_layout_with_full_rebuild(tmp_path, export, scd):
+    """ 既有表不是目前模式的格式 (is_scd_file 不符) 時，即使沒有新資料也要全量重建 """
+    raw, _ = export
+    source = tmp_path / 'POS_all.csv'
+    write_export(source, [raw])
+    build(source, tmp_path, incremental=True, scd=not scd)
+    build(source, tmp_path, incremental=True, scd=scd)
+
+    for name in ['Dim_Product', 'Dim_Customer']:
+        assert is_scd_file(tmp_path / 'BI' / f'{name}.parquet') is scd
+    fact = pd.read_parquet(tmp_path / 'BI' / 'Fact_Sales.parquet')
+    assert ('Product_Version_Key' in fact.columns) is scd
+    if scd:
+        assert fact['Product_Version_Key'].notna().all() and fact['Customer_Version_Key'].notna().all()
+
+def test_model_must_match_scd_mode(tmp_path, export):
+    raw, _ = export
+    model = tmp_path / 'model'
+    shutil.copytree(MODEL_FOLDER, model)
+    source = tmp_path / 'POS_all.csv'
+    write_export(source, [raw])
+
+    with pytest.raises(ValueError, match='SCD_MODE'):
+        build(source, tmp_path, incremental=False, scd=True, model_folder=str(model))
+    assert not (tmp_path / 'BI' / 'Fact_Sales.parquet').exists()
+
+    scd2.export_tmdl(True, str(model))
+    build(source, tmp_path, incremental=False, scd=True, model_folder=str(model))
+    relationships = scd2.read_tmdl(str(model / 'relationships.tmdl'))
+    assert 'fromColumn: Fact_Sales.Product_Version_Key\n\ttoColumn: Dim_Product.Product_Version_Key' in relationships
+    assert 'fromColumn: Fact_Sales.Product_Key\n' not in relationships
+    # 模型宣告的欄位都在 Parquet 裡
+    for table, columns in scd2.SCD_MODEL_COLS.items():
+        text = scd2.read_tmdl(str(model / 'tables' / f'{table}.tmdl'))
+        names = pd.read_parquet(tmp_path / 'BI' / f'{table}.parquet').columns
+        assert all(f"\tcolumn {col}\n" in text and col in names for col in columns)
+
+    # 關閉 SCD 後模型還原成原本的檔案
+    scd2.export_tmdl(False, str(model))
+    for path in model.rglob('*.tmdl'):
+        assert path.read_bytes() == (Path(MODEL_FOLDER) / path.relative_to(model)).read_bytes()